@@ -2,6 +2,7 @@
 
 import sys
 import time
+import signal
 import hashlib
 import mimetypes
 import os
@@ -10,17 +11,40 @@ import threading
 import subprocess
 import tempfile
 import pprint
+import json
+import heapq
+import itertools
+import concurrent.futures
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import requests
 from flask import Flask, Response, redirect, url_for, render_template, jsonify, request, \
-    send_from_directory, abort, after_this_request
+    send_from_directory, abort, after_this_request, stream_with_context
 from flask.json import JSONEncoder
 from .flask_reverse_proxy import ReverseProxied
 import six
-from six.moves.urllib.parse import urlparse
+from six.moves.urllib.parse import urlparse, quote as url_quote
 from werkzeug.utils import secure_filename
-from .filedb import FileDB, FileEntry
+from werkzeug.exceptions import RequestEntityTooLarge
+from .filedb import FILEDB_BACKENDS, EVICTION_POLICIES
 from .crossdomain import crossdomain
+from .scheduler import Scheduler, QueueFullError
+from .hashing import hash_file, new_hasher, HASH_ALGORITHMS
+from .compression import compress_file, CONTENT_ENCODINGS
+from .taskstore import TaskStore, process_alive
+from .converters import Converter, ConverterRegistry, ConversionStep
+from .assimp_pool import AssimpWorkerPool, AssimpWorkerError
+from .formats import FormatDetector, read_head
 
 mimetypes.init()
 # Fill mimetypes with common types for the case /etc/mime.types is missing
@@ -68,10 +92,37 @@ def run_command(command, env=None, cwd=None, encoding=None):
     return status, out, err
 
 
-def run_command2(command, env=None, cwd=None, get_stdout=True, get_stderr=True, encoding=None):
+def _set_rlimits(limits):
+    """Returns preexec_fn applying limits, dict mapping resource.RLIMIT_* to (soft, hard) pair"""
+    if not limits:
+        return None
+
+    def preexec():
+        for limit, value in limits.items():
+            resource.setrlimit(limit, value)
+
+    return preexec
+
+
+def kill_process_group(process):
+    """Kills process started by run_command2() with all its children"""
+    if process.poll() is None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def run_command2(command, env=None, cwd=None, get_stdout=True, get_stderr=True, encoding=None,
+                 timeout=None, limits=None, on_start=None):
     """returns triple (returncode, stdout, stderr)
     if get_stdout is False stdout tuple element will be set to None
     if get_stderr is False stderr tuple element will be set to None
+
+    The command runs in a new process group. When it is still running after
+    timeout seconds the group is killed and subprocess.TimeoutExpired raised.
+    limits maps resource.RLIMIT_* constants to (soft, hard) limits set in the child.
+    on_start is called with the Popen object once the process started.
     """
     logger.info('Run command {} in env {}, cwd {}'.format(command, env, cwd))
 
@@ -89,7 +140,9 @@ def run_command2(command, env=None, cwd=None, get_stdout=True, get_stderr=True,
                                      stderr=tmp_stderr,
                                      env=env,
                                      cwd=cwd,
-                                     universal_newlines=False)
+                                     universal_newlines=False,
+                                     start_new_session=True,
+                                     preexec_fn=_set_rlimits(limits))
             else:
                 p = subprocess.Popen(command,
                                      stdout=tmp_stdout,
@@ -97,8 +150,18 @@ def run_command2(command, env=None, cwd=None, get_stdout=True, get_stderr=True,
                                      env=env,
                                      cwd=cwd,
                                      universal_newlines=False,
-                                     shell=True)
-            status = p.wait()
+                                     shell=True,
+                                     start_new_session=True,
+                                     preexec_fn=_set_rlimits(limits))
+            if on_start is not None:
+                on_start(p)
+            try:
+                status = p.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning('Command {} timed out after {} seconds, killing it'.format(command, timeout))
+                kill_process_group(p)
+                p.wait()
+                raise
 
             if get_stdout:
                 tmp_stdout.flush()
@@ -124,10 +187,13 @@ def run_command2(command, env=None, cwd=None, get_stdout=True, get_stderr=True,
 
 class CustomJSONEncoder(JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, ConversionTask):
+        if isinstance(obj, (ConversionTask, RemoteTask)):
             return {'hash': obj.result_hash if obj.is_finished() else None,
                     'taskFinished': obj.is_finished(),
                     'taskStatus': obj.get_status(),
+                    'taskQueuePosition': obj.queue_position(),
+                    'taskVersion': obj.version,
+                    'taskPath': obj.conversion_path,
                     'taskAge': obj.age,
                     'taskId': obj.task_id}
         return JSONEncoder.default(self, obj)
@@ -146,25 +212,187 @@ app.config.update(dict(
     LOG_FILE=os.path.join(app.instance_path, 'ldrconverter.log'),
     FILE_FOLDER=os.path.join(app.instance_path, 'files'),
     LDRCONVERT='ldrconvert',
+    LDRAW_BACKEND='ldrconvert',  # 'ldrconvert' (LDR/MPD to 3DS) or 'native' (LDR/MPD to GLB with instancing, needs numpy)
+    LDRAW_CACHE=os.path.join(app.instance_path, 'ldraw-cache.bin'),  # Parts of LDRAWDIR compiled for 'native', None - off
+    LDRAW_CACHE_CHECK_INTERVAL=60,  # Check every minute whether LDRAWDIR changed and LDRAW_CACHE must be rebuilt
+    LDRAW_BLOCK_CACHE=os.path.join(app.instance_path, 'ldraw-blocks'),  # Sub-models of MPD files for 'native', None - off
+    LDRAW_BLOCK_CACHE_MAX_ENTRIES=10000,  # Least recently used sub-models over this number are removed, 0 - no limit
     ASSIMP='assimp',
+    ASSIMP_INFO_CACHE=os.path.join(app.instance_path, 'assimp-formats.json'),  # None - always probe assimp
+    ASSIMP_BACKEND='cli',  # 'cli' (assimp process per conversion) or 'pool' (persistent workers, needs pyassimp)
+    ASSIMP_POOL_SIZE=os.cpu_count() or 1,  # Maximal number of persistent assimp workers
+    ASSIMP_POOL_MAX_JOBS=100,  # Workers are replaced after 100 conversions
     LDRAWDIR=os.getenv('LDRAWDIR', '/usr/share/ldraw'),
-    MAX_CONTENT_LENGTH=100 * 1024 * 1024  # Maximal 100 Mb for files
+    FILEDB_BACKEND='files',  # 'files' (per-entry sidecar files) or 'sqlite' (single index)
+    FILEDB_RECONCILE_INTERVAL=15 * 60,  # Full rescan of FILE_FOLDER every 15 minutes
+    FILEDB_MAX_SIZE=0,  # Maximal total size of stored files in bytes, 0 - unlimited
+    FILEDB_MAX_ENTRIES=0,  # Maximal number of stored files, 0 - unlimited
+    FILEDB_EVICTION_POLICY='lru',  # 'lru', 'lfu' or 'gdsf'
+    FILEDB_EVICTION_INTERVAL=60,  # Check the FileDB limits every minute
+    FILEDB_HASH_ALGORITHM='sha1',  # Content hash for FileDB keys: 'sha1', 'blake2b', 'xxh64', 'xxh128'
+    FILEDB_COMPRESS=None,  # Store compressed variants of results: None, 'ingest' or 'lazy' (on first request)
+    FILEDB_COMPRESS_ENCODINGS=None,  # Content encodings of variants: 'gzip', 'br' (needs brotli), None - all
+    FILEDB_COMPRESS_MIN_SIZE=1024,  # Files smaller than 1 KB are not compressed
+    FILEDB_COMPRESS_MIN_RATIO=0.9,  # Compressed variant is kept if it has at most 90% of the original size
+    MAX_CONTENT_LENGTH=100 * 1024 * 1024,  # Maximal 100 Mb for files
+    CONVERSION_WORKERS=2 * (os.cpu_count() or 1),  # Maximal number of conversion tasks run concurrently
+    CONVERSION_QUEUE_SIZE=256,  # Maximal number of conversion tasks waiting for a worker, 0 - unlimited
+    DOWNLOAD_CONCURRENCY=2 * (os.cpu_count() or 1),  # Maximal number of concurrent URI downloads
+    DOWNLOAD_CHUNK_SIZE=1024 * 1024,  # Block size of URI downloads
+    DOWNLOAD_MAX_SIZE=100 * 1024 * 1024,  # Maximal size of downloaded files, 0 - unlimited
+    DOWNLOAD_TIMEOUT=60,  # Connect and read timeout of URI downloads in seconds, 0 - none
+    CONVERTER_CONCURRENCY=os.cpu_count() or 1,  # Maximal number of concurrent converter processes
+    CONVERTER_TIMEOUT=10 * 60,  # Maximal wall time of one converter run in seconds, 0 - unlimited
+    CONVERTER_TIMEOUTS={},  # Per input format overrides of CONVERTER_TIMEOUT, e.g. {'mpd': 1200}
+    CONVERTER_CPU_LIMIT=10 * 60,  # RLIMIT_CPU of converter processes in seconds, 0 - unlimited
+    CONVERTER_MEMORY_LIMIT=4 * 1024 * 1024 * 1024,  # RLIMIT_AS of converter processes in bytes, 0 - unlimited
+    CONVERSION_STAGE_FOLDER=None,  # Memory backed folder for intermediate files like /dev/shm, None - FILE_FOLDER/tmp
+    CONVERSION_STAGE_MAX_SIZE=16 * 1024 * 1024,  # Steps with larger inputs write to FILE_FOLDER/tmp, 0 - unlimited
+    CONVERTER_VERSION=None,  # Part of the result cache key, derived from the converter binaries when None
+    FILE_DELIVERY='wsgi',  # 'wsgi', 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd)
+    FILE_DELIVERY_ACCEL_PREFIX='/protected-files',  # internal nginx location mapped to FILE_FOLDER
+    HASH_CACHE_MAX_AGE=365 * 24 * 60 * 60,  # Cache-Control max-age of /api/hash/<hash> responses
+    TASK_MAX_AGE=10 * 60,  # Finished tasks are removed 10 minutes after the last access
+    TASK_REAP_INTERVAL=10,  # Check for expired tasks every 10 seconds
+    TASK_MAX_WAIT=60,  # Maximal value of the wait parameter of /api/task/<task_id> in seconds
+    TASK_STORE=None,  # SQLite database with task state shared by server processes, None - tasks are per process
+    SERVER_PROCESSES=1,  # Number of server processes, concurrency limits and queue sizes are divided among them
+    TASK_EVENTS_HEARTBEAT=15,  # Interval of keep-alive comments in /api/task/<task_id>/events in seconds
+    LOD_GRID_CELLS=(32, 12, 4),  # Vertex clustering grid sizes of the levels of detail generated with lod=true
+    LOD_MAX_LEVELS=6  # Maximal number of levels of detail of the lod parameter
 ))
 app.config.from_envvar('LDR_CONVERTER_SETTINGS', silent=True)
 
 app.json_encoder = CustomJSONEncoder
 
 
+def tmp_folders(file_folder, stage_folder=None):
+    """Returns tuple (tmp_folder, stage_folder) of folders for temporary files and
+    intermediate files of multi-stage conversions of the store in file_folder"""
+    tmp_folder = os.path.join(file_folder, 'tmp')
+    if stage_folder and os.path.isdir(stage_folder) and os.access(stage_folder, os.W_OK):
+        # Subfolder unique for the store, instances with different stores do not share it
+        stage_folder = os.path.join(stage_folder, 'web3dconverter-{}'.format(
+            hashlib.sha1(os.path.abspath(file_folder).encode()).hexdigest()[:16]))
+    else:
+        stage_folder = os.path.join(tmp_folder, 'stages')
+    return tmp_folder, stage_folder
+
+
+# Free space of the stage folder required for an intermediate result, in multiples of the input size
+STAGE_SPACE_FACTOR = 4
+
+
 class FileManager(object):
-    def __init__(self, file_folder):
-        self.fdb = FileDB(file_folder)
-        self.tmp_folder = os.path.join(file_folder, 'tmp')
-        shutil.rmtree(self.tmp_folder, ignore_errors=True, onerror=None)
-        if not os.path.exists(self.tmp_folder):
-            os.makedirs(self.tmp_folder)
+    def __init__(self, file_folder, backend='files', reconcile_interval=None,
+                 max_size=0, max_entries=0, eviction_policy='lru', eviction_interval=60,
+                 compress=None, compress_encodings=None, compress_min_size=1024, compress_min_ratio=0.9,
+                 stage_folder=None, stage_max_size=0, clean_tmp=True):
+        fdb_class = FILEDB_BACKENDS.get(backend)
+        if fdb_class is None:
+            raise ValueError('Unknown FileDB backend {!r}, supported: {}'.format(
+                backend, ', '.join(sorted(FILEDB_BACKENDS))))
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError('Unknown FileDB eviction policy {!r}, supported: {}'.format(
+                eviction_policy, ', '.join(EVICTION_POLICIES)))
+        self.fdb = fdb_class(file_folder, reconcile_interval=reconcile_interval)
+        if max_size or max_entries:
+            self.fdb.start_evictor(eviction_interval,
+                                   max_size=max_size,
+                                   max_entries=max_entries,
+                                   policy=eviction_policy)
+        self.tmp_folder, self.stage_folder = tmp_folders(file_folder, stage_folder)
+        for folder in (self.tmp_folder, self.stage_folder):
+            if clean_tmp:
+                # Server processes sharing file_folder must not remove files of each other
+                shutil.rmtree(folder, ignore_errors=True, onerror=None)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+        self.stage_max_size = stage_max_size
         self.remove_files = []
         self.lock = threading.RLock()
 
+        if compress not in (None, 'ingest', 'lazy'):
+            raise ValueError("Unknown compression mode {!r}, supported: None, 'ingest', 'lazy'".format(compress))
+        self.compress_mode = compress
+        self.compress_encodings = [e for e in CONTENT_ENCODINGS
+                                   if compress_encodings is None or e in compress_encodings] if compress else []
+        self.compress_min_size = compress_min_size
+        self.compress_min_ratio = compress_min_ratio
+        self._compressor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if compress == 'lazy' else None
+        self._compressing = set()
+
+    def stage_folder_for(self, input_size):
+        """Returns the folder for the intermediate result of a step with input_size
+        bytes. A memory backed stage folder is small, e.g. 64 MB in Docker, large
+        intermediate results are written to tmp_folder"""
+        if self.stage_folder.startswith(self.tmp_folder + os.sep):
+            return self.stage_folder
+        if self.stage_max_size and input_size > self.stage_max_size:
+            return self.tmp_folder
+        try:
+            free = shutil.disk_usage(self.stage_folder).free
+        except OSError:
+            return self.tmp_folder
+        # Intermediate results may be several times larger than the input
+        return self.stage_folder if free >= STAGE_SPACE_FACTOR * input_size else self.tmp_folder
+
+    def compress(self, fentry):
+        """Creates missing compressed variants of the entry, returns dict mapping
+        encoding to the variant size or None if compression did not pay off"""
+        encodings = fentry.get('encodings') or {}
+        missing = [e for e in self.compress_encodings if e not in encodings]
+        if not missing:
+            return encodings
+        size = os.path.getsize(fentry.path)
+        for encoding in missing:
+            encodings[encoding] = None
+            if size < self.compress_min_size:
+                continue
+            variant_path = self.fdb.variant_path(fentry.name, encoding, create=True)
+            tmp_path = '{}.{}.{}.tmp'.format(variant_path, os.getpid(), threading.current_thread().ident)
+            try:
+                compress_file(fentry.path, tmp_path, encoding)
+                variant_size = os.path.getsize(tmp_path)
+                if variant_size <= size * self.compress_min_ratio:
+                    os.rename(tmp_path, variant_path)
+                    encodings[encoding] = variant_size
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        fentry.update_data({'encodings': encodings})
+        return encodings
+
+    def _compress_job(self, name):
+        try:
+            fentry = self.fdb.get(name)
+            if fentry is not None:
+                self.compress(fentry)
+        except Exception:
+            logger.exception('Could not compress file {}'.format(name))
+        finally:
+            with self.lock:
+                self._compressing.discard(name)
+
+    def select_variant(self, fentry, accept_encodings):
+        """Returns tuple (encoding, path) of the best stored representation of the entry
+        acceptable according to accept_encodings, encoding is None for the file itself"""
+        if not self.compress_encodings:
+            return None, fentry.path
+        encodings = fentry.get('encodings') or {}
+        if self.compress_mode == 'lazy' and any(e not in encodings for e in self.compress_encodings):
+            with self.lock:
+                if fentry.name not in self._compressing:
+                    self._compressing.add(fentry.name)
+                    self._compressor.submit(self._compress_job, fentry.name)
+        available = [e for e in self.compress_encodings if encodings.get(e)]
+        encoding = accept_encodings.best_match(available) if available else None
+        if encoding:
+            variant_path = self.fdb.variant_path(fentry.name, encoding)
+            if os.path.exists(variant_path):
+                return encoding, variant_path
+        return None, fentry.path
+
     def remove_later(self, filename):
         if filename:
             with self.lock:
@@ -234,60 +462,211 @@ class Task(object):
 
 
 class TaskManager(object):
-    def __init__(self):
+    """Registry of tasks by ID.
+
+    Finished tasks are removed max_age seconds after they were touched last.
+    Expiry deadlines are kept in a heap ordered by deadline, so
+    del_expired_tasks() only inspects tasks that are due. Task.touch() does
+    not update the heap: when a due task turns out to be touched or still
+    running, it is pushed back with a new deadline.
+
+    With a TaskStore tasks are shared by server processes: a new task is
+    claimed in the store and run by the claiming process, the others get
+    a RemoteTask reading its state from the store. While tasks of this
+    process are running, the reaper checks the store for cancel requests of
+    other processes every CANCEL_POLL_INTERVAL seconds.
+    """
+
+    CANCEL_POLL_INTERVAL = 0.25
+
+    def __init__(self, scheduler, max_age=10 * 60, store=None):
         self._lock = threading.RLock()
         self._tasks = {}
+        self._scheduler = scheduler
+        self._max_age = max_age
+        self._store = store
+        self._expiry = []
+        self._expiry_counter = itertools.count()
+        self._reaper = None
+        self._reaper_stop = threading.Event()
 
     @property
     def lock(self):
         return self._lock
 
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def max_age(self):
+        return self._max_age
+
+    def start_task(self, task):
+        task.start(self._scheduler)
+
+    def _schedule_expiry(self, task, deadline):
+        # Must be called with self._lock held
+        heapq.heappush(self._expiry, (deadline, next(self._expiry_counter), task))
+
+    @property
+    def store(self):
+        return self._store
+
     def get_task(self, id):
         with self._lock:
-            return self._tasks.get(id)
+            task = self._tasks.get(id)
+        if task is None and self._store is not None:
+            state = self._store.load(id)
+            if state is not None and state['owner'] != os.getpid():
+                task = RemoteTask(self._store, state)
+        return task
 
     def set_task(self, id, task):
         with self._lock:
             self._tasks[id] = task
+            self._schedule_expiry(task, task.timestamp + self._max_age)
 
     def get_or_set_task(self, new_task):
         with self._lock:
             task = self._tasks.get(new_task.task_id)
             if task is None:
+                if self._store is not None:
+                    task = self._claim(new_task)
+                    if task is not None:
+                        return task
                 task = new_task
                 self._tasks[new_task.task_id] = new_task
+                self._schedule_expiry(task, task.timestamp + self._max_age)
             return task
 
+    def _claim(self, task):
+        """Registers task in the store, returns RemoteTask when the task is already
+        owned by another running process and None when it was claimed"""
+        pid = os.getpid()
+        while not self._store.claim(task.task_id, pid):
+            state = self._store.load(task.task_id)
+            if state is None:
+                # Deleted in the meantime
+                continue
+            if state['owner'] != pid and process_alive(state['owner']):
+                return RemoteTask(self._store, state)
+            # Owner exited, run the task here
+            if self._store.take_over(task.task_id, pid, state['owner']):
+                break
+        task.attach_store(self._store)
+        return None
+
     def del_task(self, task_or_id, destroy=True):
         with self._lock:
             task_id = task_or_id.task_id if isinstance(task_or_id, Task) else task_or_id
             task = self._tasks.get(task_id)
             if task:
                 del self._tasks[task_id]
+                if self._store is not None:
+                    self._store.delete(task_id, os.getpid())
                 if destroy:
                     task.destroy()
 
+    def cancel_task(self, task):
+        """Cancels task and removes it from the registry"""
+        task.cancel()
+        if not isinstance(task, RemoteTask):
+            self.del_task(task, destroy=False)
+
+    def cancel_requested_tasks(self):
+        """Cancels tasks of this process cancelled in other processes"""
+        if self._store is None:
+            return
+        with self._lock:
+            running = any(not isinstance(task, RemoteTask) and not task.is_finished()
+                          for task in self._tasks.values())
+        if not running:
+            return
+        for task_id in self._store.cancel_requests(os.getpid()):
+            task = self.get_task(task_id)
+            if task is not None and not isinstance(task, RemoteTask):
+                self.cancel_task(task)
+
     def del_expired_tasks(self, destroy=True):
+        now = time.time()
+        expired = []
         with self._lock:
-            expired = []
-            for task in six.itervalues(self._tasks):
-                if task.is_expired():
+            while self._expiry and self._expiry[0][0] <= now:
+                deadline, seq, task = heapq.heappop(self._expiry)
+                if self._tasks.get(task.task_id) is not task:
+                    # Task was deleted or replaced
+                    continue
+                if task.is_expired(self._max_age):
+                    accessed = self._store.accessed(task.task_id) if self._store is not None else None
+                    if accessed is not None and accessed + self._max_age > now:
+                        # Task was accessed by another process
+                        self._schedule_expiry(task, accessed + self._max_age)
+                        continue
+                    del self._tasks[task.task_id]
+                    if self._store is not None:
+                        self._store.delete(task.task_id, os.getpid())
                     expired.append(task)
+                elif task.is_finished():
+                    # Task was touched after its deadline was scheduled
+                    self._schedule_expiry(task, max(task.timestamp + self._max_age, now + 1))
+                else:
+                    self._schedule_expiry(task, now + self._max_age)
+        if self._store is not None:
+            self._store.delete_orphans(self._max_age)
+        if destroy:
             for task in expired:
-                del self._tasks[task.task_id]
-                if destroy:
-                    task.destroy()
+                task.destroy()
+        return expired
 
-
-def hash_file(filename):
-    BLOCKSIZE = 65536
-    hasher = hashlib.sha1()
-    with open(filename, 'rb') as fd:
-        buf = fd.read(BLOCKSIZE)
-        while len(buf) > 0:
-            hasher.update(buf)
-            buf = fd.read(BLOCKSIZE)
-    return hasher.hexdigest()
+    def start_reaper(self, interval):
+        """Run del_expired_tasks() every interval seconds and cancel_requested_tasks()
+        every CANCEL_POLL_INTERVAL seconds in a daemon thread."""
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper_stop.clear()
+
+            poll_interval = min(interval, self.CANCEL_POLL_INTERVAL) if self._store is not None else interval
+
+            def run():
+                next_reap = time.time() + interval
+                while not self._reaper_stop.wait(poll_interval):
+                    try:
+                        self.cancel_requested_tasks()
+                        if time.time() >= next_reap:
+                            next_reap = time.time() + interval
+                            self.del_expired_tasks()
+                    except Exception:
+                        logger.exception('Could not delete expired tasks')
+
+            self._reaper = threading.Thread(target=run, name='TaskManager-reaper')
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def stop_reaper(self):
+        with self._lock:
+            thread = self._reaper
+            self._reaper = None
+        if thread is not None:
+            self._reaper_stop.set()
+            thread.join()
+
+
+def copy_and_hash(src, dst, max_size=None, block_size=1024 * 1024):
+    """Copies file-like object src to dst in blocks while hashing the content,
+    returns tuple (hexdigest, size)"""
+    hasher = new_hasher(HASH_ALGORITHM)
+    size = 0
+    buf = src.read(block_size)
+    while len(buf) > 0:
+        size += len(buf)
+        if max_size and size > max_size:
+            raise RequestEntityTooLarge()
+        hasher.update(buf)
+        dst.write(buf)
+        buf = src.read(block_size)
+    return hasher.hexdigest(), size
 
 
 @app.before_first_request
@@ -297,15 +676,15 @@ def pre_first_request():
 
 @app.before_request
 def pre_request():
-    global FM, TM
+    global FM
     FM.sync()
-    TM.del_expired_tasks()
 
 
 HTTP_OK = 200
 HTTP_BAD_REQUEST = 400
 HTTP_INTERNAL_SERVER_ERROR = 500
 HTTP_NOT_IMPLEMENTED = 501
+HTTP_SERVICE_UNAVAILABLE = 503
 
 
 def error_response(message, status_code=HTTP_INTERNAL_SERVER_ERROR):
@@ -338,18 +717,43 @@ FORMAT_INFO = {
     'blend': FileFormat("BLEND", "Blender", "application/octet-stream", ".blend"),
     'bvh': FileFormat("BVH", "Biovision BVH", "text/plain", ".bvh"),
     'ply': FileFormat("PLY", "Stanford Polygon Library", "application/octet-stream", ".ply"),
-    'smd': FileFormat("SMD", "Studiomdl Data file format", "text/plain", ".smd")
+    'smd': FileFormat("SMD", "Studiomdl Data file format", "text/plain", ".smd"),
+    'glb': FileFormat("GLB", "glTF 2.0 binary", "model/gltf-binary", ".glb")
 }
 
 
+# Suffix index and content sniffing of FORMAT_INFO, rebuilt by init()
+FORMAT_DETECTOR = FormatDetector(FORMAT_INFO)
+
+
 def derive_format(filename):
-    global FORMAT_INFO
     """Returns format_name, format tuple or None"""
-    filename_lc = filename.lower()
-    for format_name, format_info in six.iteritems(FORMAT_INFO):
-        if filename_lc.endswith(format_info.ext):
-            return format_name, format_info
-    return None
+    format_name = FORMAT_DETECTOR.from_filename(filename)
+    if format_name is None:
+        return None
+    return format_name, FORMAT_INFO[format_name]
+
+
+def detect_input_format(path, filename=None):
+    """Returns format_name, format tuple of input file path or None,
+    filename is a hint, the file content decides"""
+    format_name = FORMAT_DETECTOR.detect(filename, read_head(path), os.path.getsize(path), INPUT_FORMATS)
+    if format_name is None:
+        return None
+    return format_name, FORMAT_INFO[format_name]
+
+
+def check_input_format(path, format_name):
+    """Raises BadRequestError if the content of input file path is not of format format_name"""
+    head = read_head(path)
+    size = os.path.getsize(path)
+    if FORMAT_DETECTOR.check(format_name, head, size) is not False:
+        return
+    candidates = FORMAT_DETECTOR.sniff(head, size, INPUT_FORMATS)
+    if candidates:
+        raise BadRequestError('Input is not in format {}, it looks like format {}'.format(
+            FORMAT_INFO[format_name].name, FORMAT_INFO[candidates[0]].name))
+    raise BadRequestError('Input is not in format {}'.format(FORMAT_INFO[format_name].name))
 
 
 INPUT_FORMATS = ['ldr', 'mpd']
@@ -358,55 +762,351 @@ OUTPUT_FORMATS = ['3ds']
 LDRCONVERTER_INPUT_FORMATS = set(('ldr', 'mpd'))
 LDRCONVERTER_OUTPUT_FORMATS = set(('3ds',))
 
-# Application initialization
-FM = None
-TM = None
+# Native LDraw converter, run as separate process like the converter binaries
+LDRAW_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ldraw.py')
+LDRAW_INPUT_FORMATS = set(('ldr', 'mpd'))
+LDRAW_OUTPUT_FORMATS = set(('glb',))
+
+# Mesh optimization of GLB results, run as separate process like the LDraw converter
+MESHOPT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meshopt.py')
+MESHOPT_STAGES = ('weld', 'degenerate', 'reorder', 'quantize')
+MESHOPT_DEFAULT_STAGES = ('weld', 'degenerate', 'reorder')
+MESHOPT_FORMATS = set(('glb',))
+
+# Converters available for conversion paths, filled by init()
+CONVERTERS = ConverterRegistry()
+
+# Maps file extensions to assimp export format IDs, filled by init()
+ASSIMP_EXPORT_FORMATS = {}
+
+
+def converter_version():
+    """Returns string identifying the installed converter binaries"""
+    if app.config["CONVERTER_VERSION"]:
+        return str(app.config["CONVERTER_VERSION"])
+    version = []
+    commands = [app.config["LDRCONVERT"], app.config["ASSIMP"]]
+    if app.config["LDRAW_BACKEND"] == 'native':
+        commands.append(LDRAW_SCRIPT)
+    if numpy is not None:
+        commands.append(MESHOPT_SCRIPT)
+    for command in commands:
+        path = shutil.which(command) or command
+        try:
+            st = os.stat(path)
+            version.append('{}:{}:{}'.format(path, st.st_size, int(st.st_mtime)))
+        except OSError:
+            version.append(path)
+    if ASSIMP_POOL is not None:
+        # pyassimp may be linked to another assimp library than the command line tool
+        version.append('assimp-pool')
+    return ';'.join(version)
+
+
+def uri_cache_key(uri):
+    """Returns FileDB link key of the last downloaded content of uri"""
+    return 'uri-' + hashlib.sha1(uri.encode()).hexdigest()
+
+
+def result_cache_key(content_hash, input_format_name, output_format_name, mesh_options=None, lod_cells=None):
+    """Returns FileDB link key of the conversion result of the input with content_hash"""
+    hasher = hashlib.sha1()
+    parts = [content_hash, input_format_name, output_format_name, CONVERTER_VERSION]
+    if mesh_options is not None:
+        parts.append(mesh_options.key)
+    if lod_cells:
+        parts.append('lod=' + ','.join(str(cells) for cells in lod_cells))
+    for part in parts:
+        hasher.update(part.encode())
+        hasher.update(b'\0')
+    return 'result-' + hasher.hexdigest()
+
+
+def lod_manifest_key(result_hash, lod_cells):
+    """Returns FileDB link key of the LOD manifest of conversion result result_hash
+    with the grid sizes lod_cells, manifests of other grid sizes are kept"""
+    return 'lod-{}-{}'.format(result_hash, ','.join(str(cells) for cells in lod_cells))
+
+
+def lod_cells_from_args(args):
+    """Returns tuple of the grid sizes of the levels of detail requested with the
+    query parameter lod, 'true' for LOD_GRID_CELLS or comma separated grid
+    sizes, finest first. None if lod is missing or false, raises
+    BadRequestError on invalid values."""
+    lod = args.get('lod', None)
+    if lod is None or lod in ('', '0', 'false'):
+        return None
+    if lod in ('1', 'true'):
+        cells = [int(value) for value in app.config['LOD_GRID_CELLS']]
+    else:
+        try:
+            cells = [int(value) for value in lod.split(',')]
+        except ValueError:
+            cells = None
+        if not cells or any(not 1 <= value <= 1024 for value in cells) or \
+                len(cells) > int(app.config['LOD_MAX_LEVELS']):
+            raise BadRequestError('Invalid lod parameter: {}, must be true or at most {} grid sizes of 1 to 1024 '
+                                  'cells'.format(lod, app.config['LOD_MAX_LEVELS']))
+    return tuple(sorted(set(cells), reverse=True))
+
+
+class MeshOptions(object):
+    """Settings of the mesh optimization stage appended to conversions to GLB,
+    stages are a subset of MESHOPT_STAGES"""
+
+    def __init__(self, stages=MESHOPT_DEFAULT_STAGES, weld_tolerance=0.0, quantize_bits=14):
+        self.stages = tuple(stage for stage in MESHOPT_STAGES if stage in stages)
+        self.weld_tolerance = weld_tolerance
+        self.quantize_bits = quantize_bits
+
+    def __repr__(self):
+        return 'MeshOptions({!r})'.format(self.key)
+
+    @classmethod
+    def from_args(cls, args):
+        """Returns MeshOptions of the query parameters optimize ('true' or comma
+        separated stages), weld_tolerance and quantize_bits, None if optimize
+        is missing or false. Raises BadRequestError on invalid values."""
+        optimize = args.get('optimize', None)
+        if optimize is None or optimize in ('', '0', 'false'):
+            return None
+        if optimize in ('1', 'true'):
+            stages = MESHOPT_DEFAULT_STAGES
+        else:
+            stages = [stage.strip() for stage in optimize.split(',') if stage.strip()]
+            unknown = [stage for stage in stages if stage not in MESHOPT_STAGES]
+            if unknown or not stages:
+                raise BadRequestError('Invalid optimize parameter: {}, supported stages: {}'.format(
+                    optimize, ', '.join(MESHOPT_STAGES)))
+        try:
+            weld_tolerance = float(args.get('weld_tolerance', 0.0))
+        except ValueError:
+            weld_tolerance = -1
+        if not weld_tolerance >= 0:
+            raise BadRequestError('Invalid weld_tolerance parameter: {}'.format(args.get('weld_tolerance')))
+        try:
+            quantize_bits = int(args.get('quantize_bits', 14))
+        except ValueError:
+            quantize_bits = 0
+        if not 8 <= quantize_bits <= 16:
+            raise BadRequestError('Invalid quantize_bits parameter: {}, must be 8 to 16'.format(
+                args.get('quantize_bits')))
+        return cls(stages, weld_tolerance, quantize_bits)
 
+    @property
+    def key(self):
+        """String identifying the settings, part of task ids and result cache keys"""
+        key = ','.join(self.stages)
+        if 'weld' in self.stages and self.weld_tolerance:
+            key += ';weld_tolerance={!r}'.format(self.weld_tolerance)
+        if 'quantize' in self.stages:
+            key += ';quantize_bits={}'.format(self.quantize_bits)
+        return key
+
+    def command_args(self):
+        """Returns the options of MESHOPT_SCRIPT"""
+        return ['--stages', ','.join(self.stages),
+                '--weld-tolerance', repr(self.weld_tolerance),
+                '--quantize-bits', str(self.quantize_bits)]
+
+
+def probe_assimp(assimp, cwd=None):
+    """Runs assimp to list supported formats, returns dict with outputs of
+    'listexport' and 'listext' commands and list of (format, output) pairs of
+    'exportinfo' commands. Export formats are queried in parallel.
+    """
+    result = {'listexport': None, 'exportinfo': [], 'listext': None}
+    status, out, err = run_command([assimp, 'listexport'], cwd=cwd, encoding='utf-8')
+    if status == 0:
+        result['listexport'] = out
+        export_formats = [f.strip() for f in out.split("\n") if f.strip()]
+
+        def exportinfo(export_format):
+            return run_command([assimp, 'exportinfo', export_format], cwd=cwd, encoding='utf-8')
+
+        if export_formats:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(export_formats), 16)) as executor:
+                for export_format, (status, out, err) in zip(export_formats,
+                                                             executor.map(exportinfo, export_formats)):
+                    if status == 0:
+                        result['exportinfo'].append((export_format, out))
+
+    status, out, err = run_command([assimp, 'listext'], cwd=cwd, encoding='utf-8')
+    if status == 0:
+        result['listext'] = out
+    return result
+
+
+def get_assimp_info(assimp, cache_file=None, cwd=None):
+    """Returns result of probe_assimp(), cached in cache_file as long as
+    path, modification time and version of the assimp binary do not change.
+    """
+    path = shutil.which(assimp) or assimp
+    st = os.stat(path)
+    status, out, err = run_command([assimp, 'version'], cwd=cwd, encoding='utf-8')
+    cache_key = {'path': os.path.abspath(path),
+                 'mtime': st.st_mtime,
+                 'size': st.st_size,
+                 'version': out.strip() if status == 0 else None}
+
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as fd:
+                cache = json.load(fd)
+            if cache.get('key') == cache_key:
+                logger.info('Using cached assimp format information from {}'.format(cache_file))
+                return cache['info']
+        except (IOError, OSError, ValueError, KeyError):
+            logger.exception('Could not read assimp format cache {}'.format(cache_file))
+
+    info = probe_assimp(assimp, cwd=cwd)
+
+    if cache_file:
+        try:
+            cache_dir = os.path.dirname(cache_file)
+            if cache_dir and not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'w') as fd:
+                json.dump({'key': cache_key, 'info': info}, fd)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError):
+            logger.exception('Could not write assimp format cache {}'.format(cache_file))
+    return info
 
-def init():
-    global FM, TM, INPUT_FORMATS, OUTPUT_FORMATS
 
-    FM = FileManager(app.config["FILE_FOLDER"])
-    TM = TaskManager()
+# Application initialization
+FM = None
+TM = None
+SCHED = None
+ASSIMP_POOL = None
+HTTP_SESSION = None
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+CONVERTER_VERSION = None
+HASH_ALGORITHM = 'sha1'
+
+
+def process_limit(name):
+    """Returns the share of one server process of limit name of the configuration,
+    the limits apply to all SERVER_PROCESSES together. 0 stays unlimited."""
+    limit = int(app.config[name] or 0)
+    if not limit:
+        return 0
+    return max(1, limit // max(1, int(app.config["SERVER_PROCESSES"])))
+
+
+def init(clean_tmp=True):
+    global FM, TM, SCHED, ASSIMP_POOL, HTTP_SESSION, CONVERTER_VERSION, HASH_ALGORITHM, INPUT_FORMATS, OUTPUT_FORMATS, \
+        FORMAT_DETECTOR
+
+    HASH_ALGORITHM = app.config["FILEDB_HASH_ALGORITHM"]
+    if HASH_ALGORITHM not in HASH_ALGORITHMS:
+        raise ValueError('Unsupported FileDB hash algorithm {!r}, supported: {}'.format(
+            HASH_ALGORITHM, ', '.join(HASH_ALGORITHMS)))
+
+    FM = FileManager(app.config["FILE_FOLDER"],
+                     backend=app.config["FILEDB_BACKEND"],
+                     reconcile_interval=float(app.config["FILEDB_RECONCILE_INTERVAL"]),
+                     max_size=int(app.config["FILEDB_MAX_SIZE"]),
+                     max_entries=int(app.config["FILEDB_MAX_ENTRIES"]),
+                     eviction_policy=app.config["FILEDB_EVICTION_POLICY"],
+                     eviction_interval=float(app.config["FILEDB_EVICTION_INTERVAL"]),
+                     compress=app.config["FILEDB_COMPRESS"],
+                     compress_encodings=app.config["FILEDB_COMPRESS_ENCODINGS"],
+                     compress_min_size=int(app.config["FILEDB_COMPRESS_MIN_SIZE"]),
+                     compress_min_ratio=float(app.config["FILEDB_COMPRESS_MIN_RATIO"]),
+                     stage_folder=app.config["CONVERSION_STAGE_FOLDER"],
+                     stage_max_size=int(app.config["CONVERSION_STAGE_MAX_SIZE"] or 0),
+                     clean_tmp=clean_tmp)
+    SCHED = Scheduler(workers=process_limit("CONVERSION_WORKERS"),
+                      max_queue=process_limit("CONVERSION_QUEUE_SIZE"),
+                      stage_limits={'download': process_limit("DOWNLOAD_CONCURRENCY"),
+                                    'convert': process_limit("CONVERTER_CONCURRENCY")})
+    store = TaskStore(app.config["TASK_STORE"]) if app.config["TASK_STORE"] else None
+    if store is not None and clean_tmp:
+        store.reset()
+    TM = TaskManager(SCHED, max_age=float(app.config["TASK_MAX_AGE"]), store=store)
+    TM.start_reaper(float(app.config["TASK_REAP_INTERVAL"]))
+
+    # Keep-alive connections for URI downloads, shared by all tasks
+    HTTP_SESSION = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=process_limit("DOWNLOAD_CONCURRENCY"))
+    HTTP_SESSION.mount('http://', adapter)
+    HTTP_SESSION.mount('https://', adapter)
+
+    if app.config["ASSIMP_BACKEND"] == 'pool':
+        memory_limit = int(app.config["CONVERTER_MEMORY_LIMIT"] or 0)
+        ASSIMP_POOL = AssimpWorkerPool(process_limit("ASSIMP_POOL_SIZE"),
+                                       max_jobs=int(app.config["ASSIMP_POOL_MAX_JOBS"]),
+                                       cwd=FM.tmp_folder,
+                                       preexec_fn=_set_rlimits({resource.RLIMIT_AS: (memory_limit, memory_limit)}
+                                                               if resource is not None and memory_limit > 0 else None))
+        try:
+            ASSIMP_POOL.check()
+        except (AssimpWorkerError, subprocess.TimeoutExpired, OSError) as e:
+            logger.error('Could not start assimp worker, using assimp command line tool: {}'.format(e))
+            ASSIMP_POOL.close()
+            ASSIMP_POOL = None
+    elif app.config["ASSIMP_BACKEND"] != 'cli':
+        raise ValueError("Unknown assimp backend {!r}, supported: 'cli', 'pool'".format(app.config["ASSIMP_BACKEND"]))
+    CONVERTER_VERSION = converter_version()
 
     try:
-        status, out, err = run_command([app.config["ASSIMP"], 'listexport'], cwd=FM.tmp_folder, encoding='utf-8')
-        have_assimp = True
-        if status == 0:
-            export_formats = out.split("\n")
-            for export_format in export_formats:
-                export_format = export_format.strip()
-                if not export_format:
-                    continue
-                status, out, err = run_command([app.config["ASSIMP"], 'exportinfo', export_format], cwd=FM.tmp_folder, encoding='utf-8')
-                if status == 0:
-                    export_format_info = [s.strip() for s in out.split("\n")]
-                    if len(export_format_info) >= 3:
-                        export_format_id = export_format_info[0]
-                        export_format_ext = export_format_info[1]
-                        export_format_descr = export_format_info[2]
-                        if export_format_ext.startswith("*."):
-                            export_format_ext = export_format_ext[2:]
-                        elif export_format_ext.startswith("."):
-                            export_format_ext = export_format_ext[1:]
-                        export_format_ext = export_format_ext.lower()
-                        format_name = export_format_ext
-
-                        format_info = FORMAT_INFO.get(format_name)
-                        if format_info:
-                            if not format_info.description:
-                                format_info.description = export_format_descr
-                        else:
-                            FORMAT_INFO[format_name] = FileFormat(format_name.upper(),
-                                                                  export_format_descr,
-                                                                  "application/octet-stream",
-                                                                  '.' + export_format_ext)
-                        if format_name not in OUTPUT_FORMATS:
-                            OUTPUT_FORMATS.append(format_name)
-
-        status, out, err = run_command([app.config["ASSIMP"], 'listext'], cwd=FM.tmp_folder, encoding='utf-8')
-        if status == 0:
-            import_exts = out.split(';')
+        assimp_info = get_assimp_info(app.config["ASSIMP"], app.config["ASSIMP_INFO_CACHE"], cwd=FM.tmp_folder)
+    except OSError as e:
+        logger.exception("Could not run assimp")
+        assimp_info = None
+
+    ldraw_backend = app.config["LDRAW_BACKEND"]
+    if ldraw_backend == 'native' and numpy is None:
+        logger.error('NumPy is not installed, using ldrconvert')
+        ldraw_backend = 'ldrconvert'
+    if ldraw_backend == 'native':
+        CONVERTERS.register(Converter('ldraw', ldraw_convert, LDRAW_INPUT_FORMATS, LDRAW_OUTPUT_FORMATS, cost=0.5))
+        # Start building the library cache before the first conversion
+        ldraw_cache()
+        for format_name in LDRAW_OUTPUT_FORMATS:
+            if format_name not in OUTPUT_FORMATS:
+                OUTPUT_FORMATS.append(format_name)
+    elif ldraw_backend == 'ldrconvert':
+        CONVERTERS.register(Converter('ldrconvert', ldr_convert, LDRCONVERTER_INPUT_FORMATS,
+                                      LDRCONVERTER_OUTPUT_FORMATS))
+    else:
+        raise ValueError("Unknown LDraw backend {!r}, supported: 'ldrconvert', 'native'".format(ldraw_backend))
+
+    if assimp_info:
+        assimp_input_formats = set()
+        assimp_output_formats = set()
+        for export_format, out in assimp_info['exportinfo']:
+            export_format_info = [s.strip() for s in out.split("\n")]
+            if len(export_format_info) >= 3:
+                export_format_id = export_format_info[0]
+                export_format_ext = export_format_info[1]
+                export_format_descr = export_format_info[2]
+                if export_format_ext.startswith("*."):
+                    export_format_ext = export_format_ext[2:]
+                elif export_format_ext.startswith("."):
+                    export_format_ext = export_format_ext[1:]
+                export_format_ext = export_format_ext.lower()
+                format_name = export_format_ext
+                # First exporter of the extension, like 'assimp export' selects it
+                ASSIMP_EXPORT_FORMATS.setdefault(format_name, export_format_id)
+
+                format_info = FORMAT_INFO.get(format_name)
+                if format_info:
+                    if not format_info.description:
+                        format_info.description = export_format_descr
+                else:
+                    FORMAT_INFO[format_name] = FileFormat(format_name.upper(),
+                                                          export_format_descr,
+                                                          "application/octet-stream",
+                                                          '.' + export_format_ext)
+                assimp_output_formats.add(format_name)
+                if format_name not in OUTPUT_FORMATS:
+                    OUTPUT_FORMATS.append(format_name)
+
+        if assimp_info['listext'] is not None:
+            import_exts = assimp_info['listext'].split(';')
             for ext in import_exts:
                 format_name = ext.strip().lower()
                 if format_name.startswith("*."):
@@ -422,16 +1122,13 @@ def init():
                     format_info = FileFormat(format_name.upper(), format_name.upper() + " File Format",
                                              "application/octet-stream", my_ext)
                     FORMAT_INFO[format_name] = format_info
+                assimp_input_formats.add(format_name)
                 if format_name not in INPUT_FORMATS:
                     INPUT_FORMATS.append(format_name)
 
+        CONVERTERS.register(Converter('assimp', assimp_convert, assimp_input_formats, assimp_output_formats))
 
-                    # for i in FORMAT_INFO.values():
-                    #    logger.info(i)
-
-    except OSError as e:
-        logger.exception("Could not run assimp")
-        have_assimp = False
+    FORMAT_DETECTOR = FormatDetector(FORMAT_INFO)
 
 
 class FileGuard(object):
@@ -476,6 +1173,11 @@ class FileGuard(object):
         self.name = None
         return name
 
+    def rename(self, name):
+        """Renames the file to name, an existing file is replaced"""
+        os.rename(self.name, name)
+        self.name = name
+
     def close(self):
         self.close_descriptor()
         if self.name is not None:
@@ -518,7 +1220,80 @@ def on_bad_request_error(error):
     return bad_request(error.message)
 
 
-def ldr_convert(input_file, output_file):
+def error_to_dict(error):
+    """Returns JSON serializable description of a task error"""
+    if error is None:
+        return None
+    if isinstance(error, BadRequestError):
+        return {'type': 'bad_request', 'message': error.message}
+    return {'type': 'conversion',
+            'message': getattr(error, 'message', str(error)),
+            'internal': getattr(error, 'oserror', None) is not None}
+
+
+def error_from_dict(data):
+    """Inverse of error_to_dict()"""
+    if data is None:
+        return None
+    if data['type'] == 'bad_request':
+        return BadRequestError(data['message'])
+    return ConversionError(message=data['message'],
+                           oserror=OSError(data['message']) if data.get('internal') else None)
+
+
+@app.errorhandler(QueueFullError)
+def on_queue_full_error(error):
+    return error_response(error.message, HTTP_SERVICE_UNAVAILABLE)
+
+
+def converter_timeout(format_name):
+    """Returns wall time limit in seconds of converting from format_name or None"""
+    timeouts = app.config["CONVERTER_TIMEOUTS"] or {}
+    timeout = float(timeouts.get(format_name, app.config["CONVERTER_TIMEOUT"]) or 0)
+    return timeout if timeout > 0 else None
+
+
+def converter_limits():
+    """Returns resource limits of converter processes for run_command2()"""
+    if resource is None:
+        return None
+    limits = {}
+    cpu_limit = int(app.config["CONVERTER_CPU_LIMIT"] or 0)
+    if cpu_limit > 0:
+        # SIGXCPU at the soft limit, SIGKILL one second later
+        limits[resource.RLIMIT_CPU] = (cpu_limit, cpu_limit + 1)
+    memory_limit = int(app.config["CONVERTER_MEMORY_LIMIT"] or 0)
+    if memory_limit > 0:
+        limits[resource.RLIMIT_AS] = (memory_limit, memory_limit)
+    return limits
+
+
+def run_converter(commandline, env=None, timeout=None, task=None):
+    """Runs converter command line with converter_limits(), the process can be
+    killed by task.cancel(). Raises ConversionError on failure"""
+    if task is not None and task.is_cancelled():
+        raise ConversionError(message='Conversion cancelled')
+    try:
+        status, out, err = run_command2(commandline, env=env, cwd=FM.tmp_folder,
+                                        timeout=timeout,
+                                        limits=converter_limits(),
+                                        on_start=task.add_process if task is not None else None)
+    except subprocess.TimeoutExpired:
+        raise ConversionError(message='Conversion timed out after {:g} seconds'.format(timeout))
+    except OSError as e:
+        message = 'Could not execute command line "{}" in directory "{}": {}'.format(
+            ' '.join(commandline), FM.tmp_folder, e)
+        logger.exception(message)
+        raise ConversionError(message=message, oserror=e)
+    if task is not None and task.is_cancelled():
+        raise ConversionError(message='Conversion cancelled')
+    if status == -signal.SIGXCPU:
+        raise ConversionError(message='Conversion exceeded CPU time limit', stdout=out, stderr=err)
+    if status != 0:
+        raise ConversionError(message='Conversion failed', stdout=out, stderr=err)
+
+
+def ldr_convert(input_file, output_file, timeout=None, task=None):
     args = [app.config["LDRCONVERT"],
             '-v',
             input_file.name,
@@ -528,73 +1303,291 @@ def ldr_convert(input_file, output_file):
         'LDRAWDIR': app.config['LDRAWDIR']
     }
 
-    commandline = args
-    try:
-        status, out, err = run_command2(commandline, env=env, cwd=FM.tmp_folder)
-    except OSError as e:
-        message = 'Could not execute command line "{}" in directory "{}": {}'.format(
-            ' '.join(commandline), FM.tmp_folder, e)
-        logger.exception(message)
-        raise ConversionError(message=message, oserror=e)
-    if status != 0:
-        raise ConversionError(message='Conversion failed', stdout=out, stderr=err)
+    run_converter(args, env=env, timeout=timeout, task=task)
     input_file.close()
     return output_file
 
 
-def assimp_convert(input_file, output_file):
+class LDrawCacheState(object):
+    """State of LDRAW_CACHE in this process, see ldraw_cache()"""
+    lock = threading.Lock()
+    checked = 0
+    fresh = False
+    builder = None
+
+
+def ldraw_cache():
+    """Returns path of LDRAW_CACHE if it was built from the current LDRAWDIR,
+    otherwise starts a rebuild in the background and returns None.
+    LDRAWDIR is checked every LDRAW_CACHE_CHECK_INTERVAL seconds."""
+    path = app.config["LDRAW_CACHE"]
+    if not path:
+        return None
+    from .ldraw import cache_signature, library_signature
+
+    state = LDrawCacheState
+    with state.lock:
+        if state.builder is not None and state.builder.poll() is not None:
+            if state.builder.returncode != 0:
+                logger.error('Could not build LDraw library cache {}, exit code {}'.format(
+                    path, state.builder.returncode))
+            state.builder = None
+            state.checked = 0
+        now = time.time()
+        if now - state.checked >= float(app.config["LDRAW_CACHE_CHECK_INTERVAL"]):
+            state.checked = now
+            state.fresh = cache_signature(path) == library_signature(app.config["LDRAWDIR"])
+            if not state.fresh and state.builder is None:
+                logger.info('Building LDraw library cache {}'.format(path))
+                # Concurrent builders of other server processes wait for the lock of the first one
+                state.builder = subprocess.Popen([sys.executable, LDRAW_SCRIPT, '--ldrawdir', app.config["LDRAWDIR"],
+                                                  '--build-cache', path],
+                                                 stdin=subprocess.DEVNULL,
+                                                 start_new_session=True)
+        return path if state.fresh else None
+
+
+# Conversions run in parallel processes, one BLAS thread each
+NUMPY_CONVERTER_ENV = {
+    'OPENBLAS_NUM_THREADS': '1',
+    'OMP_NUM_THREADS': '1'
+}
+
+
+def ldraw_convert(input_file, output_file, timeout=None, task=None):
+    args = [sys.executable,
+            LDRAW_SCRIPT,
+            '-v',
+            input_file.name,
+            output_file.name]
+
+    cache = ldraw_cache()
+    if cache:
+        args[2:2] = ['--cache', cache]
+    if app.config['LDRAW_BLOCK_CACHE']:
+        args[2:2] = ['--block-cache', app.config['LDRAW_BLOCK_CACHE'],
+                     '--block-cache-size', str(int(app.config['LDRAW_BLOCK_CACHE_MAX_ENTRIES']))]
+
+    env = dict(NUMPY_CONVERTER_ENV, LDRAWDIR=app.config['LDRAWDIR'])
+
+    run_converter(args, env=env, timeout=timeout, task=task)
+    input_file.close()
+    return output_file
+
+
+def meshopt_convert(input_file, output_file, timeout=None, task=None):
+    """Optimizes the meshes of GLB input_file with the MeshOptions of task"""
+    mesh_options = task.mesh_options if task is not None and task.mesh_options is not None else MeshOptions()
+    args = [sys.executable, MESHOPT_SCRIPT, '-v'] + mesh_options.command_args() + [input_file.name, output_file.name]
+    run_converter(args, env=dict(NUMPY_CONVERTER_ENV), timeout=timeout, task=task)
+    input_file.close()
+    return output_file
+
+
+# Not registered in CONVERTERS, plan_conversion() appends it to the planned path
+MESH_OPTIMIZER = Converter('meshopt', meshopt_convert, MESHOPT_FORMATS, MESHOPT_FORMATS, cost=0.2)
+
+
+def plan_conversion(input_format_name, output_format_name, input_size=None, mesh_options=None):
+    """Returns list of ConversionStep or None if there is no conversion path,
+    with mesh_options the path ends with the mesh optimization"""
+    if mesh_options is not None and input_format_name == output_format_name:
+        return [ConversionStep(MESH_OPTIMIZER, input_format_name, output_format_name)]
+    steps = CONVERTERS.plan(input_format_name, output_format_name, input_size)
+    if steps is not None and mesh_options is not None:
+        steps.append(ConversionStep(MESH_OPTIMIZER, output_format_name, output_format_name))
+    return steps
+
+
+def run_pooled_assimp(input_file, output_file, format_id, timeout=None, task=None):
+    """Converts with a worker of ASSIMP_POOL, raises ConversionError on failure"""
+    if task is not None and task.is_cancelled():
+        raise ConversionError(message='Conversion cancelled')
+    try:
+        ASSIMP_POOL.convert(input_file.name, output_file.name, format_id,
+                            timeout=timeout,
+                            cpu_limit=int(app.config["CONVERTER_CPU_LIMIT"] or 0) or None,
+                            on_start=task.add_process if task is not None else None,
+                            on_finish=task.remove_process if task is not None else None)
+    except subprocess.TimeoutExpired:
+        raise ConversionError(message='Conversion timed out after {:g} seconds'.format(timeout))
+    except AssimpWorkerError as e:
+        if task is not None and task.is_cancelled():
+            raise ConversionError(message='Conversion cancelled')
+        if e.exitcode == -signal.SIGXCPU:
+            raise ConversionError(message='Conversion exceeded CPU time limit')
+        raise ConversionError(message='Conversion failed', stderr=e.message)
+
+
+def assimp_convert(input_file, output_file, timeout=None, task=None):
+    if ASSIMP_POOL is not None:
+        format_id = ASSIMP_EXPORT_FORMATS.get(os.path.splitext(output_file.name)[1][1:].lower())
+        if format_id:
+            run_pooled_assimp(input_file, output_file, format_id, timeout=timeout, task=task)
+            input_file.close()
+            return output_file
+
     args = [app.config["ASSIMP"],
             'export',
             input_file.name,
             output_file.name]
 
-    commandline = args
-    try:
-        status, out, err = run_command2(commandline, cwd=FM.tmp_folder)
-    except OSError as e:
-        message = 'Could not execute command line "{}" in directory "{}": {}'.format(
-            ' '.join(commandline), FM.tmp_folder, e)
-        logger.exception(message)
-        raise ConversionError(message=message, oserror=e)
-    if status != 0:
-        raise ConversionError(message='Conversion failed', stdout=out, stderr=err)
+    run_converter(args, timeout=timeout, task=task)
     input_file.close()
     return output_file
 
 
+def run_pipeline(steps, input_file, output_file, prefix, task=None):
+    """Runs list of ConversionStep in order.
+
+    The first step reads input_file, the last one writes output_file.
+    Results of the other steps are written to FM.stage_folder_for() their
+    input size, memory backed when possible, and removed as soon as the next step is done.
+    Converters remove their input file. Wall time and sizes of every step
+    are reported to CONVERTERS. Every step is limited by converter_timeout()
+    of its input format, task.cancel() stops the pipeline.
+    """
+    current_file = input_file
+    for i, step in enumerate(steps):
+        input_size = os.path.getsize(current_file.name)
+        if i == len(steps) - 1:
+            stage_output = output_file
+        else:
+            stage_output = FileGuard.mkstemp(dir=FM.stage_folder_for(input_size), prefix=prefix,
+                                             suffix=FORMAT_INFO[step.output_format].ext)
+            stage_output.close_descriptor()
+        try:
+            start = time.time()
+            step.converter.func(current_file, stage_output,
+                                timeout=converter_timeout(step.input_format),
+                                task=task)
+            CONVERTERS.record(step, time.time() - start, input_size, os.path.getsize(stage_output.name))
+        except:
+            if stage_output is not output_file:
+                stage_output.close()
+            raise
+        finally:
+            if current_file is not input_file:
+                current_file.close()
+        current_file = stage_output
+    return output_file
+
+
+def generate_lods(result_hash, lod_cells, prefix, task=None):
+    """Simplifies GLB conversion result result_hash stored in FileDB with every
+    grid size of lod_cells. The levels and their manifest are stored in FileDB,
+    the manifest is linked from the result hash. Returns the manifest."""
+    fentry = FM.fdb.get(result_hash)
+    level_files = [FileGuard.mkstemp(dir=FM.tmp_folder, prefix=prefix, suffix='.lod{}.glb'.format(cells))
+                   for cells in lod_cells]
+    levels = []
+    try:
+        for level_file in level_files:
+            level_file.close_descriptor()
+        args = [sys.executable, MESHOPT_SCRIPT, '-v', '--simplify', ','.join(str(cells) for cells in lod_cells),
+                fentry.path] + [level_file.name for level_file in level_files]
+        run_converter(args, env=dict(NUMPY_CONVERTER_ENV), timeout=converter_timeout('glb'), task=task)
+        for cells, level_file in zip(lod_cells, level_files):
+            hash = hash_file(level_file.name, HASH_ALGORITHM)
+            size = os.path.getsize(level_file.name)
+            level_entry = FM.fdb.get_or_create(hash, move_from=level_file.name,
+                                               data={'filename': '{}.lod{}.glb'.format(prefix, cells)})
+            if not os.path.exists(level_file.name):
+                level_file.release()
+            if FM.compress_mode == 'ingest':
+                FM.compress(level_entry)
+            levels.append({'hash': hash, 'cells': cells, 'size': size})
+    finally:
+        for level_file in level_files:
+            level_file.close()
+
+    # Coarse to fine, the conversion result is the finest level. Grids finer than
+    # the mesh give the same level as the next coarser grid or the result itself.
+    unique_levels = []
+    for level in reversed(levels):
+        if level['hash'] != result_hash and (not unique_levels or unique_levels[-1]['hash'] != level['hash']):
+            unique_levels.append(level)
+    unique_levels.append({'hash': result_hash, 'cells': None, 'size': os.path.getsize(fentry.path)})
+    manifest = {'hash': result_hash, 'cells': list(lod_cells), 'levels': unique_levels}
+    data = json.dumps(manifest, sort_keys=True).encode()
+    hasher = new_hasher(HASH_ALGORITHM)
+    hasher.update(data)
+    with FileGuard.mkstemp(dir=FM.tmp_folder, prefix=prefix, suffix='.lod.json') as manifest_file:
+        with manifest_file.open('wb') as file:
+            file.write(data)
+        FM.fdb.get_or_create(hasher.hexdigest(), move_from=manifest_file.name,
+                             data={'filename': prefix + '.lod.json'})
+        if not os.path.exists(manifest_file.name):
+            manifest_file.release()
+    FM.fdb.set_link(lod_manifest_key(result_hash, lod_cells), hasher.hexdigest())
+    return manifest
+
+
+def load_lod_manifest(result_hash, lod_cells):
+    """Returns the manifest stored by generate_lods() for result_hash and the
+    grid sizes lod_cells, None if there is none or a level was evicted"""
+    fentry = FM.fdb.get_link(lod_manifest_key(result_hash, lod_cells))
+    if fentry is None:
+        return None
+    try:
+        with open(fentry.path, 'r') as file:
+            manifest = json.load(file)
+    except (IOError, OSError, ValueError):
+        return None
+    if manifest.get('cells') != list(lod_cells):
+        return None
+    if any(FM.fdb.get(level['hash']) is None for level in manifest['levels']):
+        return None
+    return manifest
+
+
 class ConversionTask(Task):
     def __init__(self,
                  uri=None,
                  uri_path=None,
-                 data=None,
+                 data_file=None,
+                 content_hash=None,
                  input_format_name=None,
                  input_format=None,
                  output_format_name=None,
                  output_format=None,
-                 get_hash=False):
+                 get_hash=False,
+                 mesh_options=None,
+                 lod_cells=None):
         super(ConversionTask, self).__init__(
             self.compute_id(input_format_name=input_format_name,
                             output_format_name=output_format_name,
                             uri=uri,
-                            data=data))
-        self._thread = None
+                            content_hash=content_hash,
+                            mesh_options=mesh_options,
+                            lod_cells=lod_cells))
+        self._scheduler = None
+        self._done = threading.Event()
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
         self._error = None
         self._status = None
+        self._steps = None
+        self._store = None
+        self._cancelled = False
+        self._processes = []
 
         self.uri = uri
         self.uri_path = uri_path
-        self.data = data
+        self.data_file = data_file
         self.input_format_name = input_format_name
         self.input_format = input_format
         self.output_format_name = output_format_name
         self.output_format = output_format
         self.get_hash = get_hash
+        self.mesh_options = mesh_options
+        self.lod_cells = lod_cells
 
+        self.content_hash = content_hash
         self.result_hash = None
-        self.result_file_name = None
 
     @staticmethod
-    def compute_id(input_format_name, output_format_name, uri, data):
+    def compute_id(input_format_name, output_format_name, uri, content_hash, mesh_options=None, lod_cells=None):
         hasher = hashlib.sha1()
         if not isinstance(input_format_name, bytes):
             input_format_name = input_format_name.encode()
@@ -608,10 +1601,20 @@ class ConversionTask(Task):
             hasher.update(b'uri')
             hasher.update(b'\0')
             hasher.update(uri.encode())
-        elif data:
+        elif content_hash:
             hasher.update(b'data')
             hasher.update(b'\0')
-            hasher.update(data.encode())
+            hasher.update(content_hash.encode())
+        if mesh_options is not None:
+            hasher.update(b'\0')
+            hasher.update(b'optimize')
+            hasher.update(b'\0')
+            hasher.update(mesh_options.key.encode())
+        if lod_cells:
+            hasher.update(b'\0')
+            hasher.update(b'lod')
+            hasher.update(b'\0')
+            hasher.update(','.join(str(cells) for cells in lod_cells).encode())
         return hasher.hexdigest()
 
     def set_error(self, error):
@@ -630,30 +1633,110 @@ class ConversionTask(Task):
     def set_status(self, status):
         with self._lock:
             self._status = status
+            self._notify_change()
 
     def get_status(self):
         with self._lock:
             return self._status
 
-    def start(self):
+    def attach_store(self, store):
+        """Publish state changes to TaskStore store"""
+        with self._lock:
+            self._store = store
+            self._publish()
+
+    def _publish(self):
+        # Must be called with self._lock held
+        if self._store is not None:
+            self._store.publish(self.task_id, os.getpid(), self._status, self._version, self._done.is_set(),
+                                self.result_hash, error_to_dict(self._error), self.conversion_path)
+
+    def set_steps(self, steps):
+        with self._lock:
+            self._steps = steps
+            self._notify_change()
+
+    @property
+    def conversion_path(self):
+        """List of conversion steps as dicts or None if not planned yet"""
+        with self._lock:
+            if self._steps is None:
+                return None
+            return [{'converter': step.converter.name, 'from': step.input_format, 'to': step.output_format}
+                    for step in self._steps]
+
+    def _notify_change(self):
+        with self._lock:
+            self._version += 1
+            self._changed.notify_all()
+            self._publish()
+
+    def _set_done(self):
         with self._lock:
-            if not self._thread:
-                self._thread = threading.Thread(target=self._run)
-                self._thread.daemon = 1
-                self._thread.start()
+            self._done.set()
             self.touch()
+            self._notify_change()
+
+    @property
+    def version(self):
+        """Counter incremented on every change of the task status"""
+        with self._lock:
+            return self._version
+
+    def wait_for_change(self, version, timeout=None):
+        """Waits until the task version differs from version or the task is finished,
+        returns the current version"""
+        with self._lock:
+            self._changed.wait_for(lambda: self._version != version or self._done.is_set(), timeout)
+            return self._version
+
+    def start(self, scheduler):
+        with self._lock:
+            if not self._scheduler:
+                if self.content_hash and self.use_cached_result(self.content_hash):
+                    self.destroy()
+                    self._set_done()
+                else:
+                    self.set_status('Waiting for conversion')
+                    scheduler.submit(self._execute)
+                self._scheduler = scheduler
+            self.touch()
+
+    def use_cached_result(self, content_hash):
+        """Takes the result of a previous conversion of the same input from FileDB,
+        returns True on success"""
+        global FM
+        key = result_cache_key(content_hash, self.input_format_name, self.output_format_name, self.mesh_options,
+                               self.lod_cells)
+        fentry = FM.fdb.get_link(key)
+        if fentry is None:
+            return False
+        if self.lod_cells and load_lod_manifest(fentry.name, self.lod_cells) is None:
+            # A level was evicted
+            return False
+        logger.info('Found cached conversion result {} for input {}'.format(fentry.name, content_hash))
+        FM.fdb.touch(fentry.name)
+        self.result_hash = fentry.name
+        self.set_status('Conversion succeeded')
+        return True
+
+    def queue_position(self):
+        with self._lock:
+            scheduler = self._scheduler
+        if scheduler is None or self._done.is_set():
+            return None
+        return scheduler.position(self._execute)
 
     def is_started(self):
         with self._lock:
-            return self._thread is not None
+            return self._scheduler is not None
 
     def is_finished(self):
-        with self._lock:
-            return self._thread is not None and not self._thread.is_alive()
+        return self._done.is_set()
 
     def is_alive(self):
         with self._lock:
-            return self._thread is not None and self._thread.is_alive()
+            return self._scheduler is not None and not self._done.is_set()
 
     def is_expired(self, max_sec=10 * 60):
         if not self.is_finished():
@@ -661,12 +1744,10 @@ class ConversionTask(Task):
         return super(ConversionTask, self).is_expired(max_sec)
 
     def stop(self, timeout=None):
-        with self._lock:
-            thread = self._thread
-        if thread:
-            thread.join(timeout=timeout)
+        if self.is_started():
+            self._done.wait(timeout=timeout)
             self.touch()
-            return thread.is_alive()
+            return self.is_alive()
         return True
 
     def __enter__(self):
@@ -675,96 +1756,344 @@ class ConversionTask(Task):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop()
 
+    def _execute(self):
+        try:
+            self._run()
+        except (ConversionError, BadRequestError) as e:
+            self.set_error(e)
+        except Exception as e:
+            logger.exception('Conversion task {} failed'.format(self.task_id))
+            self.set_error(ConversionError(message='Internal error: {}'.format(e), oserror=e))
+        finally:
+            if self.is_cancelled():
+                self.set_error(ConversionError(message='Conversion cancelled'))
+                self.set_status('Conversion cancelled')
+            elif self.get_error():
+                self.set_status('Conversion failed')
+            self.destroy()
+            self._set_done()
+
+    def is_cancelled(self):
+        with self._lock:
+            return self._cancelled
+
+    def add_process(self, process):
+        """Registers converter process killed by cancel()"""
+        with self._lock:
+            self._processes = [p for p in self._processes if p.returncode is None]
+            self._processes.append(process)
+            cancelled = self._cancelled
+        if cancelled:
+            kill_process_group(process)
+
+    def remove_process(self, process):
+        with self._lock:
+            if process in self._processes:
+                self._processes.remove(process)
+
+    def cancel(self):
+        """Stops the task. A queued task is removed from the scheduler queue,
+        converter processes of a running task are killed"""
+        with self._lock:
+            if self._cancelled or self._done.is_set():
+                return
+            self._cancelled = True
+            scheduler = self._scheduler
+            processes = list(self._processes)
+        logger.info('Cancel conversion task {}'.format(self.task_id))
+        if scheduler is None or scheduler.cancel(self._execute):
+            # Task was not running yet
+            self.set_error(ConversionError(message='Conversion cancelled'))
+            self.set_status('Conversion cancelled')
+            self.destroy()
+            self._set_done()
+            return
+        for process in processes:
+            kill_process_group(process)
+
     def _run(self):
-        global FM
+        global FM, SCHED
 
         if self.uri_path:
             head, tail = os.path.split(self.uri_path)
             prefix, suffix = os.path.splitext(tail)
         else:
+            tail = None
             prefix = 'output'
-            suffix = self.input_format.ext
+            suffix = self.input_format.ext if self.input_format else ''
 
+        content_hash = None
         with FileGuard.mkstemp(dir=FM.tmp_folder, prefix=prefix, suffix=suffix) as input_file:
 
             if self.uri:
-                logger.info("Download URI {} to file {}".format(self.uri, input_file.name))
-                self.set_status('Downloading URI: {}'.format(self.uri))
-
-                try:
-                    response = requests.get(self.uri, stream=True)
-                except requests.RequestException as e:
-                    logger.exception("HTTP Request Error")
-                    self.set_error(BadRequestError("HTTP Request Error: {}".format(e)))
+                with SCHED.stage('download'):
+                    logger.info("Download URI {} to file {}".format(self.uri, input_file.name))
+                    self.set_status('Downloading URI: {}'.format(self.uri))
+                    content_hash = self._download(input_file, tail)
+                    if self.result_hash:
+                        # URI was not modified and the result is cached
+                        return
+            elif self.data_file:
+                with self._lock:
+                    input_file.swap(self.data_file)
+
+            detected = self.input_format is None
+            if detected:
+                # 'auto' with a URI without known suffix
+                result = detect_input_format(input_file.name, tail)
+                if not result:
+                    self.set_error(BadRequestError('Could not detect input file format of URI {}'.format(self.uri)))
                     return
+                self.input_format_name, self.input_format = result
+                # Converters derive the format from the extension
+                input_file.rename(input_file.name + self.input_format.ext)
+
+            content_hash = content_hash or self.content_hash or hash_file(input_file.name, HASH_ALGORITHM)
+            if self.use_cached_result(content_hash):
+                return
 
+            if self.uri and not detected:
+                # Uploads are checked before the task is created
                 try:
-                    with input_file.open('wb') as file:
-                        for block in response.iter_content(1024):
-                            file.write(block)
-                        file.flush()
-                except requests.HTTPError as e:
-                    logger.exception("HTTP Error")
-                    self.set_error(BadRequestError("HTTP Error: {}".format(e)))
+                    check_input_format(input_file.name, self.input_format_name)
+                except BadRequestError as e:
+                    self.set_error(e)
                     return
-            elif self.data:
-                with input_file.open('wb') as file:
-                    file.write(self.data)
-
-            msg = "Converting file from format {} to format {}".format(self.input_format.name, self.output_format.name)
-            logger.info(msg)
-            self.set_status(msg)
 
-            use_ldrconverter = self.input_format_name in LDRCONVERTER_INPUT_FORMATS
-            use_assimp_converter = not use_ldrconverter or self.output_format_name not in LDRCONVERTER_OUTPUT_FORMATS
+            steps = plan_conversion(self.input_format_name, self.output_format_name,
+                                    os.path.getsize(input_file.name), self.mesh_options)
+            if steps is None:
+                self.set_error(BadRequestError('No conversion from format {} to format {}'.format(
+                    self.input_format.name, self.output_format.name)))
+                return
+            self.set_steps(steps)
 
             output_file = FileGuard.mkstemp(dir=FM.tmp_folder, prefix=prefix, suffix=self.output_format.ext)
             try:
 
-                tmp_file = None
-                try:
-                    if use_ldrconverter:
-                        if self.output_format_name not in LDRCONVERTER_OUTPUT_FORMATS:
-                            tmp_file = FileGuard.mkstemp(dir=FM.tmp_folder, prefix=prefix, suffix='.3ds')
-                            ldr_convert(input_file, tmp_file)
-                            input_file.swap(tmp_file)
-                        else:
-                            ldr_convert(input_file, output_file)
-
-                    if use_assimp_converter:
-                        assimp_convert(input_file, output_file)
-
-                finally:
-                    if tmp_file:
-                        tmp_file.close()
-
-                if self.get_hash:
-                    hash = hash_file(output_file.name)
-                    output_file.close_descriptor()
-                    fentry = FM.fdb.get_or_create(hash, move_from=output_file.name,
-                                                  data={'filename': prefix + self.output_format.ext})
+                with SCHED.stage('convert'):
+                    msg = "Converting file from format {} to format {}".format(self.input_format.name,
+                                                                               self.output_format.name)
+                    logger.info(msg)
+                    self.set_status(msg)
+
+                    run_pipeline(steps, input_file, output_file, prefix, task=self)
+
+                hash = hash_file(output_file.name, HASH_ALGORITHM)
+                output_file.close_descriptor()
+                fentry = FM.fdb.get_or_create(hash, move_from=output_file.name,
+                                              data={'filename': prefix + self.output_format.ext})
+                if not os.path.exists(output_file.name):
+                    # Moved to FileDB, an equal stored result is kept instead
                     output_file.release()
-                    self.result_hash = hash
-                    return
-                else:
-                    self.result_file_name = output_file.release()
+                if FM.compress_mode == 'ingest':
+                    self.set_status('Compressing conversion result')
+                    FM.compress(fentry)
+                if self.lod_cells:
+                    with SCHED.stage('convert'):
+                        self.set_status('Generating levels of detail')
+                        generate_lods(hash, self.lod_cells, prefix, task=self)
+                FM.fdb.set_link(result_cache_key(content_hash, self.input_format_name, self.output_format_name,
+                                                 self.mesh_options, self.lod_cells),
+                                hash)
+                self.result_hash = hash
+                self.set_status('Conversion succeeded')
 
             finally:
                 output_file.close()
-                if self.get_error():
-                    self.set_status('Conversion failed')
-                else:
-                    self.set_status('Conversion succeeded')
 
-        def destroy(self):
-            global FM
+    def _download(self, input_file, filename=None, conditional=True):
+        """Downloads self.uri to input_file, returns the content hash.
+
+        Inputs served with ETag or Last-Modified are kept in FileDB, the next
+        download of the URI is a conditional GET. When the server answers 304
+        the cached result is used or the input is copied from FileDB.
+        """
+        uri_key = uri_cache_key(self.uri)
+        cached = FM.fdb.get_link(uri_key) if conditional else None
+        validators = (cached.get('validators') or {}).get(self.uri) if cached is not None else None
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('lastModified'):
+                headers['If-Modified-Since'] = validators['lastModified']
 
-            if self.result_hash:
-                fentry = FM.fdb.get(self.result_hash)
-                FM.remove_later(fentry)
+        try:
+            response = HTTP_SESSION.get(self.uri, stream=True, headers=headers,
+                                        timeout=float(app.config['DOWNLOAD_TIMEOUT']) or None)
+        except requests.RequestException as e:
+            logger.exception("HTTP Request Error")
+            raise BadRequestError("HTTP Request Error: {}".format(e))
+
+        with contextlib.closing(response):
+            if response.status_code == 304 and headers:
+                logger.info('URI {} not modified, cached input {}'.format(self.uri, cached.name))
+                FM.fdb.touch(cached.name)
+                if self.input_format is not None and self.use_cached_result(cached.name):
+                    return cached.name
+                try:
+                    with open(cached.path, 'rb') as src, input_file.open('wb') as file:
+                        shutil.copyfileobj(src, file, DOWNLOAD_BLOCK_SIZE)
+                except (IOError, OSError):
+                    # Evicted in the meantime
+                    logger.exception('Could not copy cached input {}'.format(cached.name))
+                    return self._download(input_file, filename, conditional=False)
+                return cached.name
 
-            if self.result_file_name:
-                FM.remove_later(self.result_file_name)
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as e:
+                raise BadRequestError("HTTP Error: {}".format(e))
+
+            max_size = int(app.config['DOWNLOAD_MAX_SIZE'] or 0)
+            content_length = response.headers.get('Content-Length')
+            if max_size and content_length and content_length.isdigit() and int(content_length) > max_size:
+                raise BadRequestError('Size of URI content {} exceeds limit of {} bytes'.format(
+                    content_length, max_size))
+
+            try:
+                # Hash while downloading, the input is not read again
+                hasher = new_hasher(HASH_ALGORITHM)
+                size = 0
+                with input_file.open('wb') as file:
+                    for block in response.iter_content(int(app.config['DOWNLOAD_CHUNK_SIZE'])):
+                        if self.is_cancelled():
+                            raise ConversionError(message='Conversion cancelled')
+                        size += len(block)
+                        if max_size and size > max_size:
+                            raise BadRequestError('Size of URI content exceeds limit of {} bytes'.format(max_size))
+                        hasher.update(block)
+                        file.write(block)
+            except requests.RequestException as e:
+                logger.exception("HTTP Error")
+                raise BadRequestError("HTTP Error: {}".format(e))
+            content_hash = hasher.hexdigest()
+
+            validators = {}
+            if response.headers.get('ETag'):
+                validators['etag'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                validators['lastModified'] = response.headers['Last-Modified']
+            if validators:
+                fentry = FM.fdb.get_or_create(content_hash, copy_from=input_file.name,
+                                              data={'filename': filename or content_hash})
+                uris = dict(fentry.get('validators') or {})
+                uris[self.uri] = validators
+                fentry.update_data({'validators': uris})
+                FM.fdb.set_link(uri_key, content_hash)
+            return content_hash
+
+    def destroy(self):
+        # Conversion results are kept in FileDB as cache until evicted,
+        # only the uploaded input is released
+        with self._lock:
+            data_file, self.data_file = self.data_file, None
+        if data_file:
+            data_file.close()
+
+
+class RemoteTask(Task):
+    """Conversion task run by another server process, the state is read from the task store"""
+
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, store, state):
+        super(RemoteTask, self).__init__(state['task_id'])
+        self._store = store
+        self._state = self._check_owner(state, state['owner'])
+
+    @staticmethod
+    def _check_owner(state, owner):
+        # Task of an exited process or deleted unfinished task can not finish anymore
+        if not state['finished'] and (state['owner'] is None or not process_alive(state['owner'])):
+            state = dict(state,
+                         finished=True,
+                         status='Conversion failed',
+                         error={'type': 'conversion',
+                                'message': 'Conversion process {} exited'.format(owner),
+                                'internal': True})
+        return state
+
+    def refresh(self):
+        with self._lock:
+            owner = self._state['owner']
+        state = self._check_owner(self._store.load(self.task_id) or dict(self._state, owner=None), owner)
+        with self._lock:
+            self._state = state
+        return state
+
+    @property
+    def result_hash(self):
+        with self._lock:
+            return self._state['result_hash']
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._state['version']
+
+    @property
+    def conversion_path(self):
+        with self._lock:
+            return self._state['path']
+
+    def get_status(self):
+        with self._lock:
+            return self._state['status']
+
+    def get_error(self):
+        with self._lock:
+            return error_from_dict(self._state['error'])
+
+    def raise_error(self):
+        error = self.get_error()
+        if error:
+            raise error
+
+    def queue_position(self):
+        # Queue of the owner is not visible
+        return None
+
+    def touch(self):
+        super(RemoteTask, self).touch()
+        self._store.touch(self.task_id)
+
+    def start(self, scheduler):
+        self.touch()
+
+    def cancel(self):
+        # Owner process cancels the task within TaskManager.CANCEL_POLL_INTERVAL
+        self._store.request_cancel(self.task_id)
+
+    def is_started(self):
+        return True
+
+    def is_finished(self):
+        with self._lock:
+            return self._state['finished']
+
+    def is_alive(self):
+        return not self.is_finished()
+
+    def wait_for_change(self, version, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            state = self.refresh()
+            if state['version'] != version or state['finished']:
+                return state['version']
+            remaining = deadline - time.time() if deadline is not None else self.POLL_INTERVAL
+            if remaining <= 0:
+                return state['version']
+            time.sleep(min(remaining, self.POLL_INTERVAL))
+
+    def stop(self, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        while not self.refresh()['finished']:
+            if deadline is not None and time.time() >= deadline:
+                break
+            time.sleep(self.POLL_INTERVAL)
+        return self.is_alive()
 
 
 @app.route("/", methods=['GET'])
@@ -781,6 +2110,55 @@ def viewer():
     # return redirect(url_for('static', filename='Online3DViewer/website/index.html'))
 
 
+FILE_DELIVERY_MODES = ('wsgi', 'x-accel-redirect', 'x-sendfile')
+
+
+def send_stored_file(file_path, attachment_filename, etag=None, headers=None):
+    """Sends file stored in FILE_FOLDER as attachment.
+
+    Depending on FILE_DELIVERY the content is sent by the WSGI server
+    ('wsgi', using wsgi.file_wrapper when the server provides it) or only
+    the file location is returned to the front-end server in the
+    X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd) header.
+    Conditional requests are answered here, range requests are handled
+    by whoever sends the content.
+    """
+    delivery = app.config['FILE_DELIVERY']
+    if delivery == 'wsgi':
+        head, tail = os.path.split(file_path)
+        response = send_from_directory(head, tail, as_attachment=True, attachment_filename=attachment_filename,
+                                       conditional=False)
+    else:
+        response = Response(None, mimetype=mimetypes.guess_type(attachment_filename)[0] or 'application/octet-stream',
+                            direct_passthrough=True)
+        response.headers.set('Content-Disposition', 'attachment', filename=attachment_filename)
+        if delivery == 'x-accel-redirect':
+            rel_path = os.path.relpath(file_path, app.config['FILE_FOLDER']).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = url_quote(
+                app.config['FILE_DELIVERY_ACCEL_PREFIX'].rstrip('/') + '/' + rel_path)
+        elif delivery == 'x-sendfile':
+            response.headers['X-Sendfile'] = os.path.abspath(file_path)
+        else:
+            raise ValueError('Unknown FILE_DELIVERY mode {!r}, supported: {}'.format(
+                delivery, ', '.join(FILE_DELIVERY_MODES)))
+
+    if headers:
+        response.headers.update(headers)
+    if etag:
+        response.set_etag(etag)
+
+    if delivery == 'wsgi':
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response.make_conditional(request, accept_ranges=True, complete_length=os.path.getsize(file_path))
+
+    response.make_conditional(request)
+    if response.status_code == 304:
+        # Nothing to send, the front-end server must not replace the response
+        response.headers.pop('X-Accel-Redirect', None)
+        response.headers.pop('X-Sendfile', None)
+    return response
+
+
 @app.route("/api/hash/<hash>", methods=["GET"])
 @crossdomain(origin='*')
 def get_file_by_hash(hash):
@@ -789,14 +2167,36 @@ def get_file_by_hash(hash):
     fentry = FM.fdb.get(hash)
     if fentry is None:
         abort(404)
+    FM.fdb.touch(hash)
 
     attachment_filename = fentry.get('filename', hash)
 
-    file_path = fentry.path
-    head, tail = os.path.split(file_path)
+    encoding, file_path = FM.select_variant(fentry, request.accept_encodings)
 
-    # Send file back
-    return send_from_directory(head, tail, as_attachment=True, attachment_filename=attachment_filename)
+    # Send file back, content addressed by hash never changes: the hash is a strong ETag
+    headers = {'Cache-Control': 'public, max-age={}, immutable'.format(int(app.config['HASH_CACHE_MAX_AGE']))}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if FM.compress_encodings:
+        headers['Vary'] = 'Accept-Encoding'
+    return send_stored_file(file_path, attachment_filename,
+                            etag='{}.{}'.format(hash, encoding) if encoding else hash,
+                            headers=headers)
+
+
+@app.route("/api/lod/<hash>", methods=["GET"])
+@crossdomain(origin='*')
+def get_lod_manifest(hash):
+    """Levels of detail of conversion result hash generated with the lod parameter,
+    coarse to fine. Clients show the first level and replace it with the next ones.
+    The lod parameter selects the grid sizes like in conversions, default true."""
+    manifest = load_lod_manifest(hash, lod_cells_from_args(request.args) or lod_cells_from_args({'lod': 'true'}))
+    if manifest is None:
+        abort(404)
+    for level in manifest['levels']:
+        FM.fdb.touch(level['hash'])
+        level['url'] = url_for('get_file_by_hash', hash=level['hash'])
+    return jsonify(manifest)
 
 
 @app.route("/api/task/<task_id>", methods=["GET"])
@@ -807,6 +2207,22 @@ def get_task_status(task_id):
     if conv_task is None:
         abort(404)
 
+    # Long polling: wait until the task version differs from the version parameter
+    wait = request.args.get('wait', None)
+    if wait is not None and not conv_task.is_finished():
+        try:
+            wait = min(float(wait), float(app.config['TASK_MAX_WAIT']))
+        except ValueError:
+            return bad_request('Invalid wait parameter: {}'.format(wait))
+        version = request.args.get('version', None)
+        try:
+            version = int(version) if version is not None else conv_task.version
+        except ValueError:
+            return bad_request('Invalid version parameter: {}'.format(version))
+        if wait > 0:
+            conv_task.touch()
+            conv_task.wait_for_change(version, timeout=wait)
+
     if conv_task.is_finished():
         conv_task.touch()
         conv_task.stop()
@@ -815,6 +2231,53 @@ def get_task_status(task_id):
     return jsonify(conv_task)
 
 
+@app.route("/api/task/<task_id>", methods=["DELETE"])
+def cancel_task(task_id):
+    """Cancels the task, identical conversions requested later start anew"""
+    global TM
+
+    conv_task = TM.get_task(task_id)
+    if conv_task is None:
+        abort(404)
+    TM.cancel_task(conv_task)
+    return jsonify(conv_task)
+
+
+@app.route("/api/task/<task_id>/events", methods=["GET"])
+def get_task_events(task_id):
+    """Server-Sent Events stream of the task state, ends when the task is finished"""
+    global TM
+
+    conv_task = TM.get_task(task_id)
+    if conv_task is None:
+        abort(404)
+
+    heartbeat = float(app.config['TASK_EVENTS_HEARTBEAT'])
+
+    def generate():
+        version = None
+        while True:
+            if version is not None:
+                conv_task.wait_for_change(version, timeout=heartbeat)
+            conv_task.touch()
+            finished = conv_task.is_finished()
+            new_version = conv_task.version
+            if new_version != version:
+                version = new_version
+                yield 'data: {}\n\n'.format(json.dumps(conv_task, cls=CustomJSONEncoder))
+            else:
+                yield ': keep-alive\n\n'
+            if finished:
+                error = conv_task.get_error()
+                if error:
+                    yield 'event: failure\ndata: {}\n\n'.format(
+                        json.dumps({'message': getattr(error, 'message', str(error))}))
+                return
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route("/api/debug/tasks", methods=["GET"])
 def debug_get_tasks():
     global TM
@@ -825,9 +2288,10 @@ def debug_get_tasks():
             task_get_status = getattr(task, 'get_status')
             if callable(task_get_status):
                 status = task_get_status()
+            queue_position = getattr(task, 'queue_position', None)
             result.append({'hash': getattr(task, 'result_hash', None),
                            'taskTimestamp': task.timestamp,
-                           'filename': getattr(task, 'result_file_name', None),
+                           'taskQueuePosition': queue_position() if callable(queue_position) else None,
                            'taskFinished': task.is_finished(),
                            'taskExpired': task.is_expired(),
                            'taskAge': task.age,
@@ -837,32 +2301,37 @@ def debug_get_tasks():
     return jsonify(result)
 
 
+@app.route("/api/debug/converters", methods=["GET"])
+def debug_get_converters():
+    return jsonify({'converters': [{'name': converter.name,
+                                    'inputFormats': sorted(converter.input_formats),
+                                    'outputFormats': sorted(converter.output_formats),
+                                    'cost': converter.cost}
+                                   for converter in CONVERTERS.converters()],
+                    'measured': CONVERTERS.stats()})
+
+
 @app.route("/api/convert/<input_format_name>/<output_format_name>", methods=["GET", "POST"])
 def convert(input_format_name, output_format_name):
     global FM, FORMAT_INFO, TM
 
     uri = None
     uri_path = None
-    data = None
 
     if request.method == "GET":
         uri = request.args.get('uri', None)
         if uri is None:
             return error_response('Error: no URI specified', status_code=400)
         uri_path = urlparse(uri).path
-    elif request.method == "POST":
-        if not request.data:
-            return error_response("Data missing in POST request", status_code=400)
-        data = request.data
-    else:
+    elif request.method != "POST":
         return bad_request("Bad request")
 
-    if input_format_name == 'auto' and uri_path:
-        result = derive_format(uri_path)
-        if result:
+    if input_format_name == 'auto':
+        # URIs with unknown suffix are detected after the download, uploads after spooling
+        result = derive_format(uri_path) if uri_path else None
+        input_format = None
+        if result and result[0] in INPUT_FORMATS:
             input_format_name, input_format = result
-        else:
-            return bad_request('Could not derive input file format from URI {}'.format(uri))
     else:
         input_format = FORMAT_INFO.get(input_format_name)
         if not input_format:
@@ -872,6 +2341,23 @@ def convert(input_format_name, output_format_name):
     if not output_format:
         return bad_request('Unsupported destination format {}'.format(output_format_name))
 
+    mesh_options = MeshOptions.from_args(request.args)
+    if mesh_options is not None:
+        if numpy is None:
+            return bad_request('Mesh optimization is not available')
+        if output_format_name not in MESHOPT_FORMATS:
+            return bad_request('Mesh optimization is only supported for output format GLB')
+    lod_cells = lod_cells_from_args(request.args)
+    if lod_cells is not None:
+        if numpy is None:
+            return bad_request('Levels of detail are not available')
+        if output_format_name not in MESHOPT_FORMATS:
+            return bad_request('Levels of detail are only supported for output format GLB')
+
+    if input_format is not None and plan_conversion(input_format_name, output_format_name,
+                                                    mesh_options=mesh_options) is None:
+        return bad_request('No conversion from format {} to format {}'.format(input_format.name, output_format.name))
+
     as_task = request.args.get('as_task', None) in ('1', 'true')
     get_hash = as_task or (request.args.get('get_hash', None) in ('1', 'true'))
     timeout = request.args.get('timeout', None)
@@ -883,18 +2369,63 @@ def convert(input_format_name, output_format_name):
         if timeout <= 0:
             timeout = None
 
+    data_file = None
+    content_hash = None
+    if request.method == "POST":
+        # Spool request body to the file, memory usage does not depend on the upload size
+        max_size = app.config['MAX_CONTENT_LENGTH']
+        if max_size and request.content_length and request.content_length > max_size:
+            raise RequestEntityTooLarge()
+        data_file = FileGuard.mkstemp(dir=FM.tmp_folder, prefix='upload',
+                                      suffix=input_format.ext if input_format else '')
+        try:
+            with data_file.open('wb') as file:
+                content_hash, size = copy_and_hash(request.stream, file, max_size=max_size)
+            if size == 0:
+                data_file.close()
+                return error_response("Data missing in POST request", status_code=400)
+            # Reject inputs of the wrong format before a converter runs
+            if input_format is None:
+                filename = request.args.get('filename', None)
+                result = detect_input_format(data_file.name, filename)
+                if not result:
+                    data_file.close()
+                    return bad_request('Could not detect input file format')
+                input_format_name, input_format = result
+                if plan_conversion(input_format_name, output_format_name, mesh_options=mesh_options) is None:
+                    data_file.close()
+                    return bad_request('No conversion from format {} to format {}'.format(input_format.name,
+                                                                                          output_format.name))
+                # Converters derive the format from the extension
+                data_file.rename(data_file.name + input_format.ext)
+            else:
+                check_input_format(data_file.name, input_format_name)
+        except:
+            data_file.close()
+            raise
+
     try:
-        conv_task = TM.get_or_set_task(ConversionTask(uri=uri,
-                                                    uri_path=uri_path,
-                                                    data=data,
-                                                    input_format_name=input_format_name,
-                                                    input_format=input_format,
-                                                    output_format_name=output_format_name,
-                                                    output_format=output_format,
-                                                    get_hash=get_hash))
+        new_task = ConversionTask(uri=uri,
+                                  uri_path=uri_path,
+                                  data_file=data_file,
+                                  content_hash=content_hash,
+                                  input_format_name=input_format_name,
+                                  input_format=input_format,
+                                  output_format_name=output_format_name,
+                                  output_format=output_format,
+                                  get_hash=get_hash,
+                                  mesh_options=mesh_options,
+                                  lod_cells=lod_cells)
+        conv_task = TM.get_or_set_task(new_task)
+        if conv_task is not new_task:
+            new_task.destroy()
     except Exception as e:
         logger.exception(e)
-    conv_task.start()
+    try:
+        TM.start_task(conv_task)
+    except QueueFullError:
+        TM.del_task(conv_task)
+        raise
 
     if as_task:
         if conv_task.is_finished():
@@ -906,10 +2437,13 @@ def convert(input_format_name, output_format_name):
         conv_task.stop()
         conv_task.raise_error()
 
-        if conv_task.result_file_name:
-            head, tail = os.path.split(conv_task.result_file_name)
+        if isinstance(conv_task, RemoteTask):
+            # Result was stored by another process
+            FM.fdb.sync()
+        fentry = FM.fdb.get(conv_task.result_hash) if conv_task.result_hash and not get_hash else None
+        if fentry is not None:
             # Send file back
-            return send_from_directory(head, tail, as_attachment=True)
+            return send_stored_file(fentry.path, fentry.get('filename', fentry.name))
         else:
             return jsonify(conv_task)
 
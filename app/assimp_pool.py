@@ -0,0 +1,170 @@
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+
+import contextlib
+import json
+import logging
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assimp_worker.py')
+
+
+class AssimpWorkerError(Exception):
+    def __init__(self, message, exitcode=None):
+        self.message = message
+        self.exitcode = exitcode
+        super(AssimpWorkerError, self).__init__(message)
+
+
+class AssimpWorker(object):
+    """Persistent assimp_worker.py process in its own process group"""
+
+    START_TIMEOUT = 30
+
+    def __init__(self, env=None, cwd=None, preexec_fn=None):
+        self.jobs = 0
+        self.process = subprocess.Popen([sys.executable, WORKER_SCRIPT],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL,
+                                        env=env,
+                                        cwd=cwd,
+                                        universal_newlines=True,
+                                        start_new_session=True,
+                                        preexec_fn=preexec_fn)
+        reply = self._read_reply(self.START_TIMEOUT)
+        if not reply.get('ready'):
+            self.kill()
+            raise AssimpWorkerError(reply.get('error', 'Worker did not start'))
+        logger.info('Started assimp worker process {}'.format(self.process.pid))
+
+    def _read_reply(self, timeout=None):
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            self.kill()
+            raise subprocess.TimeoutExpired(WORKER_SCRIPT, timeout)
+        line = self.process.stdout.readline()
+        if not line:
+            self.kill()
+            raise AssimpWorkerError('Worker process exited', exitcode=self.process.returncode)
+        return json.loads(line)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def convert(self, input_path, output_path, format_id, timeout=None, cpu_limit=None):
+        """Converts input_path to output_path in export format format_id, raises
+        AssimpWorkerError on failure and subprocess.TimeoutExpired after timeout seconds,
+        the worker is killed in both cases unless assimp reported an error"""
+        self.jobs += 1
+        try:
+            self.process.stdin.write(json.dumps({'input': input_path,
+                                                 'output': output_path,
+                                                 'format': format_id,
+                                                 'cpu_limit': cpu_limit}) + '\n')
+            self.process.stdin.flush()
+        except (IOError, OSError):
+            self.kill()
+            raise AssimpWorkerError('Worker process exited', exitcode=self.process.returncode)
+        reply = self._read_reply(timeout)
+        if not reply.get('ok'):
+            raise AssimpWorkerError(reply.get('error', 'Conversion failed'))
+
+    def kill(self):
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self.process.wait()
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (IOError, OSError, subprocess.TimeoutExpired):
+                self.kill()
+
+
+class AssimpWorkerPool(object):
+    """Pool of at most size persistent assimp workers.
+
+    Workers are started on demand and replaced after max_jobs conversions,
+    after a timeout and when they die, so leaks of assimp are bounded.
+    """
+
+    def __init__(self, size, max_jobs=100, env=None, cwd=None, preexec_fn=None):
+        assert size > 0
+        self._size = size
+        self._max_jobs = max_jobs
+        self._env = env
+        self._cwd = cwd
+        self._preexec_fn = preexec_fn
+        self._cond = threading.Condition()
+        self._idle = []
+        self._count = 0
+        self._closed = False
+
+    def check(self):
+        """Starts one worker to check that pyassimp can be loaded, raises AssimpWorkerError otherwise"""
+        with self._acquire():
+            pass
+
+    @contextlib.contextmanager
+    def _acquire(self):
+        with self._cond:
+            while not self._idle and self._count >= self._size and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise AssimpWorkerError('Worker pool is closed')
+            worker = self._idle.pop() if self._idle else None
+            self._count += 1
+        try:
+            if worker is None:
+                worker = AssimpWorker(env=self._env, cwd=self._cwd, preexec_fn=self._preexec_fn)
+        except:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+        try:
+            yield worker
+        finally:
+            recycle = self._closed or not worker.is_alive() or (self._max_jobs and worker.jobs >= self._max_jobs)
+            if recycle:
+                worker.close()
+            with self._cond:
+                self._count -= 1
+                if not recycle:
+                    self._idle.append(worker)
+                self._cond.notify()
+
+    def convert(self, input_path, output_path, format_id, timeout=None, cpu_limit=None,
+                on_start=None, on_finish=None):
+        """Runs AssimpWorker.convert() in an idle worker, on_start and on_finish
+        are called with the worker process before and after the conversion"""
+        with self._acquire() as worker:
+            if on_start is not None:
+                on_start(worker.process)
+            try:
+                worker.convert(input_path, output_path, format_id, timeout=timeout, cpu_limit=cpu_limit)
+            finally:
+                if on_finish is not None:
+                    on_finish(worker.process)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for worker in idle:
+            worker.close()
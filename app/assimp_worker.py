@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+"""
+    Persistent assimp worker process of AssimpWorkerPool
+
+    Loads assimp once through pyassimp and converts files on request.
+    Requests and replies are JSON objects, one per line, on stdin and
+    stdout. The first reply reports whether pyassimp could be loaded.
+
+    Request: {"input": path, "output": path, "format": export format ID,
+              "cpu_limit": seconds or null}
+    Reply:   {"ok": true} or {"ok": false, "error": message}
+"""
+
+import json
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def main():
+    # Libraries may print to stdout, keep it for the protocol only
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def reply(message):
+        replies.write(json.dumps(message) + '\n')
+        replies.flush()
+
+    try:
+        import pyassimp
+    except Exception as e:
+        reply({'ready': False, 'error': 'Could not load pyassimp: {}'.format(e)})
+        return 1
+    reply({'ready': True})
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        cpu_limit = request.get('cpu_limit')
+        if cpu_limit and resource is not None:
+            # RLIMIT_CPU counts the whole process lifetime, allow cpu_limit more seconds
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            soft = int(usage.ru_utime + usage.ru_stime + cpu_limit) + 1
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.RLIM_INFINITY))
+        try:
+            # No post-processing, like 'assimp export'
+            with pyassimp.load(request['input'], processing=0) as scene:
+                pyassimp.export(scene, request['output'], file_type=request['format'], processing=0)
+        except Exception as e:
+            reply({'ok': False, 'error': str(e)})
+        else:
+            reply({'ok': True})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+
+import gzip
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BLOCK_SIZE = 1024 * 1024
+
+# Supported HTTP content codings, in order of preference
+CONTENT_ENCODINGS = []
+if brotli is not None:
+    CONTENT_ENCODINGS.append('br')
+CONTENT_ENCODINGS.append('gzip')
+
+
+def compress_file(src_path, dst_path, encoding, block_size=BLOCK_SIZE):
+    """Writes content of src_path compressed with HTTP content coding encoding to dst_path"""
+    if encoding == 'gzip':
+        with open(src_path, 'rb') as src:
+            # mtime=0 makes output depend on the content only
+            with gzip.GzipFile(dst_path, 'wb', compresslevel=9, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, block_size)
+    elif encoding == 'br':
+        if brotli is None:
+            raise ValueError('Content encoding br requires the brotli module')
+        compressor = brotli.Compressor(quality=11)
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            buf = src.read(block_size)
+            while len(buf) > 0:
+                dst.write(compressor.process(buf))
+                buf = src.read(block_size)
+            dst.write(compressor.finish())
+    else:
+        raise ValueError('Unknown content encoding {!r}, supported: {}'.format(
+            encoding, ', '.join(CONTENT_ENCODINGS)))
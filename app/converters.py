@@ -0,0 +1,159 @@
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+
+import collections
+import heapq
+import itertools
+import threading
+
+# Input size the static costs of converters are given for
+REFERENCE_SIZE = 1024 * 1024
+
+# One converter invocation: converter.func() converts from input_format to output_format
+ConversionStep = collections.namedtuple('ConversionStep', ['converter', 'input_format', 'output_format'])
+
+
+class Converter(object):
+    """Converter tool, func(input_file, output_file, timeout, task) converts any of
+    input_formats to any of output_formats within timeout seconds, task can cancel
+    the conversion. cost is the estimated wall time in seconds of the conversion of
+    an input of REFERENCE_SIZE bytes, used until the first conversion was measured."""
+
+    def __init__(self, name, func, input_formats, output_formats, cost=1.0):
+        self.name = name
+        self.func = func
+        self.input_formats = frozenset(input_formats)
+        self.output_formats = frozenset(output_formats)
+        self.cost = cost
+
+    def __repr__(self):
+        return 'Converter({!r})'.format(self.name)
+
+
+class EdgeStats(object):
+    """Exponential moving averages of wall time, input and output size of one edge"""
+
+    ALPHA = 0.2
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+        self.input_size = 0.0
+        self.output_size = 0.0
+
+    def record(self, elapsed, input_size, output_size):
+        alpha = self.ALPHA if self.count else 1.0
+        self.count += 1
+        self.elapsed += alpha * (elapsed - self.elapsed)
+        self.input_size += alpha * (input_size - self.input_size)
+        self.output_size += alpha * (output_size - self.output_size)
+
+    def estimate(self, input_size):
+        """Returns tuple (elapsed, output_size) estimated for input_size,
+        both scale linearly with the input size"""
+        if not input_size or not self.input_size:
+            return self.elapsed, self.output_size or input_size
+        scale = input_size / self.input_size
+        return self.elapsed * scale, self.output_size * scale
+
+    def to_dict(self):
+        return {'count': self.count,
+                'elapsed': self.elapsed,
+                'inputSize': self.input_size,
+                'outputSize': self.output_size}
+
+
+class ConverterRegistry(object):
+    """Format graph with converters as edges.
+
+    plan() returns the conversion path with the lowest estimated wall time,
+    estimates are learned from the conversions reported with record().
+    Estimates scale with the input size. Unmeasured edges are estimated not
+    faster than the slowest measured edge and every edge adds HOP_PENALTY, so
+    a detour only beats a direct edge when measurements show it is faster.
+    """
+
+    HOP_PENALTY = 0.1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._converters = collections.OrderedDict()
+        self._stats = {}
+
+    def register(self, converter):
+        with self._lock:
+            self._converters[converter.name] = converter
+
+    def unregister(self, name):
+        with self._lock:
+            self._converters.pop(name, None)
+
+    def get(self, name):
+        with self._lock:
+            return self._converters.get(name)
+
+    def converters(self):
+        with self._lock:
+            return list(self._converters.values())
+
+    def _measured_floor(self, input_size):
+        """Returns the estimate of the slowest measured edge for input_size"""
+        # Must be called with self._lock held
+        measured = [stats.estimate(input_size)[0] for stats in self._stats.values() if stats.count]
+        return max(measured or [0.0])
+
+    def _estimate(self, step, input_size, floor=0.0):
+        """Returns tuple (elapsed, output_size) of step, unmeasured steps are not
+        estimated faster than floor"""
+        # Must be called with self._lock held
+        stats = self._stats.get(step)
+        if stats is None or not stats.count:
+            elapsed = step.converter.cost * (input_size / REFERENCE_SIZE if input_size else 1.0)
+            elapsed, output_size = max(elapsed, floor), input_size
+        else:
+            elapsed, output_size = stats.estimate(input_size)
+        return elapsed + self.HOP_PENALTY, output_size
+
+    def plan(self, input_format, output_format, input_size=None):
+        """Returns the cheapest list of ConversionStep from input_format to
+        output_format, at least one step long, or None if there is no path"""
+        with self._lock:
+            converters = list(self._converters.values())
+            floor = self._measured_floor(input_size)
+            counter = itertools.count()
+            queue = [(0.0, next(counter), input_format, input_size, ())]
+            settled = set()
+            while queue:
+                cost, _, fmt, size, path = heapq.heappop(queue)
+                if path:
+                    if fmt == output_format:
+                        return list(path)
+                    if fmt in settled:
+                        continue
+                    settled.add(fmt)
+                for converter in converters:
+                    if fmt not in converter.input_formats:
+                        continue
+                    for next_fmt in converter.output_formats:
+                        if next_fmt in settled:
+                            continue
+                        step = ConversionStep(converter, fmt, next_fmt)
+                        elapsed, next_size = self._estimate(step, size, floor)
+                        heapq.heappush(queue, (cost + elapsed, next(counter), next_fmt, next_size, path + (step,)))
+            return None
+
+    def record(self, step, elapsed, input_size, output_size):
+        """Reports wall time and sizes of a finished conversion step"""
+        with self._lock:
+            stats = self._stats.get(step)
+            if stats is None:
+                stats = self._stats[step] = EdgeStats()
+            stats.record(elapsed, input_size, output_size)
+
+    def stats(self):
+        """Returns list of measured edges as dicts"""
+        with self._lock:
+            return [dict(stats.to_dict(), converter=step.converter.name, input=step.input_format,
+                         output=step.output_format)
+                    for step, stats in self._stats.items()]
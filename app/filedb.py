@@ -2,21 +2,28 @@
 # the LICENSE file found in the top-level directory of this distribution.
 # You may not use this file except in compliance with the License.
 
+import copy
 import fasteners
+import logging
 import os
 import os.path
 import threading
 import json
 import six
 import shutil
+import sqlite3
+import time
 try:
     from .utils import obj_merge
 except:
     from utils import obj_merge
 
+logger = logging.getLogger(__name__)
+
 class FileEntry(object):
     def __init__(self, fdb, name, data=None, move_from=None, copy_from=None):
         assert data is None or isinstance(data, dict)
+        self._fdb = fdb
         self._name = name
         self._path = os.path.join(fdb.path, name)
         self.thread_lock = threading.RLock()
@@ -46,29 +53,66 @@ class FileEntry(object):
     def path(self):
         return self._path
 
-    def remove(self):
+    def remove(self, remove_links=True):
+        """Remove the file, its metadata and lock files, variants and, unless
+        remove_links is False, the links to it."""
         with self.thread_lock:
             with self.process_lock:
                 os.remove(self._path)
+                for path in (self.data_path, self._path + '.lock'):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        self._fdb.entry_removed(self, remove_links=remove_links)
 
     def sync(self):
+        """Write local changes of the metadata since the last sync() and read
+        the changes of other processes."""
         with self.thread_lock:
             with self.process_lock:
-                if os.path.exists(self.data_path):
-                    with open(self.data_path, 'r') as fd:
-                        try:
-                            self.disk_data = json.load(fd)
-                        except:
-                            pass
-                if self.disk_data is None:
-                    self.disk_data = {}
+                synced = self.disk_data
+                disk_data = self._read_data()
                 if self.data is None:
-                    self.data = self.disk_data.copy()
-                if self.disk_data != self.data:
-                    self.data = obj_merge(self.data, self.disk_data)
+                    data = copy.deepcopy(disk_data)
+                elif synced is None:
+                    data = obj_merge(self.data, disk_data)
+                else:
+                    # Keys not changed locally take the value on disk, other processes may have changed them
+                    changed = dict((key, value) for key, value in self.data.items()
+                                   if key not in synced or synced[key] != value)
+                    data = obj_merge(changed, disk_data)
+                    for key in synced:
+                        if key not in self.data:
+                            data.pop(key, None)
+                if data != disk_data:
                     with open(self.data_path, 'w') as fd:
-                        json.dump(self.data, fd, separators=(',', ':'))
-                    self.disk_data = self.data.copy()
+                        json.dump(data, fd, separators=(',', ':'))
+                self.data = data
+                self.disk_data = copy.deepcopy(data)
+
+    def _read_data(self):
+        # Must be called with process_lock held
+        if os.path.exists(self.data_path):
+            with open(self.data_path, 'r') as fd:
+                try:
+                    return json.load(fd)
+                except ValueError:
+                    pass
+        return {}
+
+    def modify_data(self, func):
+        """Apply func to the metadata dict read from disk while holding the
+        process lock, so concurrent changes of other processes are kept."""
+        with self.thread_lock:
+            with self.process_lock:
+                data = self._read_data()
+                func(data)
+                with open(self.data_path, 'w') as fd:
+                    json.dump(data, fd, separators=(',', ':'))
+                self.data = data
+                self.disk_data = copy.deepcopy(data)
+            return data
 
     def update_data(self, new_data):
         with self.thread_lock:
@@ -105,17 +149,251 @@ class FileEntry(object):
         return 'FileEntry(name={!r}, data={!r})'.format(self.name, self.data)
 
 
-class FileDB(object):
+EVICTION_POLICIES = ('lru', 'lfu', 'gdsf')
+
+
+class BaseFileDB(object):
+    """Common part of the FileDB backends: store directory, locks,
+    variants, eviction and the background threads that periodically
+    call reconcile() and evict().
+
+    Variants are alternative representations of an entry (e.g. compressed
+    copies), stored in .variants/<name>/<variant> and removed together
+    with the entry.
+    """
+
+    VARIANTS_NAME = '.variants'
+
     def __init__(self, path):
         self.path = path
         if not os.path.exists(self.path):
             os.makedirs(self.path)
+        self.variants_path = os.path.join(self.path, self.VARIANTS_NAME)
         self.thread_lock = threading.RLock()
         self.process_lock = fasteners.InterProcessLock(os.path.join(self.path, '.lock'))
+        self._background = {}
+        self._background_stop = threading.Event()
+        self._gdsf_clock = 0.0
+
+    def sync(self):
+        pass
+
+    def reconcile(self):
+        pass
+
+    def remove(self, name):
+        pass
+
+    def variant_path(self, name, variant, create=False):
+        """Returns path of the variant of the entry name."""
+        variant_dir = os.path.join(self.variants_path, name)
+        if create and not os.path.exists(variant_dir):
+            os.makedirs(variant_dir)
+        return os.path.join(variant_dir, variant)
+
+    def _remove_variants(self, name):
+        shutil.rmtree(os.path.join(self.variants_path, name), ignore_errors=True)
+
+    def _variant_sizes(self):
+        """Returns dict mapping entry names to the total size of their variants."""
+        sizes = {}
+        if not os.path.exists(self.variants_path):
+            return sizes
+        for name in os.listdir(self.variants_path):
+            variant_dir = os.path.join(self.variants_path, name)
+            try:
+                variants = os.listdir(variant_dir)
+            except OSError:
+                continue
+            size = 0
+            for variant in variants:
+                try:
+                    size += os.path.getsize(os.path.join(variant_dir, variant))
+                except OSError:
+                    pass
+            sizes[name] = size
+        return sizes
+
+    def _prune_variants(self, is_entry):
+        if os.path.exists(self.variants_path):
+            for name in os.listdir(self.variants_path):
+                if not is_entry(name):
+                    self._remove_variants(name)
+
+    def touch(self, name):
+        """Record an access to the entry name."""
+        pass
+
+    def usage(self):
+        """Returns list of (name, size, accessed, hits, priority) tuples for all
+        entries, size includes variants and other files stored with the entry,
+        priority is the GDSF priority of the last insertion or access."""
+        return []
+
+    def gdsf_priority(self, hits, size):
+        """Returns the GDSF priority of an entry inserted or accessed now, the
+        priority of the last evicted entry plus the frequency per byte."""
+        return self._gdsf_clock + float(hits + 1) / max(size, 1)
+
+    def evict(self, max_size=None, max_entries=None, policy='lru'):
+        """Remove entries until the store holds at most max_size bytes and
+        max_entries entries, returns list of removed entry names.
+
+        policy selects the victims: 'lru' - least recently accessed first,
+        'lfu' - least frequently accessed first, 'gdsf' - Greedy-Dual-Size-Frequency,
+        lowest priority stored on insertion and access first, see gdsf_priority().
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError('Unknown eviction policy {!r}, supported: {}'.format(
+                policy, ', '.join(EVICTION_POLICIES)))
+        usage = self.usage()
+        total_size = sum(u[1] for u in usage)
+        count = len(usage)
+
+        def over_budget():
+            return (max_size and total_size > max_size) or (max_entries and count > max_entries)
+
+        if not over_budget():
+            return []
+
+        if policy == 'lru':
+            usage.sort(key=lambda u: u[2])
+        elif policy == 'lfu':
+            usage.sort(key=lambda u: (u[3], u[2]))
+        else:
+            usage.sort(key=lambda u: (u[4], u[2]))
+
+        removed = []
+        for name, size, accessed, hits, priority in usage:
+            if not over_budget():
+                break
+            if policy == 'gdsf':
+                # Entries inserted or accessed from now on age the remaining ones
+                self._gdsf_clock = max(self._gdsf_clock, priority)
+            total_size -= size
+            count -= 1
+            removed.append(name)
+        self._remove_entries(removed)
+        return removed
+
+    def _remove_entries(self, names):
+        for name in names:
+            self.remove(name)
+
+    def _start_background(self, name, interval, func):
+        with self.thread_lock:
+            if name in self._background:
+                return
+            self._background_stop.clear()
+
+            def run():
+                while not self._background_stop.wait(interval):
+                    try:
+                        func()
+                    except Exception:
+                        logger.exception('FileDB {} failed'.format(name))
+
+            thread = threading.Thread(target=run, name='FileDB-' + name)
+            thread.daemon = True
+            thread.start()
+            self._background[name] = thread
+
+    def start_reconciler(self, interval):
+        """Run reconcile() every interval seconds in a daemon thread."""
+        self._start_background('reconciler', interval, self.reconcile)
+
+    def start_evictor(self, interval, max_size=None, max_entries=None, policy='lru'):
+        """Run evict() every interval seconds in a daemon thread."""
+        self._start_background('evictor', interval,
+                               lambda: self.evict(max_size=max_size, max_entries=max_entries, policy=policy))
+
+    def stop_background(self):
+        with self.thread_lock:
+            threads = list(self._background.values())
+            self._background.clear()
+        self._background_stop.set()
+        for thread in threads:
+            thread.join()
+
+
+class FileDB(BaseFileDB):
+    """Directory of files with attached metadata.
+
+    The in-memory index of entries is kept up to date incrementally:
+    every process appends added and removed entry names to a journal file,
+    and sync() only applies journal records written since the last call.
+    A full directory rescan is done by reconcile(), which runs on
+    construction and, optionally, periodically in a background thread.
+    """
+
+    JOURNAL_NAME = '.journal'
+    JOURNAL_MAX_SIZE = 1024 * 1024
+    LINKS_NAME = '.links'
+
+    def __init__(self, path, reconcile_interval=None):
+        super(FileDB, self).__init__(path)
+        self.journal_path = os.path.join(self.path, self.JOURNAL_NAME)
+        self.links_path = os.path.join(self.path, self.LINKS_NAME)
+        if not os.path.exists(self.links_path):
+            os.makedirs(self.links_path)
+        self._journal_id = None
+        self._journal_offset = 0
+        self._hits = {}
         self.entries = {}
-        self.sync()
+        self.reconcile()
+        # Priorities of all entries are at least the priority of the last victim
+        self._gdsf_clock = min([entry.data.get('priority', 0.0) for entry in self.entries.values()] or [0.0])
+        if reconcile_interval:
+            self.start_reconciler(reconcile_interval)
+
+    def _journal_stat(self):
+        try:
+            st = os.stat(self.journal_path)
+        except OSError:
+            return None, 0
+        return (st.st_dev, st.st_ino), st.st_size
+
+    def _journal_append(self, op, name):
+        # Must be called with process_lock held
+        with open(self.journal_path, 'ab') as fd:
+            fd.write(op + name.encode('utf-8') + b'\n')
+
+    def _add_entry(self, name):
+        entry = self.entries.get(name, None)
+        if entry is None and os.path.isfile(os.path.join(self.path, name)):
+            entry = FileEntry(fdb=self, name=name)
+            self.entries[name] = entry
+        return entry
+
+    def _drop_entry(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            entry.close()
 
     def sync(self):
+        """Apply journal records written since the last call, usually O(1)."""
+        with self.thread_lock:
+            journal_id, size = self._journal_stat()
+            if journal_id == self._journal_id and size == self._journal_offset:
+                return
+            if journal_id != self._journal_id or size < self._journal_offset:
+                # Journal was compacted by another process
+                self.reconcile()
+                return
+            with self.process_lock:
+                with open(self.journal_path, 'rb') as fd:
+                    fd.seek(self._journal_offset)
+                    records = fd.read()
+                    self._journal_offset = fd.tell()
+            for record in records.splitlines():
+                op, name = record[:1], record[1:].decode('utf-8')
+                if op == b'+':
+                    self._add_entry(name)
+                elif op == b'-':
+                    self._drop_entry(name)
+
+    def reconcile(self):
+        """Rescan the whole directory and rebuild the index of entries."""
         with self.thread_lock:
             with self.process_lock:
                 if os.path.exists(self.path):
@@ -148,8 +426,7 @@ class FileDB(object):
                             remove_entries.add(entry_name)
 
                     for entry_name in remove_entries:
-                        self.entries[entry_name].close()
-                        del self.entries[entry_name]
+                        self._drop_entry(entry_name)
 
                     for fname in lock_files:
                         if fname[:-5] not in self.entries:
@@ -158,6 +435,62 @@ class FileDB(object):
                         if fname[:-5] not in self.entries:
                             os.remove(os.path.join(self.path, fname))
 
+                    for key in os.listdir(self.links_path):
+                        link_path = os.path.join(self.links_path, key)
+                        try:
+                            with open(link_path, 'r') as fd:
+                                name = fd.read()
+                            if name not in self.entries:
+                                os.remove(link_path)
+                        except (IOError, OSError):
+                            pass
+
+                    self._prune_variants(lambda name: name in self.entries)
+
+                journal_id, size = self._journal_stat()
+                if journal_id is None or size > self.JOURNAL_MAX_SIZE:
+                    # Start a new journal, the index now reflects the directory content
+                    tmp_path = self.journal_path + '.tmp'
+                    open(tmp_path, 'wb').close()
+                    os.rename(tmp_path, self.journal_path)
+                    journal_id, size = self._journal_stat()
+                self._journal_id = journal_id
+                self._journal_offset = size
+
+    def entry_removed(self, entry, remove_links=True):
+        with self.thread_lock:
+            with self.process_lock:
+                self._journal_append(b'-', entry.name)
+                self._remove_variants(entry.name)
+                if remove_links:
+                    self._remove_links(set((entry.name,)))
+            if self.entries.get(entry.name) is entry:
+                del self.entries[entry.name]
+
+    def _remove_links(self, names):
+        """Remove the links to the entries of set names."""
+        # Must be called with process_lock held
+        for key in os.listdir(self.links_path):
+            link_path = os.path.join(self.links_path, key)
+            try:
+                with open(link_path, 'r') as fd:
+                    if fd.read() in names:
+                        os.remove(link_path)
+            except (IOError, OSError):
+                pass
+
+    def _remove_entries(self, names):
+        # Links are removed with one scan of the links directory
+        removed = set()
+        for name in names:
+            entry = self.get(name)
+            if entry is not None:
+                entry.remove(remove_links=False)
+                removed.add(name)
+        if removed:
+            with self.process_lock:
+                self._remove_links(removed)
+
     def __contains__(self, item):
         with self.thread_lock:
             return item in self.entries
@@ -166,18 +499,347 @@ class FileDB(object):
         with self.thread_lock:
             return self.entries.get(name, default)
 
+    def remove(self, name):
+        entry = self.get(name)
+        if entry is not None:
+            entry.remove()
+
+    def touch(self, name):
+        """Record an access to the entry name.
+
+        The access time is kept as atime of the file, hit counts are
+        collected in memory and flushed to the entry data with the new GDSF
+        priority by usage().
+        """
+        entry = self.get(name)
+        if entry is None:
+            return
+        try:
+            st = os.stat(entry.path)
+            os.utime(entry.path, (time.time(), st.st_mtime))
+        except OSError:
+            return
+        with self.thread_lock:
+            self._hits[name] = self._hits.get(name, 0) + 1
+
+    def usage(self):
+        with self.thread_lock:
+            hits, self._hits = self._hits, {}
+            entries = list(self.entries.values())
+        variant_sizes = self._variant_sizes()
+        result = []
+        for entry in entries:
+            try:
+                st = os.stat(entry.path)
+            except OSError:
+                continue
+            if entry.name in hits:
+                count = hits[entry.name]
+
+                def add_hits(data):
+                    data['hits'] = data.get('hits', 0) + count
+                    data['priority'] = self.gdsf_priority(data['hits'], st.st_size)
+
+                entry.modify_data(add_hits)
+            size = st.st_size + variant_sizes.get(entry.name, 0)
+            try:
+                size += os.path.getsize(entry.data_path)
+            except OSError:
+                pass
+            result.append((entry.name, size, st.st_atime, entry.data.get('hits', 0),
+                           entry.data.get('priority', 0.0)))
+        return result
+
+    def set_link(self, key, name):
+        """Persistently associate key with the entry name."""
+        link_path = os.path.join(self.links_path, key)
+        tmp_path = '{}.{}.tmp'.format(link_path, threading.current_thread().ident)
+        with open(tmp_path, 'w') as fd:
+            fd.write(name)
+        os.rename(tmp_path, link_path)
+
+    def get_link(self, key, default=None):
+        """Returns the entry associated with key by set_link() if it still exists."""
+        try:
+            with open(os.path.join(self.links_path, key), 'r') as fd:
+                name = fd.read()
+        except (IOError, OSError):
+            return default
+        entry = self.get(name)
+        if entry is None:
+            # Entry may be added by another process after the last sync()
+            self.sync()
+            entry = self.get(name)
+        return entry if entry is not None else default
+
     def get_or_create(self, name, data=None, move_from=None, copy_from=None):
         with self.thread_lock:
             entry = self.entries.get(name, None)
             if not entry:
+                source = move_from or copy_from
+                data = dict(data or {})
+                data.setdefault('priority', self.gdsf_priority(0, os.path.getsize(source) if source else 0))
                 with self.process_lock:
                     entry = FileEntry(fdb=self, name=name, data=data, move_from=move_from, copy_from=copy_from)
                     self.entries[name] = entry
+                    self._journal_append(b'+', name)
             return entry
 
     def close(self):
+        self.stop_background()
         with self.thread_lock:
             with self.process_lock:
                 for entry in six.itervalues(self.entries):
                     entry.close()
                 self.entries.clear()
+
+
+class SQLiteFileEntry(object):
+    """FileEntry whose metadata is stored in the index of a SQLiteFileDB."""
+
+    def __init__(self, fdb, name, data=None):
+        self._fdb = fdb
+        self._name = name
+        self._path = os.path.join(fdb.path, name)
+        self.data = data if data is not None else {}
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def path(self):
+        return self._path
+
+    def remove(self):
+        self._fdb.remove(self._name)
+
+    def sync(self):
+        data = self._fdb.load_data(self._name)
+        if data is not None:
+            self.data = data
+
+    def _modify(self, func):
+        self.data = self._fdb.modify_data(self._name, func)
+
+    def update_data(self, new_data):
+        self._modify(lambda data: data.update(new_data))
+
+    def get(self, key, default=None):
+        self.sync()
+        return self.data.get(key, default)
+
+    def __setitem__(self, key, value):
+        self._modify(lambda data: data.__setitem__(key, value))
+
+    def __getitem__(self, item):
+        self.sync()
+        return self.data[item]
+
+    def __delitem__(self, key):
+        self._modify(lambda data: data.__delitem__(key))
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return 'SQLiteFileEntry(name={!r}, data={!r})'.format(self.name, self.data)
+
+
+class SQLiteFileDB(BaseFileDB):
+    """FileDB backend keeping the metadata of all entries in one SQLite index.
+
+    There are no per-entry .data and .lock sidecar files, lookups are
+    primary key queries, and the only inter-process lock is the store-wide
+    one. reconcile() imports sidecars left by the FileDB backend, so an
+    existing store is migrated by opening it with this backend.
+    """
+
+    INDEX_NAME = '.index.sqlite'
+
+    def __init__(self, path, reconcile_interval=None):
+        super(SQLiteFileDB, self).__init__(path)
+        self.index_path = os.path.join(self.path, self.INDEX_NAME)
+        self._db = sqlite3.connect(self.index_path, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+        with self.thread_lock:
+            with self.process_lock:
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                                 'name TEXT PRIMARY KEY, '
+                                 'size INTEGER NOT NULL DEFAULT 0, '
+                                 'created REAL NOT NULL, '
+                                 'accessed REAL NOT NULL, '
+                                 'hits INTEGER NOT NULL DEFAULT 0, '
+                                 'priority REAL NOT NULL DEFAULT 0, '
+                                 'data TEXT NOT NULL)')
+                self._db.execute('CREATE TABLE IF NOT EXISTS links ('
+                                 'key TEXT PRIMARY KEY, '
+                                 'name TEXT NOT NULL)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS links_name ON links (name)')
+        self.reconcile()
+        with self.thread_lock:
+            # Priorities of all entries are at least the priority of the last victim
+            self._gdsf_clock = self._db.execute('SELECT MIN(priority) FROM entries').fetchone()[0] or 0.0
+        if reconcile_interval:
+            self.start_reconciler(reconcile_interval)
+
+    def _insert(self, name, data):
+        # Must be called with thread_lock held
+        path = os.path.join(self.path, name)
+        st = os.stat(path)
+        now = time.time()
+        self._db.execute('INSERT OR IGNORE INTO entries (name, size, created, accessed, priority, data) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (name, st.st_size, st.st_mtime, now, self.gdsf_priority(0, st.st_size),
+                          json.dumps(data or {}, separators=(',', ':'))))
+
+    def reconcile(self):
+        """Synchronize the index with the directory content and import
+        metadata from sidecar files."""
+        with self.thread_lock:
+            with self.process_lock:
+                files = set()
+                sidecars = []
+                for fname in os.listdir(self.path):
+                    fpath = os.path.join(self.path, fname)
+                    if fname.startswith('.') or os.path.isdir(fpath):
+                        pass
+                    elif fname.endswith('.lock') or fname.endswith('.data'):
+                        sidecars.append(fname)
+                    else:
+                        files.add(fname)
+
+                known = set(row[0] for row in self._db.execute('SELECT name FROM entries'))
+                self._db.execute('BEGIN IMMEDIATE')
+                try:
+                    for name in known - files:
+                        self._db.execute('DELETE FROM entries WHERE name = ?', (name,))
+                        self._db.execute('DELETE FROM links WHERE name = ?', (name,))
+                    for name in files - known:
+                        data = None
+                        data_path = os.path.join(self.path, name + '.data')
+                        if os.path.exists(data_path):
+                            with open(data_path, 'r') as fd:
+                                try:
+                                    data = json.load(fd)
+                                except ValueError:
+                                    pass
+                        self._insert(name, data)
+                    self._db.execute('COMMIT')
+                except:
+                    self._db.execute('ROLLBACK')
+                    raise
+
+                for fname in sidecars:
+                    os.remove(os.path.join(self.path, fname))
+
+                self._prune_variants(lambda name: name in files)
+
+    def load_data(self, name):
+        with self.thread_lock:
+            row = self._db.execute('SELECT data FROM entries WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def modify_data(self, name, func):
+        """Apply func to the metadata dict of the entry in a single transaction,
+        returns the new metadata."""
+        with self.thread_lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT data FROM entries WHERE name = ?', (name,)).fetchone()
+                data = json.loads(row[0]) if row is not None else {}
+                func(data)
+                self._db.execute('UPDATE entries SET data = ? WHERE name = ?',
+                                 (json.dumps(data, separators=(',', ':')), name))
+                self._db.execute('COMMIT')
+            except:
+                self._db.execute('ROLLBACK')
+                raise
+        return data
+
+    def remove(self, name):
+        with self.thread_lock:
+            with self.process_lock:
+                self._db.execute('BEGIN IMMEDIATE')
+                try:
+                    self._db.execute('DELETE FROM entries WHERE name = ?', (name,))
+                    self._db.execute('DELETE FROM links WHERE name = ?', (name,))
+                    self._db.execute('COMMIT')
+                except:
+                    self._db.execute('ROLLBACK')
+                    raise
+                path = os.path.join(self.path, name)
+                if os.path.exists(path):
+                    os.remove(path)
+                self._remove_variants(name)
+
+    def touch(self, name):
+        """Record an access to the entry name."""
+        with self.thread_lock:
+            # Right hand sides see the old hits
+            self._db.execute('UPDATE entries SET accessed = ?, hits = hits + 1, '
+                             'priority = ? + (hits + 2.0) / MAX(size, 1) WHERE name = ?',
+                             (time.time(), self._gdsf_clock, name))
+
+    def usage(self):
+        variant_sizes = self._variant_sizes()
+        with self.thread_lock:
+            rows = self._db.execute('SELECT name, size, accessed, hits, priority FROM entries').fetchall()
+        return [(name, size + variant_sizes.get(name, 0), accessed, hits, priority)
+                for name, size, accessed, hits, priority in rows]
+
+    def __contains__(self, item):
+        with self.thread_lock:
+            return self._db.execute('SELECT 1 FROM entries WHERE name = ?', (item,)).fetchone() is not None
+
+    def get(self, name, default=None):
+        data = self.load_data(name)
+        if data is None:
+            return default
+        return SQLiteFileEntry(fdb=self, name=name, data=data)
+
+    def set_link(self, key, name):
+        """Persistently associate key with the entry name."""
+        with self.thread_lock:
+            self._db.execute('INSERT OR REPLACE INTO links (key, name) VALUES (?, ?)', (key, name))
+
+    def get_link(self, key, default=None):
+        """Returns the entry associated with key by set_link() if it still exists."""
+        with self.thread_lock:
+            row = self._db.execute('SELECT links.name, entries.data FROM links '
+                                   'JOIN entries ON entries.name = links.name '
+                                   'WHERE links.key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        return SQLiteFileEntry(fdb=self, name=row[0], data=json.loads(row[1]))
+
+    def get_or_create(self, name, data=None, move_from=None, copy_from=None):
+        with self.thread_lock:
+            entry = self.get(name)
+            if not entry:
+                with self.process_lock:
+                    path = os.path.join(self.path, name)
+                    if move_from:
+                        shutil.move(move_from, path)
+                    elif copy_from:
+                        shutil.copy2(copy_from, path)
+                    elif not os.path.exists(path):
+                        open(path, 'a').close()
+                    self._insert(name, data)
+                entry = self.get(name)
+            return entry
+
+    def close(self):
+        self.stop_background()
+        with self.thread_lock:
+            self._db.close()
+
+
+FILEDB_BACKENDS = {
+    'files': FileDB,
+    'sqlite': SQLiteFileDB
+}
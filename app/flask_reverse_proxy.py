@@ -18,6 +18,15 @@ class ReverseProxied(object):
         proxy_set_header X-Script-Name /prefix;
         }
 
+    With FILE_DELIVERY = 'x-accel-redirect' stored files are sent by nginx
+    from an internal location mapped to FILE_FOLDER
+    (FILE_DELIVERY_ACCEL_PREFIX):
+
+    location /protected-files/ {
+        internal;
+        alias /path/to/instance/files/;
+        }
+
     :param app: the WSGI application
     """
 
@@ -0,0 +1,217 @@
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+
+import re
+import struct
+
+# Number of bytes at the start of a file read for sniffing
+SNIFF_SIZE = 4096
+
+_LDRAW_LINE = re.compile(br'^\s*[0-5](\s|$)')
+_OBJ_KEYWORDS = frozenset((b'v', b'vt', b'vn', b'vp', b'f', b'l', b'p', b'o', b'g', b's',
+                           b'usemtl', b'mtllib', b'cstype', b'deg', b'curv', b'curv2', b'surf',
+                           b'parm', b'end', b'mg', b'bevel', b'c_interp', b'd_interp', b'lod',
+                           b'shadow_obj', b'trace_obj', b'maplib', b'usemap', b'ctech', b'stech',
+                           b'bmat', b'step', b'hole', b'scrv', b'sp', b'con', b'call', b'csh'))
+
+
+def read_head(path, size=SNIFF_SIZE):
+    """Returns the first size bytes of file path"""
+    with open(path, 'rb') as file:
+        return file.read(size)
+
+
+def _is_binary(head):
+    return b'\0' in head
+
+
+def _text_lines(head, size):
+    """Returns the non-empty lines of head, without a line cut off at the end of head"""
+    truncated = len(head) < size if size is not None else len(head) >= SNIFF_SIZE
+    if head.startswith(b'\xef\xbb\xbf'):
+        head = head[3:]
+    lines = head.splitlines()
+    if truncated and lines and not head.endswith((b'\n', b'\r')):
+        # Last line is cut off by the sniff size
+        lines = lines[:-1]
+    return [line for line in lines if line.strip()]
+
+
+def _check_magic(*magics):
+    def check(head, size):
+        return head.startswith(magics)
+    return check
+
+
+def _check_3ds(head, size):
+    # Main chunk 0x4D4D, its length is the file size, but some exporters write wrong lengths
+    if len(head) < 6 or head[:2] != b'MM':
+        return False
+    length = struct.unpack('<I', head[2:6])[0]
+    return True if length == size else None
+
+
+def _check_stl(head, size):
+    # Binary STL has no magic number, only the triangle count matching the size is certain
+    if size is not None and len(head) >= 84:
+        count = struct.unpack('<I', head[80:84])[0]
+        if size == 84 + 50 * count:
+            return True
+    if head.lstrip().startswith(b'solid') and not _is_binary(head):
+        return True
+    if size is not None and size < 84:
+        # Too short for a binary STL header
+        return False
+    return None
+
+
+def _check_gltf(head, size):
+    text = head.lstrip()
+    if not text.startswith(b'{'):
+        return False
+    # 'asset' is required, but may be after the sniffed bytes
+    return True if b'"asset"' in text else None
+
+
+def _check_xml_root(*roots):
+    def check(head, size):
+        text = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+        if not text.startswith(b'<'):
+            return False
+        if any(b'<' + root in text for root in roots):
+            return True
+        return None
+    return check
+
+
+def _check_off(head, size):
+    # The OFF keyword may follow comments, binary data follows a 'OFF BINARY' header
+    for line in head.splitlines():
+        tokens = line.split(None, 1)
+        if not tokens or tokens[0].startswith(b'#'):
+            continue
+        if tokens[0].endswith(b'OFF'):
+            return True
+        break
+    # The OFF keyword is optional
+    return False if _is_binary(head) else None
+
+
+def _check_fbx(head, size):
+    return head.startswith(b'Kaydara FBX Binary') or (b'FBXHeaderExtension' in head and not _is_binary(head))
+
+
+def _check_ldraw(head, size):
+    """LDraw files consist of lines starting with line type 0 to 5"""
+    if _is_binary(head):
+        return False
+    lines = _text_lines(head, size)
+    if not lines:
+        return None
+    return all(_LDRAW_LINE.match(line) for line in lines)
+
+
+def _check_obj(head, size):
+    if _is_binary(head):
+        return False
+    statements = [line.split(None, 1)[0] for line in _text_lines(head, size) if not line.lstrip().startswith(b'#')]
+    if not statements:
+        # Only comments
+        return None
+    # Unknown statements may be extensions of exporters
+    return True if all(statement in _OBJ_KEYWORDS for statement in statements) else None
+
+
+# Content checks of formats, check(head, size) returns True if head is the start of
+# a file of the format with size bytes, False if it is not and None if unknown
+SIGNATURES = {
+    '3ds': _check_3ds,
+    'blend': _check_magic(b'BLENDER'),
+    'bvh': _check_magic(b'HIERARCHY'),
+    'dae': _check_xml_root(b'COLLADA'),
+    'fbx': _check_fbx,
+    'glb': _check_magic(b'glTF'),
+    'gltf': _check_gltf,
+    'ldr': _check_ldraw,
+    'lwo': lambda head, size: head[:4] == b'FORM' and head[8:12] in (b'LWO2', b'LWOB'),
+    'md2': _check_magic(b'IDP2'),
+    'md3': _check_magic(b'IDP3'),
+    'mpd': _check_ldraw,
+    'ms3d': _check_magic(b'MS3D000000'),
+    'obj': _check_obj,
+    'off': _check_off,
+    'ply': _check_magic(b'ply\n', b'ply\r'),
+    'smd': _check_magic(b'version 1'),
+    'step': _check_magic(b'ISO-10303-21'),
+    'stl': _check_stl,
+    'stp': _check_magic(b'ISO-10303-21'),
+    'x': _check_magic(b'xof '),
+    'x3d': _check_xml_root(b'X3D'),
+}
+
+# Sniffing order, formats with strong magic numbers first
+_SNIFF_ORDER = ('glb', 'blend', '3ds', 'ply', 'fbx', 'x', 'md2', 'md3', 'ms3d', 'lwo', 'step', 'stp',
+                'dae', 'x3d', 'gltf', 'bvh', 'smd', 'off', 'stl', 'mpd', 'ldr', 'obj')
+
+
+class FormatDetector(object):
+    """Derives file formats from file names and file content.
+
+    File names are looked up in a suffix index built from the extensions of
+    formats, multi-part extensions like .mesh.xml included, the longest
+    matching suffix wins. Content is checked against SIGNATURES.
+    """
+
+    def __init__(self, formats):
+        """formats maps format names to FileFormat"""
+        self._suffixes = {}
+        self._max_parts = 1
+        for format_name, format_info in sorted(formats.items()):
+            ext = format_info.ext.lower()
+            if not ext.startswith('.'):
+                ext = '.' + ext
+            self._suffixes.setdefault(ext, format_name)
+            self._max_parts = max(self._max_parts, ext.count('.'))
+        self._formats = frozenset(formats)
+
+    def from_filename(self, filename):
+        """Returns the format name of the longest known suffix of filename or None"""
+        parts = filename.lower().rsplit('/', 1)[-1].split('.')
+        for count in range(min(self._max_parts, len(parts) - 1), 0, -1):
+            format_name = self._suffixes.get('.' + '.'.join(parts[-count:]))
+            if format_name is not None:
+                return format_name
+        return None
+
+    @staticmethod
+    def check(format_name, head, size=None):
+        """Returns True if head matches format_name, False if it does not
+        and None if the format has no known signature or head is inconclusive"""
+        check = SIGNATURES.get(format_name)
+        if check is None:
+            return None
+        return check(head, size)
+
+    def sniff(self, head, size=None, formats=None):
+        """Returns list of format names matching head, restricted to formats"""
+        candidates = []
+        for format_name in _SNIFF_ORDER:
+            if format_name not in self._formats or (formats is not None and format_name not in formats):
+                continue
+            if SIGNATURES[format_name](head, size):
+                candidates.append(format_name)
+        if 'mpd' in candidates and 'ldr' in candidates and b'0 FILE' not in head:
+            # Single model, an MPD contains '0 FILE' lines
+            candidates.remove('mpd')
+        return candidates
+
+    def detect(self, filename, head, size=None, formats=None):
+        """Returns the format name of a file, the format of the file name if the
+        content does not contradict it, otherwise the first sniffed format"""
+        format_name = self.from_filename(filename) if filename else None
+        if format_name is not None and (formats is None or format_name in formats) and \
+                self.check(format_name, head, size) is not False:
+            return format_name
+        candidates = self.sniff(head, size, formats)
+        return candidates[0] if candidates else None
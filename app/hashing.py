@@ -0,0 +1,48 @@
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+
+import hashlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+BLOCK_SIZE = 1024 * 1024
+
+HASH_ALGORITHMS = ['sha1', 'blake2b']
+if xxhash is not None:
+    HASH_ALGORITHMS.extend(['xxh64', 'xxh128'])
+
+
+def new_hasher(algorithm='sha1'):
+    """Returns hash object for one of HASH_ALGORITHMS"""
+    if algorithm == 'sha1':
+        return hashlib.sha1()
+    elif algorithm == 'blake2b':
+        # Same digest length as SHA-1
+        return hashlib.blake2b(digest_size=20)
+    elif algorithm in ('xxh64', 'xxh128'):
+        if xxhash is None:
+            raise ValueError('Hash algorithm {} requires the xxhash module'.format(algorithm))
+        return getattr(xxhash, algorithm)()
+    raise ValueError('Unknown hash algorithm {!r}, supported: {}'.format(
+        algorithm, ', '.join(HASH_ALGORITHMS)))
+
+
+def hash_file(filename, algorithm='sha1', block_size=BLOCK_SIZE):
+    """Returns hex digest of the file content computed in one pass
+    without copying the data out of the read buffer"""
+    with open(filename, 'rb', buffering=0) as fd:
+        file_digest = getattr(hashlib, 'file_digest', None)
+        if file_digest is not None:
+            return file_digest(fd, lambda: new_hasher(algorithm)).hexdigest()
+        hasher = new_hasher(algorithm)
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        size = fd.readinto(buf)
+        while size:
+            hasher.update(view[:size])
+            size = fd.readinto(buf)
+        return hasher.hexdigest()
@@ -0,0 +1,997 @@
+#!/usr/bin/env python3
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+"""
+    Native LDraw to glTF 2.0 binary (GLB) converter
+
+    Parses LDR and MPD files and the referenced files of the LDraw library
+    into NumPy arrays. Every part is flattened once into a triangle list by
+    composing the matrices of its subfile references. Repeated parts are
+    written as one mesh per part and color, every placement of the part is
+    a node with the composed transformation of the instance.
+
+    The flattened parts of the library can be compiled once into a cache
+    file that conversions memory-map read-only, so parts are not parsed
+    again and all converter processes share the page cached geometry.
+
+    With a block cache folder the sub-models and parts defined in MPD files
+    are stored by a hash of their lines, the library and the blocks they
+    reference, so converting an edited document only rebuilds the changed
+    blocks and the blocks that contain them.
+
+    Usage: ldraw.py [-v] [--ldrawdir DIR] [--cache FILE] [--block-cache DIR] input.ldr output.glb
+           ldraw.py [-v] [--ldrawdir DIR] --build-cache FILE
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import zipfile
+
+import fasteners
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAIN_COLOR = 16
+EDGE_COLOR = 24
+
+# Folders of the library searched for referenced files, in order
+LIBRARY_FOLDERS = ('parts', 'p', 'models', os.path.join('Unofficial', 'parts'), os.path.join('Unofficial', 'p'))
+
+# !LDRAW_ORG types of parts, subparts and primitives are geometry of parts
+PART_TYPES = frozenset(('part', 'shortcut', 'unofficial_part', 'unofficial_shortcut'))
+
+# RGBA of common colors, used when the library has no LDConfig.ldr
+DEFAULT_COLORS = {
+    0: (0x1B, 0x2A, 0x34, 255),
+    1: (0x1E, 0x5A, 0xA8, 255),
+    2: (0x00, 0x85, 0x2B, 255),
+    4: (0xB4, 0x00, 0x00, 255),
+    14: (0xFA, 0xC8, 0x0A, 255),
+    15: (0xF4, 0xF4, 0xF4, 255),
+    MAIN_COLOR: (0x7F, 0x7F, 0x7F, 255),
+    EDGE_COLOR: (0x33, 0x33, 0x33, 255),
+    71: (0xA0, 0xA5, 0xA9, 255),
+    72: (0x6C, 0x6E, 0x68, 255),
+}
+UNKNOWN_COLOR = (0x7F, 0x7F, 0x7F, 255)
+
+_COLOUR_RE = re.compile(r'^0\s+!COLOUR\s+\S+\s+CODE\s+(\d+)\s+VALUE\s+#([0-9A-Fa-f]{6})(?:.*?\sALPHA\s+(\d+))?')
+
+IDENTITY = np.identity(4)
+
+# Library cache file: CACHE_MAGIC, per part float32 vertices (v, 3), uint32 faces (n, 3)
+# and int32 colors (n,), JSON index, CACHE_TRAILER (index offset, index length, signature, CACHE_MAGIC)
+CACHE_MAGIC = b'LDRWCCH1'
+CACHE_TRAILER = struct.Struct('<QQ40s8s')
+
+# Subfile reference, matrix is a 4x4 numpy array, invert is set by BFC INVERTNEXT
+SubfileRef = collections.namedtuple('SubfileRef', ['color', 'matrix', 'name', 'invert'])
+
+# Indexed triangle mesh, faces index vertices, colors has one color code per face
+Mesh = collections.namedtuple('Mesh', ['vertices', 'faces', 'colors'])
+
+# Parts placed by a model file and its sub-models, as arrays of part names, colors,
+# 4x4 matrices and BFC INVERTNEXT flags, and the triangles of the model files with
+# their colors, all in the coordinates of the model file. Colors of the parent are
+# MAIN_COLOR.
+Expansion = collections.namedtuple('Expansion', ['names', 'colors', 'matrices', 'inverts', 'triangles',
+                                                 'triangle_colors'])
+
+
+class LDrawError(Exception):
+    pass
+
+
+def normalize_name(name):
+    """Returns the lookup key of a subfile name, LDraw names are case insensitive"""
+    return name.strip().replace('\\', '/').lower()
+
+
+def parse_color(token):
+    try:
+        return int(token)
+    except ValueError:
+        # Direct colors 0x2RRGGBB
+        return int(token, 16)
+
+
+class LDrawFile(object):
+    """Parsed LDraw file, triangles is an array of shape (n, 3, 3) with
+    counter-clockwise vertex order and colors an array of n color codes.
+    Parts from the library cache have a mesh, their triangles are derived
+    from it when needed."""
+
+    def __init__(self, name, triangles, colors, refs, is_part=False, mesh=None):
+        self.name = name
+        self._triangles = triangles
+        self.colors = colors
+        self.refs = refs
+        self.is_part = is_part
+        self.mesh = mesh
+
+    @property
+    def triangles(self):
+        if self._triangles is None:
+            self._triangles = self.mesh.vertices[self.mesh.faces]
+        return self._triangles
+
+    def __repr__(self):
+        return 'LDrawFile({!r}, {} triangles, {} references)'.format(self.name, len(self.triangles), len(self.refs))
+
+
+def _triangle_arrays(rows, columns):
+    """Converts token rows (color, coordinates...) to color and vertex arrays"""
+    if not rows:
+        return np.empty((0,), dtype=np.int64), np.empty((0, columns // 3, 3))
+    colors = np.array([parse_color(row[0]) for row in rows], dtype=np.int64)
+    vertices = np.array([row[1:columns + 1] for row in rows], dtype=np.float64).reshape(len(rows), columns // 3, 3)
+    return colors, vertices
+
+
+def _is_part_type(kind):
+    """Returns whether !LDRAW_ORG type kind is a part"""
+    return kind.lower() in PART_TYPES
+
+
+def lines_are_part(lines):
+    """Returns whether the file of lines is a part, without parsing it"""
+    is_part = False
+    for line in lines:
+        tokens = line.split(None, 3)
+        if len(tokens) > 2 and tokens[0] == '0' and tokens[1] in ('!LDRAW_ORG', 'LDRAW_ORG'):
+            is_part = _is_part_type(tokens[2])
+    return is_part
+
+
+def parse_file(lines, name):
+    """Returns LDrawFile parsed from lines of one LDraw file"""
+    ccw = True
+    invert_next = False
+    is_part = False
+    triangles = {True: [], False: []}
+    quads = {True: [], False: []}
+    refs = []
+    for line in lines:
+        tokens = line.split()
+        if not tokens:
+            continue
+        line_type = tokens[0]
+        if line_type == '3' and len(tokens) >= 11:
+            triangles[ccw].append(tokens[1:11])
+        elif line_type == '4' and len(tokens) >= 14:
+            quads[ccw].append(tokens[1:14])
+        elif line_type == '1' and len(tokens) >= 15:
+            x, y, z, a, b, c, d, e, f, g, h, i = (float(v) for v in tokens[2:14])
+            matrix = np.array(((a, b, c, x), (d, e, f, y), (g, h, i, z), (0, 0, 0, 1)))
+            refs.append(SubfileRef(parse_color(tokens[1]), matrix, line.split(None, 14)[14].strip(), invert_next))
+            invert_next = False
+        elif line_type == '0' and len(tokens) > 1:
+            if tokens[1] == 'BFC':
+                if 'INVERTNEXT' in tokens:
+                    invert_next = True
+                if 'CW' in tokens:
+                    ccw = False
+                elif 'CCW' in tokens:
+                    ccw = True
+            elif tokens[1] in ('!LDRAW_ORG', 'LDRAW_ORG') and len(tokens) > 2:
+                is_part = _is_part_type(tokens[2])
+
+    all_colors = []
+    all_triangles = []
+    for winding_ccw in (True, False):
+        colors, vertices = _triangle_arrays(triangles[winding_ccw], 9)
+        quad_colors, quad_vertices = _triangle_arrays(quads[winding_ccw], 12)
+        # Split quads 0-1-2-3 into triangles 0-1-2 and 0-2-3
+        vertices = np.concatenate((vertices, quad_vertices[:, (0, 1, 2)], quad_vertices[:, (0, 2, 3)]))
+        colors = np.concatenate((colors, quad_colors, quad_colors))
+        if not winding_ccw:
+            vertices = vertices[:, ::-1]
+        all_colors.append(colors)
+        all_triangles.append(vertices)
+    return LDrawFile(name, np.concatenate(all_triangles), np.concatenate(all_colors), refs, is_part)
+
+
+def split_document(text, name):
+    """Returns OrderedDict of normalized names to tuples (name, lines) of the
+    files of an LDR or MPD document, the first file is the main model"""
+    blocks = collections.OrderedDict()
+    block_name = None  # None outside of 0 FILE blocks
+    block_lines = []
+    preamble = []
+    for line in text.splitlines():
+        tokens = line.split(None, 2)
+        if len(tokens) >= 2 and tokens[0] == '0' and tokens[1] in ('FILE', 'NOFILE'):
+            if block_name is not None:
+                blocks.setdefault(normalize_name(block_name), (block_name, block_lines))
+            block_name = (tokens[2].strip() if len(tokens) > 2 else '') if tokens[1] == 'FILE' else None
+            block_lines = []
+        elif block_name is not None:
+            block_lines.append(line)
+        elif not blocks:
+            preamble.append(line)
+    if block_name is not None:
+        blocks.setdefault(normalize_name(block_name), (block_name, block_lines))
+    if not blocks:
+        # LDR file
+        blocks[normalize_name(name)] = (name, preamble)
+    return blocks
+
+
+def reference_names(lines):
+    """Returns the normalized names of the subfiles referenced by lines, without parsing them"""
+    names = []
+    for line in lines:
+        tokens = line.split(None, 14)
+        if len(tokens) == 15 and tokens[0] == '1':
+            names.append(normalize_name(tokens[14]))
+    return names
+
+
+def read_text(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    if data.startswith(b'\xef\xbb\xbf'):
+        data = data[3:]
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def library_signature(ldrawdir):
+    """Returns hash of the modification times of the library folders and LDConfig.ldr,
+    it changes when library files are added, removed or replaced"""
+    hasher = hashlib.sha1(CACHE_MAGIC + os.path.abspath(ldrawdir).encode())
+    for folder in LIBRARY_FOLDERS:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(ldrawdir, folder)):
+            dirnames.sort()
+            hasher.update('{}\0{}\0{}\0'.format(os.path.relpath(dirpath, ldrawdir), len(filenames),
+                                                os.stat(dirpath).st_mtime_ns).encode())
+    try:
+        hasher.update(str(os.stat(os.path.join(ldrawdir, 'LDConfig.ldr')).st_mtime_ns).encode())
+    except OSError:
+        pass
+    return hasher.hexdigest()
+
+
+def cache_signature(path):
+    """Returns the library signature of cache file path or None if it is missing or invalid"""
+    try:
+        with open(path, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() < len(CACHE_MAGIC) + CACHE_TRAILER.size:
+                return None
+            file.seek(-CACHE_TRAILER.size, os.SEEK_END)
+            index_offset, index_length, signature, magic = CACHE_TRAILER.unpack(file.read(CACHE_TRAILER.size))
+    except (IOError, OSError):
+        return None
+    if magic != CACHE_MAGIC:
+        return None
+    return signature.decode()
+
+
+class LibraryCache(object):
+    """Flattened part geometry of cache file path written by build_cache(),
+    the arrays are read-only views of the memory-mapped file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._mmap)
+        if size < len(CACHE_MAGIC) + CACHE_TRAILER.size or self._mmap[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+            raise ValueError('{} is not an LDraw library cache'.format(path))
+        index_offset, index_length, signature, magic = CACHE_TRAILER.unpack_from(self._mmap,
+                                                                                 size - CACHE_TRAILER.size)
+        if magic != CACHE_MAGIC:
+            raise ValueError('{} is not an LDraw library cache'.format(path))
+        index = json.loads(self._mmap[index_offset:index_offset + index_length].decode())
+        self.signature = signature.decode()
+        self.ldrawdir = index['ldrawdir']
+        self.paths = index['paths']
+        self.parts = set(index['parts'])
+        self._geometry = index['geometry']
+
+    def __contains__(self, key):
+        return key in self._geometry
+
+    def mesh(self, key):
+        """Returns Mesh of part key or None"""
+        entry = self._geometry.get(key)
+        if entry is None:
+            return None
+        offset, vertex_count, face_count = entry
+        if not face_count:
+            return Mesh(np.empty((0, 3), np.float32), np.empty((0, 3), np.uint32), np.empty((0,), np.int32))
+        vertices = np.frombuffer(self._mmap, np.float32, vertex_count * 3, offset).reshape(vertex_count, 3)
+        offset += vertices.nbytes
+        faces = np.frombuffer(self._mmap, np.uint32, face_count * 3, offset).reshape(face_count, 3)
+        colors = np.frombuffer(self._mmap, np.int32, face_count, offset + faces.nbytes)
+        return Mesh(vertices, faces, colors)
+
+
+class LDrawLibrary(object):
+    """Index of the files of the LDraw library in folder ldrawdir, with a
+    LibraryCache the index is read from the cache and parts are not parsed"""
+
+    def __init__(self, ldrawdir, cache=None):
+        self.ldrawdir = ldrawdir
+        self._cache = cache
+        self._colors = None
+        self._signature = None
+        if cache is not None:
+            self._paths = dict((key, os.path.join(ldrawdir, path)) for key, path in cache.paths.items())
+            self._parts = cache.parts
+            return
+        self._paths = {}
+        self._parts = set()
+        for folder in LIBRARY_FOLDERS:
+            root = os.path.join(ldrawdir, folder)
+            for dirpath, dirnames, filenames in os.walk(root):
+                rel_dir = os.path.relpath(dirpath, root)
+                for filename in filenames:
+                    key = normalize_name(filename if rel_dir == os.curdir else os.path.join(rel_dir, filename))
+                    if key not in self._paths:
+                        self._paths[key] = os.path.join(dirpath, filename)
+                        if os.path.basename(folder) == 'parts' and rel_dir == os.curdir:
+                            # Files of parts/s are subparts
+                            self._parts.add(key)
+
+    @classmethod
+    def open(cls, ldrawdir, cache_path=None):
+        """Returns library of ldrawdir using cache file cache_path if it is valid"""
+        if cache_path:
+            try:
+                cache = LibraryCache(cache_path)
+            except (IOError, OSError, ValueError) as e:
+                logger.warning('Could not open LDraw library cache: {}'.format(e))
+            else:
+                if os.path.abspath(cache.ldrawdir) == os.path.abspath(ldrawdir):
+                    return cls(ldrawdir, cache)
+                logger.warning('LDraw library cache {} is for library {}'.format(cache_path, cache.ldrawdir))
+        return cls(ldrawdir)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def keys(self):
+        """Returns the keys of all library files"""
+        return self._paths.keys()
+
+    @property
+    def signature(self):
+        """Hash of the library, see library_signature()"""
+        if self._signature is None:
+            self._signature = self._cache.signature if self._cache is not None else library_signature(self.ldrawdir)
+        return self._signature
+
+    @property
+    def parts(self):
+        """Set of keys of the parts of the library"""
+        return self._parts
+
+    def find(self, name):
+        """Returns path of library file name or None"""
+        return self._paths.get(normalize_name(name))
+
+    def load(self, name):
+        """Returns LDrawFile of library file name or None, cached parts are
+        returned flattened without references"""
+        if self._cache is not None:
+            mesh = self._cache.mesh(normalize_name(name))
+            if mesh is not None:
+                return LDrawFile(name, None, mesh.colors, [], is_part=True, mesh=mesh)
+        path = self.find(name)
+        if path is None:
+            return None
+        file = parse_file(read_text(path).splitlines(), name)
+        file.is_part = file.is_part or normalize_name(name) in self._parts
+        return file
+
+    def colors(self):
+        """Returns dict of color codes to RGBA tuples"""
+        if self._colors is None:
+            colors = dict(DEFAULT_COLORS)
+            try:
+                text = read_text(os.path.join(self.ldrawdir, 'LDConfig.ldr'))
+            except (IOError, OSError):
+                text = ''
+            for line in text.splitlines():
+                match = _COLOUR_RE.match(line.strip())
+                if match:
+                    code, value, alpha = match.groups()
+                    rgb = bytes.fromhex(value)
+                    colors[int(code)] = (rgb[0], rgb[1], rgb[2], int(alpha) if alpha else 255)
+            self._colors = colors
+        return self._colors
+
+    def color(self, code):
+        color = self.colors().get(code)
+        if color is not None:
+            return color
+        if code >> 24 == 2:
+            return ((code >> 16) & 0xFF, (code >> 8) & 0xFF, code & 0xFF, 255)
+        return UNKNOWN_COLOR
+
+
+class BlockCache(object):
+    """Expansions of sub-models and meshes of parts defined in LDraw documents,
+    stored in folder path as .npz files named by block key. At most
+    max_entries files are kept, prune() removes the least recently used."""
+
+    def __init__(self, path, max_entries=0):
+        self.path = path
+        self.max_entries = max_entries
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+
+    def get(self, key, cls):
+        """Returns namedtuple cls stored as key or None"""
+        path = os.path.join(self.path, key + '.npz')
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                value = cls(*(data[field] for field in cls._fields))
+            # Modification time is the last use
+            os.utime(path)
+        except (IOError, OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+        return value
+
+    def put(self, key, value):
+        path = os.path.join(self.path, key + '.npz')
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as file:
+                np.savez(file, **value._asdict())
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.warning('Could not store block {}: {}'.format(key, e))
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def prune(self):
+        """Removes the least recently used files exceeding max_entries, returns their number"""
+        if not self.max_entries:
+            return 0
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        if len(entries) <= self.max_entries:
+            return 0
+        entries.sort()
+        removed = 0
+        for mtime, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+class LDrawModel(object):
+    """LDraw document with references resolved from its own files and the library.
+
+    Files of the document are parsed when they are used. With a BlockCache
+    the expansions of sub-models and the meshes of parts defined in the
+    document are stored by block_key(), a changed document reuses the
+    results of all blocks that did not change and do not reference
+    changed blocks.
+    """
+
+    def __init__(self, library, blocks=None, block_cache=None):
+        self.library = library
+        self.block_cache = block_cache
+        self._blocks = blocks if blocks is not None else collections.OrderedDict()
+        self._files = {}
+        self._geometry = {}
+        self._meshes = {}
+        self._expansions = {}
+        self._block_keys = {}
+        self._flattening = set()
+        self._expanding = set()
+        self._hashing = set()
+        self.missing = set()
+        self.reused = 0
+        self.built = 0
+
+    @classmethod
+    def load(cls, path, library, block_cache=None):
+        """Returns model of LDR or MPD file path"""
+        return cls(library, split_document(read_text(path), os.path.basename(path)), block_cache)
+
+    @property
+    def main(self):
+        """LDrawFile of the main model of the document"""
+        if not self._blocks:
+            return None
+        return self.get_file(next(iter(self._blocks.values()))[0])
+
+    def forget(self, name):
+        """Drops file name and its flattened geometry"""
+        key = normalize_name(name)
+        self._geometry.pop(key, None)
+        self._meshes.pop(key, None)
+        self._files.pop(key, None)
+
+    def get_file(self, name):
+        key = normalize_name(name)
+        file = self._files.get(key)
+        if file is not None:
+            return file
+        block = self._blocks.get(key)
+        if block is not None:
+            file = self._files[key] = parse_file(block[1], block[0])
+        elif key not in self.missing:
+            file = self.library.load(name)
+            if file is None:
+                logger.warning('Missing file {}'.format(name))
+                self.missing.add(key)
+            else:
+                self._files[key] = file
+        return file
+
+    def is_part(self, name):
+        """Returns whether file name is a part, None if it is missing"""
+        key = normalize_name(name)
+        block = self._blocks.get(key)
+        if block is not None and key not in self._files:
+            return lines_are_part(block[1])
+        file = self.get_file(name)
+        return file.is_part if file is not None else None
+
+    def block_key(self, name):
+        """Returns hash of the document file name, the blocks it references and
+        the library, None if name is not a file of the document"""
+        key = normalize_name(name)
+        block = self._blocks.get(key)
+        if block is None:
+            return None
+        block_key = self._block_keys.get(key)
+        if block_key is None:
+            if key in self._hashing:
+                raise LDrawError('Recursive reference of {}'.format(block[0]))
+            self._hashing.add(key)
+            try:
+                hasher = hashlib.sha1(CACHE_MAGIC + self.library.signature.encode())
+                for line in block[1]:
+                    hasher.update(line.encode('utf-8', 'surrogatepass'))
+                    hasher.update(b'\n')
+                for child in reference_names(block[1]):
+                    child_key = self.block_key(child)
+                    if child_key is not None:
+                        hasher.update(child_key.encode())
+                block_key = self._block_keys[key] = hasher.hexdigest()
+            finally:
+                self._hashing.discard(key)
+        return block_key
+
+    def _cached_block(self, prefix, name, cls):
+        """Returns tuple (block key, value of the block cache or None)"""
+        if self.block_cache is None:
+            return None, None
+        block_key = self.block_key(name)
+        if block_key is None:
+            return None, None
+        block_key = prefix + block_key
+        value = self.block_cache.get(block_key, cls)
+        if value is not None:
+            self.reused += 1
+        return block_key, value
+
+    def _store_block(self, block_key, value):
+        if block_key is not None:
+            self.block_cache.put(block_key, value)
+            self.built += 1
+
+    def mesh(self, name):
+        """Returns welded Mesh of file name and all its subfiles, colors of the parent are MAIN_COLOR"""
+        key = normalize_name(name)
+        mesh = self._meshes.get(key)
+        if mesh is not None:
+            return mesh
+        block_key, mesh = self._cached_block('part-', name, Mesh)
+        if mesh is None:
+            file = self.get_file(name)
+            if file.mesh is not None:
+                return file.mesh
+            triangles, colors = self.flatten(file)
+            mesh = weld_triangles(triangles, colors)
+            self._store_block(block_key, mesh)
+        self._meshes[key] = mesh
+        return mesh
+
+    def flatten(self, file):
+        """Returns tuple (triangles, colors) of file and all its subfiles,
+        colors of the parent are MAIN_COLOR"""
+        key = normalize_name(file.name)
+        geometry = self._geometry.get(key)
+        if geometry is not None:
+            return geometry
+        if key in self._flattening:
+            raise LDrawError('Recursive reference of {}'.format(file.name))
+        self._flattening.add(key)
+        try:
+            triangles = [file.triangles]
+            colors = [file.colors]
+            for ref in file.refs:
+                child = self.get_file(ref.name)
+                if child is None:
+                    continue
+                child_triangles, child_colors = self.flatten(child)
+                if not len(child_triangles):
+                    continue
+                triangles.append(transform_triangles(child_triangles, ref.matrix, ref.invert))
+                colors.append(substitute_color(child_colors, ref.color))
+            if len(triangles) == 1:
+                # No copy of cached parts
+                geometry = (file.triangles, file.colors)
+            else:
+                geometry = (np.concatenate(triangles), np.concatenate(colors))
+        finally:
+            self._flattening.discard(key)
+        self._geometry[key] = geometry
+        return geometry
+
+    def expand(self, name):
+        """Returns Expansion of model file name, the parts placed by it and its
+        sub-models and their triangles"""
+        key = normalize_name(name)
+        expansion = self._expansions.get(key)
+        if expansion is not None:
+            return expansion
+        block_key, expansion = self._cached_block('model-', name, Expansion)
+        if expansion is None:
+            if key in self._expanding:
+                raise LDrawError('Recursive reference of {}'.format(name))
+            self._expanding.add(key)
+            try:
+                expansion = self._expand(self.get_file(name))
+            finally:
+                self._expanding.discard(key)
+            self._store_block(block_key, expansion)
+        self._expansions[key] = expansion
+        return expansion
+
+    def _expand(self, file):
+        part_names = []
+        part_colors = []
+        part_matrices = []
+        part_inverts = []
+        submodels = []
+        for ref in file.refs:
+            is_part = self.is_part(ref.name)
+            if is_part is None:
+                continue
+            if is_part:
+                part_names.append(ref.name)
+                part_colors.append(ref.color)
+                part_matrices.append(ref.matrix)
+                part_inverts.append(ref.invert)
+            else:
+                submodels.append((ref, self.expand(ref.name)))
+
+        names = [np.array(part_names, dtype=str)]
+        colors = [np.array(part_colors, dtype=np.int64)]
+        matrices = [np.array(part_matrices, dtype=np.float64).reshape(-1, 4, 4)]
+        inverts = [np.array(part_inverts, dtype=bool)]
+        triangles = [file.triangles]
+        triangle_colors = [file.colors]
+        for ref, submodel in submodels:
+            names.append(submodel.names)
+            colors.append(substitute_color(submodel.colors, ref.color))
+            matrices.append(np.matmul(ref.matrix, submodel.matrices))
+            inverts.append(submodel.inverts != ref.invert)
+            if len(submodel.triangles):
+                triangles.append(transform_triangles(submodel.triangles, ref.matrix, ref.invert))
+                triangle_colors.append(substitute_color(submodel.triangle_colors, ref.color))
+        return Expansion(np.concatenate(names), np.concatenate(colors), np.concatenate(matrices),
+                         np.concatenate(inverts), np.concatenate(triangles).astype(np.float64),
+                         np.concatenate(triangle_colors).astype(np.int64))
+
+
+def transform_triangles(triangles, matrix, invert=False):
+    """Returns triangles transformed by 4x4 matrix, the vertex order is reversed
+    if matrix mirrors or invert is set, so front faces stay counter-clockwise"""
+    result = triangles.dot(matrix[:3, :3].T) + matrix[:3, 3]
+    if invert != (np.linalg.det(matrix[:3, :3]) < 0):
+        result = result[:, ::-1]
+    return result
+
+
+def substitute_color(colors, color):
+    """Returns colors with MAIN_COLOR replaced by color"""
+    if color == MAIN_COLOR:
+        return colors
+    return np.where(colors == MAIN_COLOR, color, colors)
+
+
+def weld_triangles(triangles, colors):
+    """Returns Mesh of float32 vertices of triangles with equal vertices merged"""
+    vertices, indices = weld_vertices(triangles.reshape(-1, 3).astype(np.float32))
+    return Mesh(vertices, indices.reshape(-1, 3).astype(np.uint32), colors.astype(np.int32))
+
+
+def weld_vertices(vertices):
+    """Returns tuple (unique vertices, indices of vertices into them), lexsort
+    of the coordinates is much faster than np.unique() of rows"""
+    order = np.lexsort((vertices[:, 2], vertices[:, 1], vertices[:, 0]))
+    ordered = vertices[order]
+    first = np.ones(len(ordered), dtype=bool)
+    first[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+    indices = np.empty(len(ordered), dtype=np.int64)
+    indices[order] = np.cumsum(first) - 1
+    return ordered[first], indices
+
+
+class GLBWriter(object):
+    """Builds a glTF 2.0 asset with a single binary buffer"""
+
+    ARRAY_BUFFER = 34962
+    ELEMENT_ARRAY_BUFFER = 34963
+    FLOAT = 5126
+    UNSIGNED_SHORT = 5123
+    UNSIGNED_INT = 5125
+
+    def __init__(self, generator='Web3DConverter'):
+        self.gltf = {'asset': {'version': '2.0', 'generator': generator},
+                     'scene': 0,
+                     'scenes': [{'nodes': []}],
+                     'nodes': [],
+                     'meshes': [],
+                     'materials': [],
+                     'accessors': [],
+                     'bufferViews': []}
+        self._data = []
+        self._size = 0
+        self._materials = {}
+
+    def add_buffer_view(self, data, target):
+        padding = -self._size % 4
+        if padding:
+            self._data.append(b'\0' * padding)
+            self._size += padding
+        self.gltf['bufferViews'].append({'buffer': 0, 'byteOffset': self._size, 'byteLength': len(data),
+                                         'target': target})
+        self._data.append(data)
+        self._size += len(data)
+        return len(self.gltf['bufferViews']) - 1
+
+    def add_accessor(self, array, target, accessor_type, **kwargs):
+        component_type = {np.dtype(np.float32): self.FLOAT,
+                          np.dtype(np.uint16): self.UNSIGNED_SHORT,
+                          np.dtype(np.uint32): self.UNSIGNED_INT}[array.dtype]
+        data = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<')).tobytes()
+        accessor = {'bufferView': self.add_buffer_view(data, target),
+                    'componentType': component_type,
+                    'count': len(array),
+                    'type': accessor_type}
+        accessor.update(kwargs)
+        self.gltf['accessors'].append(accessor)
+        return len(self.gltf['accessors']) - 1
+
+    def add_material(self, key, rgba):
+        material = self._materials.get(key)
+        if material is None:
+            # baseColorFactor is linear, LDraw colors are sRGB
+            srgb = np.array(rgba[:3]) / 255.0
+            linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+            material = {'name': str(key),
+                        'pbrMetallicRoughness': {'baseColorFactor': [round(float(v), 6) for v in linear] +
+                                                                    [round(rgba[3] / 255.0, 6)],
+                                                 'metallicFactor': 0.0,
+                                                 'roughnessFactor': 0.5},
+                        # Winding of parts without BFC certification is undefined
+                        'doubleSided': True}
+            if rgba[3] < 255:
+                material['alphaMode'] = 'BLEND'
+            self.gltf['materials'].append(material)
+            material = self._materials[key] = len(self.gltf['materials']) - 1
+        return material
+
+    def add_mesh(self, name, mesh, color_rgba):
+        """Adds Mesh with one indexed primitive per color, returns the mesh index
+        or None if there are no faces"""
+        if not len(mesh.faces):
+            return None
+        primitives = []
+        for color in np.unique(mesh.colors):
+            # Only the vertices of the faces of the color
+            used, indices = np.unique(mesh.faces[mesh.colors == color], return_inverse=True)
+            vertices = mesh.vertices[used]
+            indices = indices.reshape(-1).astype(np.uint16 if len(vertices) < 0xFFFF else np.uint32)
+            position = self.add_accessor(vertices, self.ARRAY_BUFFER, 'VEC3',
+                                         min=vertices.min(axis=0).tolist(), max=vertices.max(axis=0).tolist())
+            primitives.append({'attributes': {'POSITION': position},
+                               'indices': self.add_accessor(indices, self.ELEMENT_ARRAY_BUFFER, 'SCALAR'),
+                               'material': self.add_material(int(color), color_rgba(int(color)))})
+        self.gltf['meshes'].append({'name': name, 'primitives': primitives})
+        return len(self.gltf['meshes']) - 1
+
+    def add_node(self, node, parent=None):
+        self.gltf['nodes'].append(node)
+        index = len(self.gltf['nodes']) - 1
+        if parent is None:
+            self.gltf['scenes'][0]['nodes'].append(index)
+        else:
+            self.gltf['nodes'][parent].setdefault('children', []).append(index)
+        return index
+
+    def write(self, path):
+        if self._size:
+            self.gltf['buffers'] = [{'byteLength': self._size}]
+        for key in ('meshes', 'materials', 'accessors', 'bufferViews'):
+            if not self.gltf[key]:
+                del self.gltf[key]
+        header = json.dumps(self.gltf, separators=(',', ':')).encode()
+        header += b' ' * (-len(header) % 4)
+        binary_padding = b'\0' * (-self._size % 4)
+        length = 12 + 8 + len(header) + (8 + self._size + len(binary_padding) if self._size else 0)
+        with open(path, 'wb') as file:
+            file.write(struct.pack('<4sII', b'glTF', 2, length))
+            file.write(struct.pack('<I4s', len(header), b'JSON'))
+            file.write(header)
+            if self._size:
+                file.write(struct.pack('<I4s', self._size + len(binary_padding), b'BIN\0'))
+                for data in self._data:
+                    file.write(data)
+                file.write(binary_padding)
+
+
+def gltf_matrix(matrix):
+    """Returns 4x4 matrix in glTF column-major order"""
+    return [float(v) for v in matrix.T.ravel()]
+
+
+def build_cache(ldrawdir, path):
+    """Writes the flattened geometry of all parts of the library in ldrawdir
+    to cache file path, returns the number of parts"""
+    # Library changes during the build make the cache stale
+    signature = library_signature(ldrawdir)
+    library = LDrawLibrary(ldrawdir)
+    model = LDrawModel(library)
+    geometry = {}
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as file:
+            file.write(CACHE_MAGIC)
+            offset = len(CACHE_MAGIC)
+            for key in sorted(library.parts):
+                if model.get_file(key) is None:
+                    continue
+                try:
+                    mesh = model.mesh(key)
+                except LDrawError as e:
+                    logger.warning('Could not flatten part {}: {}'.format(key, e))
+                    continue
+                finally:
+                    # Subparts and primitives stay cached, parts are used once
+                    model.forget(key)
+                data = mesh.vertices.astype('<f4').tobytes() + mesh.faces.astype('<u4').tobytes() + \
+                    mesh.colors.astype('<i4').tobytes()
+                file.write(data)
+                geometry[key] = [offset, len(mesh.vertices), len(mesh.faces)]
+                offset += len(data)
+            index = json.dumps({'ldrawdir': os.path.abspath(ldrawdir),
+                                'paths': dict((key, os.path.relpath(library.find(key), ldrawdir))
+                                              for key in library.keys()),
+                                'parts': sorted(library.parts),
+                                'geometry': geometry}, separators=(',', ':')).encode()
+            file.write(index)
+            file.write(CACHE_TRAILER.pack(offset, len(index), signature.encode(), CACHE_MAGIC))
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return len(geometry)
+
+
+def convert(input_path, output_path, library, block_cache=None):
+    """Converts LDraw file input_path to GLB file output_path, returns dict of statistics"""
+    model = LDrawModel.load(input_path, library, block_cache)
+    main = model.main
+    if main.is_part:
+        expansion = Expansion(np.array([main.name]), np.array([MAIN_COLOR]), IDENTITY[np.newaxis],
+                              np.array([False]), np.empty((0, 3, 3)), np.empty((0,), np.int64))
+    else:
+        expansion = model.expand(main.name)
+
+    writer = GLBWriter()
+    # LDraw is -Y up, glTF +Y up
+    root = writer.add_node({'name': main.name, 'matrix': gltf_matrix(np.diag((1.0, -1.0, -1.0, 1.0)))})
+    mesh = writer.add_mesh(main.name, weld_triangles(expansion.triangles, expansion.triangle_colors), library.color)
+    if mesh is not None:
+        writer.add_node({'name': main.name, 'mesh': mesh}, root)
+
+    meshes = {}
+    for name, color, matrix, invert in zip(expansion.names.tolist(), expansion.colors.tolist(),
+                                           expansion.matrices, expansion.inverts.tolist()):
+        key = (normalize_name(name), color, invert)
+        mesh = meshes.get(key)
+        if mesh is None:
+            part = model.mesh(name)
+            part = Mesh(part.vertices, part.faces[:, ::-1] if invert else part.faces,
+                        substitute_color(part.colors, color))
+            mesh = meshes[key] = writer.add_mesh(name, part, library.color)
+        node = {'name': name}
+        if mesh is not None:
+            node['mesh'] = mesh
+        if np.array_equal(matrix[:3, :3], IDENTITY[:3, :3]):
+            if matrix[:3, 3].any():
+                node['translation'] = [float(v) for v in matrix[:3, 3]]
+        else:
+            node['matrix'] = gltf_matrix(matrix)
+        writer.add_node(node, root)
+
+    writer.write(output_path)
+    if block_cache is not None:
+        block_cache.prune()
+    return {'instances': len(expansion.names), 'meshes': len(meshes), 'missing': sorted(model.missing),
+            'reused': model.reused, 'built': model.built}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Converts LDraw LDR and MPD files to glTF 2.0 binary (GLB)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log statistics')
+    parser.add_argument('--ldrawdir', default=os.getenv('LDRAWDIR', '/usr/share/ldraw'),
+                        help='LDraw library folder, default: $LDRAWDIR')
+    parser.add_argument('--cache', help='library cache file written by --build-cache')
+    parser.add_argument('--build-cache', metavar='CACHE', help='compile the parts of the library to file CACHE')
+    parser.add_argument('--block-cache', metavar='DIR',
+                        help='folder of converted sub-models and parts of MPD files, reused by later conversions')
+    parser.add_argument('--block-cache-size', type=int, default=10000,
+                        help='maximum number of files in the block cache, 0 for no limit, default: %(default)s')
+    parser.add_argument('input', nargs='?', help='LDR or MPD input file')
+    parser.add_argument('output', nargs='?', help='GLB output file')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(levelname)s: %(message)s')
+
+    if args.build_cache:
+        cache_dir = os.path.dirname(args.build_cache)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with fasteners.InterProcessLock(args.build_cache + '.lock'):
+            # Another process may have built it while we waited for the lock
+            if cache_signature(args.build_cache) == library_signature(args.ldrawdir):
+                logger.info('LDraw library cache {} is up to date'.format(args.build_cache))
+                return 0
+            try:
+                count = build_cache(args.ldrawdir, args.build_cache)
+            except (IOError, OSError) as e:
+                logger.error('Could not build LDraw library cache {}: {}'.format(args.build_cache, e))
+                return 1
+        logger.info('Wrote {} parts to LDraw library cache {}'.format(count, args.build_cache))
+        return 0
+
+    if not args.input or not args.output:
+        parser.error('input and output files are required')
+    try:
+        block_cache = BlockCache(args.block_cache, args.block_cache_size) if args.block_cache else None
+        stats = convert(args.input, args.output, LDrawLibrary.open(args.ldrawdir, args.cache), block_cache)
+    except (LDrawError, IOError, OSError, ValueError) as e:
+        logger.error('Could not convert {}: {}'.format(args.input, e))
+        return 1
+    logger.info('Wrote {} instances of {} meshes to {}'.format(stats['instances'], stats['meshes'], args.output))
+    if block_cache is not None:
+        logger.info('Reused {} and built {} document blocks'.format(stats['reused'], stats['built']))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+"""
+    Mesh optimization of glTF 2.0 binary (GLB) files
+
+    Rewrites the triangle primitives of a GLB file with vectorized NumPy
+    passes, selected with --stages:
+
+    weld        merges vertices with equal attributes, positions are compared
+                on a grid of --weld-tolerance when it is not 0
+    degenerate  removes triangles with repeated vertices or zero area
+    reorder     sorts triangles along a Morton curve of their centroids, so
+                neighbouring triangles share the post-transform vertex cache
+    quantize    stores positions as 16 bit integers with --quantize-bits
+                precision and normals as normalized bytes, the nodes of the
+                meshes get the dequantization transform (KHR_mesh_quantization)
+
+    Vertices are always numbered in order of first use by the indices,
+    unused vertices are removed and indices are 16 bit when possible.
+    Primitives with other modes, morph targets or extensions are copied
+    unchanged, files with compressed geometry are copied as they are.
+
+    With --simplify the file is written as levels of detail instead, one
+    per grid size. Vertices of the triangle primitives of every mesh are
+    clustered on a grid with the given number of cells along the longest
+    side of the bounding box of the scene, meshes smaller than a cell are
+    left out.
+
+    Usage: meshopt.py [-v] [--stages weld,degenerate,reorder,quantize] [--weld-tolerance T]
+                      [--quantize-bits N] input.glb output.glb
+           meshopt.py [-v] --simplify CELLS[,CELLS...] input.glb output.glb [output.glb...]
+"""
+
+import argparse
+import collections
+import copy
+import json
+import logging
+import shutil
+import struct
+import sys
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('weld', 'degenerate', 'reorder', 'quantize')
+DEFAULT_STAGES = ('weld', 'degenerate', 'reorder')
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+TRIANGLES = 4
+
+COMPONENT_TYPES = {5120: np.int8, 5121: np.uint8, 5122: np.int16, 5123: np.uint16, 5125: np.uint32,
+                   5126: np.float32}
+COMPONENT_TYPE_IDS = dict((np.dtype(dtype), component_type) for component_type, dtype in COMPONENT_TYPES.items())
+TYPE_SIZES = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+
+# Geometry of these extensions is not in plain accessors
+UNSUPPORTED_EXTENSIONS = frozenset(('KHR_draco_mesh_compression', 'EXT_meshopt_compression',
+                                    'KHR_mesh_quantization'))
+
+# Bits per axis of the Morton codes of triangle centroids
+MORTON_BITS = 10
+
+
+class GLBError(Exception):
+    pass
+
+
+def read_glb(path):
+    """Returns tuple (glTF JSON, binary chunk as memoryview) of GLB file path"""
+    with open(path, 'rb') as file:
+        data = memoryview(file.read())
+    if len(data) < 12:
+        raise GLBError('{} is not a GLB file'.format(path))
+    magic, version, length = struct.unpack_from('<4sII', data)
+    if magic != b'glTF' or version != 2:
+        raise GLBError('{} is not a glTF 2.0 binary file'.format(path))
+    gltf = None
+    binary = memoryview(b'')
+    offset = 12
+    end = min(length, len(data))
+    while offset + 8 <= end:
+        chunk_length, chunk_type = struct.unpack_from('<I4s', data, offset)
+        offset += 8
+        chunk = data[offset:offset + chunk_length]
+        offset += chunk_length
+        if chunk_type == b'JSON' and gltf is None:
+            gltf = json.loads(chunk.tobytes().decode('utf-8'))
+        elif chunk_type == b'BIN\0' and not len(binary):
+            binary = chunk
+    if gltf is None:
+        raise GLBError('{} has no JSON chunk'.format(path))
+    return gltf, binary
+
+
+def read_accessor(gltf, binary, index):
+    """Returns accessor index as read-only array of shape (count, components)"""
+    accessor = gltf['accessors'][index]
+    if 'sparse' in accessor:
+        raise GLBError('sparse accessor {}'.format(index))
+    try:
+        dtype = np.dtype(COMPONENT_TYPES[accessor['componentType']]).newbyteorder('<')
+        components = TYPE_SIZES[accessor['type']]
+    except KeyError:
+        raise GLBError('invalid accessor {}'.format(index))
+    count = accessor['count']
+    if 'bufferView' not in accessor:
+        return np.zeros((count, components), dtype)
+    view = gltf['bufferViews'][accessor['bufferView']]
+    if view.get('buffer', 0) != 0:
+        raise GLBError('accessor {} is not in the binary chunk'.format(index))
+    offset = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    stride = view.get('byteStride') or dtype.itemsize * components
+    if count and offset + stride * (count - 1) + dtype.itemsize * components > \
+            min(len(binary), view.get('byteOffset', 0) + view['byteLength']):
+        raise GLBError('accessor {} exceeds its buffer view'.format(index))
+    return np.ndarray((count, components), dtype, buffer=binary, offset=offset, strides=(stride, dtype.itemsize))
+
+
+def weld(attributes, tolerance=0.0):
+    """Returns tuple (index of the first vertex of every group of equal vertices,
+    group of every vertex) of attributes, dict of arrays of equal length"""
+    count = len(attributes['POSITION'])
+    columns = []
+    for name in sorted(attributes):
+        array = attributes[name]
+        if name == 'POSITION' and tolerance > 0:
+            array = np.round(array / tolerance).astype(np.int64)
+        elif array.dtype.kind == 'f':
+            # -0.0 equals 0.0
+            array = array + array.dtype.type(0)
+        columns.append(np.ascontiguousarray(array).view(np.uint8).reshape(count, -1))
+    keys = np.ascontiguousarray(np.concatenate(columns, axis=1))
+    # Rows as opaque bytes, sorted with memcmp
+    keys = keys.view(np.dtype((np.void, keys.shape[1]))).reshape(-1)
+    unique, first, groups = np.unique(keys, return_index=True, return_inverse=True)
+    return first, groups.reshape(-1)
+
+
+def degenerate_triangles(faces, positions):
+    """Returns mask of faces with repeated vertices or zero area"""
+    mask = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 0] == faces[:, 2])
+    triangles = positions[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    return mask | ~normals.any(axis=1)
+
+
+def _spread_bits(values):
+    """Inserts two zero bits between the low 10 bits of values"""
+    values = values & np.uint64(0x3FF)
+    values = (values | (values << np.uint64(16))) & np.uint64(0x030000FF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x0300F00F)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x030C30C3)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x09249249)
+    return values
+
+
+def morton_order(points):
+    """Returns the order of points along the Morton curve of their bounding cube"""
+    if not len(points):
+        return np.arange(0)
+    low = points.min(axis=0)
+    extent = float((points.max(axis=0) - low).max())
+    if not extent > 0:
+        return np.arange(len(points))
+    cells = (1 << MORTON_BITS) - 1
+    grid = np.clip((points - low) * (cells / extent), 0, cells).astype(np.uint64)
+    codes = _spread_bits(grid[:, 0]) | (_spread_bits(grid[:, 1]) << np.uint64(1)) | \
+        (_spread_bits(grid[:, 2]) << np.uint64(2))
+    return np.argsort(codes, kind='stable')
+
+
+def read_triangles(gltf, binary, primitive):
+    """Returns tuple (attributes, faces) of primitive, attributes is a dict of
+    arrays of equal length and faces an array of shape (n, 3), or None if the
+    primitive is not a plain triangle list"""
+    if primitive.get('mode', TRIANGLES) != TRIANGLES or 'POSITION' not in primitive.get('attributes', {}) or \
+            primitive.get('targets') or primitive.get('extensions'):
+        return None
+    attributes = dict((name, read_accessor(gltf, binary, index)) for name, index in primitive['attributes'].items())
+    count = len(attributes['POSITION'])
+    if 'indices' in primitive:
+        faces = read_accessor(gltf, binary, primitive['indices'])[:, 0].astype(np.int64)
+    else:
+        faces = np.arange(count)
+    faces = faces[:len(faces) // 3 * 3].reshape(-1, 3)
+    if len(faces) and (faces.max() >= count or faces.min() < 0):
+        raise GLBError('index out of range')
+    return attributes, faces
+
+
+def compact_vertices(attributes, faces):
+    """Returns tuple (attributes, faces) with the vertices in order of first use,
+    unused ones are dropped"""
+    used, first_use = np.unique(faces.reshape(-1), return_index=True)
+    order = used[np.argsort(first_use)]
+    numbers = np.empty(len(attributes['POSITION']), dtype=np.int64)
+    numbers[order] = np.arange(len(order))
+    return dict((name, array[order]) for name, array in attributes.items()), numbers[faces]
+
+
+def optimize_primitive(attributes, faces, stages, tolerance=0.0):
+    """Returns tuple (attributes, faces) of the optimized triangle list"""
+    if 'weld' in stages:
+        first, groups = weld(attributes, tolerance)
+        attributes = dict((name, array[first]) for name, array in attributes.items())
+        faces = groups[faces]
+    if 'degenerate' in stages or 'reorder' in stages:
+        positions = attributes['POSITION'].astype(np.float64)
+        if 'degenerate' in stages:
+            faces = faces[~degenerate_triangles(faces, positions)]
+        if 'reorder' in stages:
+            faces = faces[morton_order(positions[faces].mean(axis=1))]
+    return compact_vertices(attributes, faces)
+
+
+def simplify_primitive(attributes, faces, low, cell_size):
+    """Returns tuple (attributes, faces) simplified by vertex clustering, the
+    vertices in a cell of the grid at low with cell_size merge into their mean
+    position, the other attributes are those of the first vertex of the cell"""
+    positions = attributes['POSITION'].astype(np.float64)
+    cells = np.ascontiguousarray(np.floor((positions - low) / cell_size).astype(np.int64))
+    unique, first, clusters = np.unique(cells.view(np.dtype((np.void, cells.itemsize * 3))).reshape(-1),
+                                        return_index=True, return_inverse=True)
+    clusters = clusters.reshape(-1)
+    counts = np.bincount(clusters)
+    means = np.stack([np.bincount(clusters, weights=positions[:, axis]) for axis in range(3)], axis=1) / \
+        counts[:, np.newaxis]
+    dtype = attributes['POSITION'].dtype
+    attributes = dict((name, array[first]) for name, array in attributes.items())
+    attributes['POSITION'] = (means if dtype.kind == 'f' else np.round(means)).astype(dtype)
+
+    faces = clusters[faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    # Triangles collapsed onto the same vertices, the first one is kept
+    corners = np.ascontiguousarray(np.sort(faces, axis=1))
+    unique, first = np.unique(corners.view(np.dtype((np.void, corners.itemsize * 3))).reshape(-1), return_index=True)
+    return compact_vertices(attributes, faces[np.sort(first)])
+
+
+def _accessor_references(gltf):
+    """Yields tuples (object, key) of all references to accessors"""
+    for mesh in gltf.get('meshes', []):
+        for primitive in mesh.get('primitives', []):
+            for attributes in [primitive.get('attributes', {})] + primitive.get('targets', []):
+                for name in attributes:
+                    yield attributes, name
+            if 'indices' in primitive:
+                yield primitive, 'indices'
+    for skin in gltf.get('skins', []):
+        if 'inverseBindMatrices' in skin:
+            yield skin, 'inverseBindMatrices'
+    for animation in gltf.get('animations', []):
+        for sampler in animation.get('samplers', []):
+            yield sampler, 'input'
+            yield sampler, 'output'
+    for node in gltf.get('nodes', []):
+        instancing = node.get('extensions', {}).get('EXT_mesh_gpu_instancing')
+        if instancing:
+            for name in instancing.get('attributes', {}):
+                yield instancing['attributes'], name
+
+
+class BufferBuilder(object):
+    """Binary chunk of the optimized file, buffer views are copied from
+    binary or added from arrays"""
+
+    def __init__(self, binary, views):
+        self._binary = binary
+        self._old_views = views
+        self._copied = {}
+        self.views = []
+        self.chunks = []
+        self.size = 0
+
+    def _append(self, data, view):
+        padding = -self.size % 4
+        if padding:
+            self.chunks.append(b'\0' * padding)
+            self.size += padding
+        view.update({'buffer': 0, 'byteOffset': self.size, 'byteLength': len(data)})
+        self.chunks.append(data)
+        self.size += len(data)
+        self.views.append(view)
+        return len(self.views) - 1
+
+    def copy(self, index):
+        """Returns the index of copied buffer view index of the input"""
+        new_index = self._copied.get(index)
+        if new_index is None:
+            view = dict(self._old_views[index])
+            start = view.get('byteOffset', 0)
+            new_index = self._copied[index] = self._append(self._binary[start:start + view['byteLength']].tobytes(),
+                                                           view)
+        return new_index
+
+    def add(self, array, target):
+        """Returns the index of a new buffer view of array, vertex attributes are padded to 4 bytes"""
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        view = {'target': target}
+        row_size = array.itemsize * array.shape[1]
+        if target == ARRAY_BUFFER and row_size % 4:
+            stride = row_size + (-row_size % 4)
+            padded = np.zeros((len(array), stride), dtype=np.uint8)
+            padded[:, :row_size] = array.view(np.uint8).reshape(len(array), row_size)
+            array = padded
+            view['byteStride'] = stride
+        return self._append(array.tobytes(), view)
+
+
+def _quantizable_meshes(gltf, meshes):
+    """Returns the meshes of meshes that may be quantized, skinned and
+    instanced meshes keep float positions"""
+    for node in gltf.get('nodes', []):
+        if 'mesh' in node and ('skin' in node or 'EXT_mesh_gpu_instancing' in node.get('extensions', {})):
+            meshes.discard(node['mesh'])
+    return meshes
+
+
+def _add_accessor(gltf, arrays, array, target, accessor_type, **kwargs):
+    """Appends accessor of array of shape (count, components), written by _compact()"""
+    accessors = gltf['accessors']
+    accessor = {'componentType': COMPONENT_TYPE_IDS[array.dtype], 'count': len(array), 'type': accessor_type}
+    accessor.update(kwargs)
+    accessors.append(accessor)
+    arrays[len(accessors) - 1] = (array, target)
+    return len(accessors) - 1
+
+
+def _write_primitive(gltf, arrays, primitive, attributes, faces, normalized=()):
+    """Replaces the accessors of primitive with attributes and faces, the names
+    of normalized are normalized integer attributes"""
+    new_attributes = {}
+    for name, array in attributes.items():
+        old = gltf['accessors'][primitive['attributes'][name]]
+        kwargs = {}
+        if old.get('normalized') or name in normalized:
+            kwargs['normalized'] = True
+        if name == 'POSITION':
+            kwargs.update({'min': array.min(axis=0).tolist(), 'max': array.max(axis=0).tolist()})
+        new_attributes[name] = _add_accessor(gltf, arrays, array, ARRAY_BUFFER, old['type'], **kwargs)
+    primitive['attributes'] = new_attributes
+    faces = faces.reshape(-1, 1).astype(np.uint16 if len(attributes['POSITION']) < 0xFFFF else np.uint32)
+    primitive['indices'] = _add_accessor(gltf, arrays, faces, ELEMENT_ARRAY_BUFFER, 'SCALAR')
+
+
+def _read_mesh(gltf, binary, mesh_index, mesh):
+    """Returns list of the result of read_triangles() of every primitive of mesh, None for primitives
+    that are not plain triangle lists or could not be read"""
+    results = []
+    for primitive in mesh.get('primitives', []):
+        try:
+            results.append(read_triangles(gltf, binary, primitive))
+        except (GLBError, IndexError, KeyError, TypeError) as e:
+            logger.warning('Primitive of mesh {} is not optimized: {}'.format(mesh_index, e))
+            results.append(None)
+    return results
+
+
+def optimize(gltf, binary, stages, tolerance=0.0, bits=14):
+    """Optimizes the triangle primitives of gltf, returns tuple (gltf, BufferBuilder, statistics)"""
+    stats = collections.Counter()
+    gltf.setdefault('accessors', [])
+    arrays = {}  # Accessor index: tuple (array, target) of new accessors
+
+    results = {}
+    quantizable = set()
+    for mesh_index, mesh in enumerate(gltf.get('meshes', [])):
+        mesh_results = []
+        for result in _read_mesh(gltf, binary, mesh_index, mesh):
+            if result is not None:
+                attributes, faces = result
+                vertex_count = len(attributes['POSITION'])
+                triangle_count = len(faces)
+                result = optimize_primitive(attributes, faces, stages, tolerance)
+                if len(result[1]):
+                    stats['vertices'] += vertex_count
+                    stats['triangles'] += triangle_count
+                else:
+                    # Primitives need at least one element, the empty one is kept
+                    result = None
+            mesh_results.append(result)
+        results[mesh_index] = mesh_results
+        if mesh_results and all(result is not None for result in mesh_results):
+            quantizable.add(mesh_index)
+    quantizable = _quantizable_meshes(gltf, quantizable) if 'quantize' in stages else set()
+
+    dequantization = {}
+    for mesh_index, mesh in enumerate(gltf.get('meshes', [])):
+        mesh_results = results[mesh_index]
+        if mesh_index in quantizable:
+            positions = [result[0]['POSITION'].astype(np.float64) for result in mesh_results]
+            low = np.min([p.min(axis=0) for p in positions], axis=0)
+            high = np.max([p.max(axis=0) for p in positions], axis=0)
+            # Uniform scale keeps normals valid
+            scale = float((high - low).max()) / ((1 << bits) - 1) or 1.0
+            dequantization[mesh_index] = (low, scale)
+        for primitive, result in zip(mesh.get('primitives', []), mesh_results):
+            if result is None:
+                continue
+            attributes, faces = result
+            stats['primitives'] += 1
+            stats['optimized_vertices'] += len(attributes['POSITION'])
+            stats['optimized_triangles'] += len(faces)
+            normalized = []
+            if mesh_index in dequantization:
+                low, scale = dequantization[mesh_index]
+                attributes = dict(attributes)
+                attributes['POSITION'] = np.round((attributes['POSITION'] - low) / scale).astype(np.uint16)
+                if 'NORMAL' in attributes and attributes['NORMAL'].dtype == np.float32:
+                    attributes['NORMAL'] = np.round(np.clip(attributes['NORMAL'], -1.0, 1.0) * 127.0).astype(np.int8)
+                    normalized.append('NORMAL')
+            _write_primitive(gltf, arrays, primitive, attributes, faces, normalized)
+
+    if dequantization:
+        nodes = gltf['nodes']
+        for node in list(nodes):
+            transform = dequantization.get(node.get('mesh'))
+            if transform is None:
+                continue
+            low, scale = transform
+            # Mesh moves to a child node, animations of the node stay valid
+            nodes.append({'mesh': node.pop('mesh'), 'translation': low.tolist(), 'scale': [scale] * 3})
+            node.setdefault('children', []).append(len(nodes) - 1)
+        for key in ('extensionsUsed', 'extensionsRequired'):
+            gltf.setdefault(key, []).append('KHR_mesh_quantization')
+
+    return gltf, _compact(gltf, binary, arrays), stats
+
+
+def _compact(gltf, binary, arrays):
+    """Drops unused accessors and buffer views, returns BufferBuilder of the new binary chunk"""
+    accessors = gltf.get('accessors', [])
+    references = list(_accessor_references(gltf))
+    used = sorted(set(container[key] for container, key in references))
+    numbers = dict((old, new) for new, old in enumerate(used))
+    for container, key in references:
+        container[key] = numbers[container[key]]
+
+    builder = BufferBuilder(binary, gltf.get('bufferViews', []))
+    new_accessors = []
+    for index in used:
+        accessor = accessors[index]
+        if index in arrays:
+            array, target = arrays[index]
+            accessor['bufferView'] = builder.add(array, target)
+        else:
+            if 'bufferView' in accessor:
+                accessor['bufferView'] = builder.copy(accessor['bufferView'])
+            for part in ('indices', 'values'):
+                if part in accessor.get('sparse', {}):
+                    accessor['sparse'][part]['bufferView'] = builder.copy(accessor['sparse'][part]['bufferView'])
+        new_accessors.append(accessor)
+    for image in gltf.get('images', []):
+        if 'bufferView' in image:
+            image['bufferView'] = builder.copy(image['bufferView'])
+
+    for key, values in (('accessors', new_accessors), ('bufferViews', builder.views)):
+        if values:
+            gltf[key] = values
+        else:
+            gltf.pop(key, None)
+    if builder.size:
+        buffer = dict(gltf['buffers'][0])
+        buffer['byteLength'] = builder.size
+        gltf['buffers'] = [buffer]
+    else:
+        gltf.pop('buffers', None)
+    return builder
+
+
+def write_glb(path, gltf, builder):
+    header = json.dumps(gltf, separators=(',', ':')).encode()
+    header += b' ' * (-len(header) % 4)
+    binary_padding = b'\0' * (-builder.size % 4)
+    length = 12 + 8 + len(header) + (8 + builder.size + len(binary_padding) if builder.size else 0)
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<4sII', b'glTF', 2, length))
+        file.write(struct.pack('<I4s', len(header), b'JSON'))
+        file.write(header)
+        if builder.size:
+            file.write(struct.pack('<I4s', builder.size + len(binary_padding), b'BIN\0'))
+            for data in builder.chunks:
+                file.write(data)
+            file.write(binary_padding)
+
+
+def _local_matrix(node):
+    """Returns the 4x4 transform of node relative to its parent"""
+    if 'matrix' in node:
+        return np.array(node['matrix'], dtype=np.float64).reshape(4, 4).T
+    x, y, z, w = node.get('rotation', (0.0, 0.0, 0.0, 1.0))
+    rotation = np.array([[1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+                         [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+                         [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]])
+    matrix = np.identity(4)
+    matrix[:3, :3] = rotation * np.array(node.get('scale', (1.0, 1.0, 1.0)), dtype=np.float64)
+    matrix[:3, 3] = node.get('translation', (0.0, 0.0, 0.0))
+    return matrix
+
+
+def mesh_instances(gltf):
+    """Returns dict mapping mesh indices to lists of the world transforms of
+    the nodes of the default scene referencing them"""
+    nodes = gltf.get('nodes', [])
+    scenes = gltf.get('scenes')
+    if scenes:
+        roots = scenes[gltf.get('scene', 0)].get('nodes', [])
+    else:
+        children = set(child for node in nodes for child in node.get('children', []))
+        roots = [index for index in range(len(nodes)) if index not in children]
+    instances = collections.defaultdict(list)
+    stack = [(index, np.identity(4)) for index in roots]
+    visited = set()
+    while stack:
+        index, parent = stack.pop()
+        if index in visited:
+            continue
+        visited.add(index)
+        node = nodes[index]
+        matrix = parent.dot(_local_matrix(node))
+        if 'mesh' in node:
+            instances[node['mesh']].append(matrix)
+        stack.extend((child, matrix) for child in node.get('children', []))
+    return instances
+
+
+def _remove_meshes(gltf, removed):
+    """Removes the meshes of set removed and the references of nodes to them"""
+    numbers = {}
+    meshes = []
+    for mesh_index, mesh in enumerate(gltf['meshes']):
+        if mesh_index not in removed:
+            numbers[mesh_index] = len(meshes)
+            meshes.append(mesh)
+    for node in gltf.get('nodes', []):
+        if 'mesh' not in node:
+            continue
+        if node['mesh'] in removed:
+            for key in ('mesh', 'skin', 'weights'):
+                node.pop(key, None)
+            node.get('extensions', {}).pop('EXT_mesh_gpu_instancing', None)
+        else:
+            node['mesh'] = numbers[node['mesh']]
+    gltf['meshes'] = meshes
+
+
+def simplify(gltf, binary, cells):
+    """Simplifies the triangle primitives of gltf by vertex clustering on a world
+    space grid of cells along the longest side of the bounding box of the scene,
+    returns tuple (gltf, BufferBuilder, statistics).
+
+    Every mesh is clustered in its local space with the world cell size divided
+    by the largest scale of its instances, instanced meshes stay shared. Meshes
+    collapsing completely are removed, unless all meshes would be removed."""
+    stats = collections.Counter()
+    gltf.setdefault('accessors', [])
+    arrays = {}
+    instances = mesh_instances(gltf)
+
+    meshes = []
+    scene_low, scene_high = np.full(3, np.inf), np.full(3, -np.inf)
+    for mesh_index, mesh in enumerate(gltf.get('meshes', [])):
+        primitives = [(primitive, result) for primitive, result in zip(mesh.get('primitives', []),
+                                                                      _read_mesh(gltf, binary, mesh_index, mesh))
+                      if result is not None and len(result[1])]
+        if not primitives:
+            continue
+        positions = [result[0]['POSITION'].astype(np.float64) for primitive, result in primitives]
+        low = np.min([p.min(axis=0) for p in positions], axis=0)
+        high = np.max([p.max(axis=0) for p in positions], axis=0)
+        corners = np.array([[x, y, z, 1.0] for x in (low[0], high[0]) for y in (low[1], high[1])
+                            for z in (low[2], high[2])])
+        scale = 0.0
+        for matrix in instances.get(mesh_index, []):
+            world = corners.dot(matrix.T)[:, :3]
+            scene_low = np.minimum(scene_low, world.min(axis=0))
+            scene_high = np.maximum(scene_high, world.max(axis=0))
+            scale = max(scale, float(np.linalg.norm(matrix[:3, :3], axis=0).max()))
+        meshes.append((mesh_index, mesh, primitives, low, high, scale))
+    world_cell = float((scene_high - scene_low).max()) / cells if np.isfinite(scene_low).all() else 0.0
+
+    removed = set()
+    for mesh_index, mesh, primitives, low, high, scale in meshes:
+        if scale > 0 and world_cell > 0:
+            cell_size = world_cell / scale
+        else:
+            # Not in the scene, clustered on its own bounding box
+            cell_size = float((high - low).max()) / cells or 1.0
+        simplified = [(primitive, result, simplify_primitive(result[0], result[1], low, cell_size))
+                      for primitive, result in primitives]
+        if not any(len(faces) for primitive, result, (attributes, faces) in simplified):
+            removed.add(mesh_index)
+            continue
+        dropped = []
+        for primitive, result, (attributes, faces) in simplified:
+            if not len(faces):
+                dropped.append(primitive)
+                continue
+            stats['primitives'] += 1
+            stats['vertices'] += len(result[0]['POSITION'])
+            stats['triangles'] += len(result[1])
+            stats['optimized_vertices'] += len(attributes['POSITION'])
+            stats['optimized_triangles'] += len(faces)
+            _write_primitive(gltf, arrays, primitive, attributes, faces)
+        if dropped:
+            mesh['primitives'] = [primitive for primitive in mesh['primitives']
+                                  if not any(primitive is other for other in dropped)]
+    if removed and len(removed) < len(gltf['meshes']):
+        for mesh_index, mesh, primitives, low, high, scale in meshes:
+            if mesh_index in removed:
+                stats['vertices'] += sum(len(result[0]['POSITION']) for primitive, result in primitives)
+                stats['triangles'] += sum(len(result[1]) for primitive, result in primitives)
+        _remove_meshes(gltf, removed)
+    return gltf, _compact(gltf, binary, arrays), stats
+
+
+def _is_supported(gltf, unsupported_extensions=UNSUPPORTED_EXTENSIONS):
+    """Returns whether the geometry of gltf is in accessors of the binary chunk"""
+    extensions = set(gltf.get('extensionsUsed', [])) | set(gltf.get('extensionsRequired', []))
+    buffers = gltf.get('buffers', [])
+    return not extensions & unsupported_extensions and len(buffers) == 1 and 'uri' not in buffers[0]
+
+
+def optimize_file(input_path, output_path, stages=DEFAULT_STAGES, tolerance=0.0, bits=14):
+    """Writes GLB file input_path optimized to output_path, returns dict of statistics"""
+    gltf, binary = read_glb(input_path)
+    if not _is_supported(gltf):
+        logger.warning('{} has external or compressed geometry, it is not optimized'.format(input_path))
+        shutil.copyfile(input_path, output_path)
+        return collections.Counter()
+    gltf, builder, stats = optimize(gltf, binary, stages, tolerance, bits)
+    write_glb(output_path, gltf, builder)
+    return stats
+
+
+def simplify_file(input_path, output_paths, cells):
+    """Writes GLB file input_path simplified with every grid size of cells to
+    the corresponding file of output_paths, returns list of dicts of statistics"""
+    gltf, binary = read_glb(input_path)
+    # Quantized positions are clustered like float positions
+    if not _is_supported(gltf, UNSUPPORTED_EXTENSIONS - set(('KHR_mesh_quantization',))):
+        logger.warning('{} has external or compressed geometry, it is not simplified'.format(input_path))
+        for output_path in output_paths:
+            shutil.copyfile(input_path, output_path)
+        return [collections.Counter() for output_path in output_paths]
+    results = []
+    for output_path, level_cells in zip(output_paths, cells):
+        level, builder, stats = simplify(copy.deepcopy(gltf), binary, level_cells)
+        write_glb(output_path, level, builder)
+        results.append(stats)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Optimizes the meshes of glTF 2.0 binary (GLB) files')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log statistics')
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES),
+                        help='comma separated optimizations of {}, default: %(default)s'.format(', '.join(STAGES)))
+    parser.add_argument('--weld-tolerance', type=float, default=0.0,
+                        help='grid size of welded positions, 0 for equal positions, default: %(default)s')
+    parser.add_argument('--quantize-bits', type=int, default=14,
+                        help='precision of quantized positions, 8 to 16 bits, default: %(default)s')
+    parser.add_argument('--simplify', metavar='CELLS',
+                        help='comma separated grid sizes, write one level of detail per grid size instead')
+    parser.add_argument('input', help='GLB input file')
+    parser.add_argument('output', nargs='+', help='GLB output file, one per grid size with --simplify')
+    args = parser.parse_args(argv)
+
+    stages = tuple(stage for stage in args.stages.split(',') if stage)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error('unknown stages: {}'.format(', '.join(sorted(unknown))))
+    if args.weld_tolerance < 0:
+        parser.error('weld tolerance must not be negative')
+    if not 8 <= args.quantize_bits <= 16:
+        parser.error('quantize bits must be 8 to 16')
+    cells = None
+    if args.simplify:
+        try:
+            cells = [int(value) for value in args.simplify.split(',')]
+        except ValueError:
+            parser.error('invalid grid sizes: {}'.format(args.simplify))
+        if any(value < 1 for value in cells):
+            parser.error('grid sizes must be positive')
+        if len(cells) != len(args.output):
+            parser.error('one output file per grid size is required')
+    elif len(args.output) != 1:
+        parser.error('one output file is required')
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(levelname)s: %(message)s')
+
+    try:
+        if cells:
+            results = simplify_file(args.input, args.output, cells)
+        else:
+            results = [optimize_file(args.input, args.output[0], stages, args.weld_tolerance, args.quantize_bits)]
+    except (GLBError, IOError, OSError, ValueError) as e:
+        logger.error('Could not optimize {}: {}'.format(args.input, e))
+        return 1
+    for output_path, stats in zip(args.output, results):
+        logger.info('Wrote {} primitives from {} to {} vertices and {} to {} triangles to {}'.format(
+            stats['primitives'], stats['vertices'], stats['optimized_vertices'], stats['triangles'],
+            stats['optimized_triangles'], output_path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+
+import collections
+import contextlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    def __init__(self, message):
+        self.message = message
+        super(QueueFullError, self).__init__(message)
+
+
+class Scheduler(object):
+    """Fixed pool of worker threads executing jobs from a bounded FIFO queue.
+
+    Jobs are callables. Besides the number of workers, the concurrency of
+    individual stages of a job (e.g. 'download' and 'convert') can be limited:
+    a job enters a stage with the stage() context manager.
+    """
+
+    def __init__(self, workers, max_queue=0, stage_limits=None):
+        assert workers > 0
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._max_queue = max_queue
+        self._running = 0
+        self._shutdown = False
+        self._stages = {}
+        if stage_limits:
+            for name, limit in stage_limits.items():
+                if limit:
+                    self._stages[name] = threading.BoundedSemaphore(limit)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name='Scheduler-worker-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._shutdown:
+                    self._cond.wait()
+                if self._shutdown:
+                    return
+                job = self._queue.popleft()
+                self._running += 1
+            try:
+                job()
+            except Exception:
+                logger.exception('Job {!r} failed'.format(job))
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def submit(self, job):
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('Scheduler is shut down')
+            if self._max_queue and len(self._queue) >= self._max_queue:
+                raise QueueFullError('Too many pending conversions ({}), try again later'.format(
+                    len(self._queue)))
+            self._queue.append(job)
+            self._cond.notify()
+
+    def cancel(self, job):
+        """Remove job from the queue, returns False if it is not queued."""
+        with self._cond:
+            try:
+                self._queue.remove(job)
+            except ValueError:
+                return False
+            return True
+
+    def position(self, job):
+        """Returns zero-based position of job in the queue or None if it is not queued."""
+        with self._cond:
+            try:
+                return self._queue.index(job)
+            except ValueError:
+                return None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        semaphore = self._stages.get(name)
+        if semaphore is None:
+            yield
+        else:
+            with semaphore:
+                yield
+
+    def stats(self):
+        with self._cond:
+            return {'workers': len(self._threads),
+                    'running': self._running,
+                    'queued': len(self._queue),
+                    'maxQueued': self._max_queue}
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._queue.clear()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
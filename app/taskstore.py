@@ -0,0 +1,153 @@
+# This file is part of Web3DConverter. It is subject to the license terms in
+# the LICENSE file found in the top-level directory of this distribution.
+# You may not use this file except in compliance with the License.
+
+import errno
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Columns of the published task state
+STATE_FIELDS = ('status', 'version', 'finished', 'result_hash', 'error', 'path')
+
+
+def process_alive(pid):
+    """Returns True if process pid exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class TaskStore(object):
+    """Conversion task state shared by server processes of one host.
+
+    Every task has exactly one owner process running it. The owner claims
+    the task ID with claim() and publishes every change of the task state,
+    other processes read the state with load(). A task of an owner that
+    does not exist anymore can be taken over with take_over().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        path_dir = os.path.dirname(path)
+        if path_dir and not os.path.exists(path_dir):
+            os.makedirs(path_dir)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                             'task_id TEXT PRIMARY KEY, '
+                             'owner INTEGER NOT NULL, '
+                             'created REAL NOT NULL, '
+                             'accessed REAL NOT NULL, '
+                             'status TEXT, '
+                             'version INTEGER NOT NULL DEFAULT 0, '
+                             'finished INTEGER NOT NULL DEFAULT 0, '
+                             'result_hash TEXT, '
+                             'error TEXT, '
+                             'path TEXT, '
+                             'cancel INTEGER NOT NULL DEFAULT 0)')
+
+    def reset(self):
+        """Deletes all tasks. Must be called before server processes start, tasks
+        left by a previous run would look owned by unrelated processes that
+        reuse the PIDs of their owners"""
+        with self._lock:
+            self._db.execute('DELETE FROM tasks')
+
+    def _row_to_dict(self, row):
+        if row is None:
+            return None
+        state = dict(zip(('task_id', 'owner', 'created', 'accessed') + STATE_FIELDS, row))
+        state['finished'] = bool(state['finished'])
+        state['error'] = json.loads(state['error']) if state['error'] else None
+        state['path'] = json.loads(state['path']) if state['path'] else None
+        return state
+
+    def claim(self, task_id, owner):
+        """Registers task_id owned by process owner, returns False if the task already exists"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute('INSERT OR IGNORE INTO tasks (task_id, owner, created, accessed) '
+                                      'VALUES (?, ?, ?, ?)', (task_id, owner, now, now))
+            return cursor.rowcount == 1
+
+    def take_over(self, task_id, owner, previous_owner):
+        """Transfers task_id from previous_owner to owner and resets its state,
+        returns False if the task was meanwhile taken over by another process"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute('UPDATE tasks SET owner = ?, created = ?, accessed = ?, status = NULL, '
+                                      'version = version + 1, finished = 0, result_hash = NULL, error = NULL, '
+                                      'path = NULL, cancel = 0 '
+                                      'WHERE task_id = ? AND owner = ?',
+                                      (owner, now, now, task_id, previous_owner))
+            return cursor.rowcount == 1
+
+    def publish(self, task_id, owner, status, version, finished, result_hash, error, path=None):
+        """Stores state of task_id, error and path are None or JSON serializable"""
+        with self._lock:
+            self._db.execute('UPDATE tasks SET status = ?, version = ?, finished = ?, result_hash = ?, error = ?, '
+                             'path = ? WHERE task_id = ? AND owner = ?',
+                             (status, version, int(finished), result_hash,
+                              json.dumps(error) if error is not None else None,
+                              json.dumps(path) if path is not None else None,
+                              task_id, owner))
+
+    def load(self, task_id):
+        """Returns dict with task state or None"""
+        with self._lock:
+            row = self._db.execute('SELECT task_id, owner, created, accessed, status, version, finished, '
+                                   'result_hash, error, path FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return self._row_to_dict(row)
+
+    def touch(self, task_id):
+        with self._lock:
+            self._db.execute('UPDATE tasks SET accessed = ? WHERE task_id = ?', (time.time(), task_id))
+
+    def accessed(self, task_id):
+        """Returns last access time of task_id or None"""
+        with self._lock:
+            row = self._db.execute('SELECT accessed FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def request_cancel(self, task_id):
+        """Asks the owner of task_id to cancel it"""
+        with self._lock:
+            self._db.execute('UPDATE tasks SET cancel = 1 WHERE task_id = ? AND finished = 0', (task_id,))
+
+    def cancel_requests(self, owner):
+        """Returns IDs of unfinished tasks of owner requested to be cancelled"""
+        with self._lock:
+            rows = self._db.execute('SELECT task_id FROM tasks WHERE owner = ? AND cancel = 1 AND finished = 0',
+                                    (owner,)).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, task_id, owner=None):
+        with self._lock:
+            if owner is None:
+                self._db.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+            else:
+                self._db.execute('DELETE FROM tasks WHERE task_id = ? AND owner = ?', (task_id, owner))
+
+    def delete_orphans(self, max_age):
+        """Deletes tasks of exited owners not accessed for max_age seconds,
+        returns list of deleted task IDs"""
+        cutoff = time.time() - max_age
+        with self._lock:
+            rows = self._db.execute('SELECT task_id, owner FROM tasks WHERE accessed < ?', (cutoff,)).fetchall()
+        deleted = []
+        for task_id, owner in rows:
+            if not process_alive(owner):
+                self.delete(task_id, owner)
+                deleted.append(task_id)
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    Benchmark of FileDB key computation
+
+    Compares the former hash_file() implementation (SHA-1 over 64 KB reads)
+    with app.hashing.hash_file() for every supported algorithm.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import hashing
+
+
+def legacy_hash_file(filename):
+    BLOCKSIZE = 65536
+    hasher = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        buf = fd.read(BLOCKSIZE)
+        while len(buf) > 0:
+            hasher.update(buf)
+            buf = fd.read(BLOCKSIZE)
+    return hasher.hexdigest()
+
+
+def measure(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hashing of conversion results.")
+    parser.add_argument("-s", "--size", type=int, default=256,
+                        help="size of the test file in MB (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="number of runs, the best one is reported (default: %(default)s)")
+    parser.add_argument("file", nargs="?",
+                        help="file to hash instead of a generated one")
+    args = parser.parse_args()
+
+    tmp_name = None
+    if args.file:
+        filename = args.file
+    else:
+        fd, tmp_name = tempfile.mkstemp(prefix='bench', suffix='.bin')
+        with os.fdopen(fd, 'wb') as file:
+            block = os.urandom(1024 * 1024)
+            for i in range(args.size):
+                file.write(block)
+        filename = tmp_name
+
+    try:
+        size_mb = os.path.getsize(filename) / (1024.0 * 1024.0)
+        print('File: {} ({:.1f} MB), best of {} runs'.format(filename, size_mb, args.repeat))
+
+        cases = [('legacy sha1 (64 KB reads)', lambda: legacy_hash_file(filename))]
+        for algorithm in hashing.HASH_ALGORITHMS:
+            cases.append(('hash_file {}'.format(algorithm),
+                          lambda algorithm=algorithm: hashing.hash_file(filename, algorithm)))
+
+        assert legacy_hash_file(filename) == hashing.hash_file(filename, 'sha1')
+
+        baseline = None
+        for name, func in cases:
+            elapsed = measure(func, args.repeat)
+            if baseline is None:
+                baseline = elapsed
+            print('{:30s} {:8.3f} s {:8.1f} MB/s  x{:.2f}'.format(
+                name, elapsed, size_mb / elapsed, baseline / elapsed))
+    finally:
+        if tmp_name:
+            os.remove(tmp_name)
@@ -25,11 +25,15 @@ console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 logger = logging.getLogger()
 logger.addHandler(console_handler)
 
+import os
 import os.path
+import shutil
 import signal
+import socket
 import sys
 import argparse
 import copy
+import time
 import app
 
 
@@ -42,6 +46,83 @@ signal.signal(signal.SIGTERM, signal_term_handler)
 signal.signal(signal.SIGINT, signal_term_handler)
 
 
+def serve_prefork(host, port, workers, request_handler=None):
+    """Serve the application from workers forked processes accepting
+    connections on one shared listening socket. Processes share tasks
+    over TASK_STORE, exited processes are restarted.
+    """
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    # Temporary files are removed once here, not by each worker
+    for folder in app.tmp_folders(app.app.config['FILE_FOLDER'], app.app.config['CONVERSION_STAGE_FOLDER']):
+        shutil.rmtree(folder, ignore_errors=True)
+
+    # Tasks of a previous run are removed before their owner PIDs can be reused by workers
+    store = app.TaskStore(app.app.config['TASK_STORE'])
+    store.reset()
+    store.close()
+
+    def run_worker():
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        status = 1
+        try:
+            from werkzeug.serving import make_server
+
+            logger.info('Worker process {} started'.format(os.getpid()))
+            app.init(clean_tmp=False)
+            srv = make_server(host, port, app.app, threaded=True, request_handler=request_handler,
+                              fd=sock.fileno())
+            srv.serve_forever()
+            status = 0
+        except BaseException:
+            logger.exception('Worker process {} failed'.format(os.getpid()))
+        finally:
+            os._exit(status)
+
+    children = set()
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            run_worker()
+        children.add(pid)
+
+    def prefork_signal_term_handler(signal_number, frame):
+        logger.info('Got signal {}, stopping worker processes'.format(signal_number))
+        stopping.append(signal_number)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, prefork_signal_term_handler)
+    signal.signal(signal.SIGINT, prefork_signal_term_handler)
+
+    for i in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.warning('Worker process {} exited with status {}, restarting'.format(pid, status))
+            time.sleep(1)
+            spawn()
+    sys.exit(0)
+
+
 def set_loggers_level(loggers, level):
     for i in loggers:
         if isinstance(i, logging.Logger):
@@ -120,6 +201,8 @@ if __name__ == "__main__":
                         help="run application with wsgiref server", default=False)
     parser.add_argument("--use-rocket", action="store_true",
                         help="run application with Rocket server", default=False)
+    parser.add_argument("-w", "--workers", action="store", default=1, type=int,
+                        help="number of server processes sharing tasks over TASK_STORE (default: %(default)s)")
     parser.add_argument("-c", "--log-to-console", action="store_true",
                         help="output log to console", default=False)
     parser.add_argument("-p", "--port", action="store", default=8080, type=int,
@@ -178,6 +261,28 @@ if __name__ == "__main__":
     msg = 'app path: "%s"' % (app.app.instance_path)
     logger.info(msg)
 
+    from werkzeug.serving import WSGIRequestHandler
+
+
+    class CustomRequestHandler(WSGIRequestHandler):
+        def connection_dropped(self, error, environ=None):
+            print('dropped {} {}'.format(error, environ))
+
+
+    if args.workers > 1:
+        if args.use_wsgiref or args.use_rocket or use_reloader:
+            parser.error('--workers can not be combined with --use-wsgiref, --use-rocket or --use-reloader')
+        # Concurrency limits and queue sizes are divided among the worker processes
+        app.app.config['SERVER_PROCESSES'] = args.workers
+        if not app.app.config['TASK_STORE']:
+            app.app.config['TASK_STORE'] = os.path.join(app.app.instance_path, 'tasks.sqlite')
+        logger.info('Starting {} worker processes, task store: {}'.format(args.workers,
+                                                                        app.app.config['TASK_STORE']))
+        logger.info('Port: %d', args.port)
+        if args.debug_http:
+            set_loggers_level((None, 'werkzeug'), logging.DEBUG)
+        serve_prefork(args.host, args.port, args.workers, request_handler=CustomRequestHandler)
+
     # Initialize application
     logger.info('Initialize application')
     app.init()
@@ -226,18 +331,10 @@ if __name__ == "__main__":
             if args.debug_http:
                 set_loggers_level((None, 'werkzeug'), logging.DEBUG)
 
-            from werkzeug.serving import WSGIRequestHandler
-
-
-            class CustomRequestHandler(WSGIRequestHandler):
-                def connection_dropped(self, error, environ=None):
-                    print('dropped {} {}'.format(error, environ))
-
-
             app.app.run(debug=args.debug,
                         host=args.host,
                         port=args.port,
                         use_debugger=args.use_debugger,
                         use_reloader=args.use_reloader,
-                        threaded=False,
+                        threaded=True,  # Long polling and event streams need concurrent requests
                         request_handler=CustomRequestHandler)
@@ -0,0 +1,34 @@
+from app.converters import ConversionStep, Converter, ConverterRegistry, REFERENCE_SIZE
+
+
+def make_registry():
+    registry = ConverterRegistry()
+    direct = Converter('direct', None, ['a'], ['b'])
+    first = Converter('first', None, ['a'], ['x'])
+    second = Converter('second', None, ['x'], ['b'])
+    for converter in (direct, first, second):
+        registry.register(converter)
+    return registry, direct, first, second
+
+
+def test_unmeasured_prefers_direct_edge():
+    registry, direct, _, _ = make_registry()
+    path = registry.plan('a', 'b', 10 * REFERENCE_SIZE)
+    assert [step.converter for step in path] == [direct]
+
+
+def test_measured_slow_direct_edge_beats_unmeasured_detour():
+    registry, direct, _, _ = make_registry()
+    size = 10 * REFERENCE_SIZE
+    registry.record(ConversionStep(direct, 'a', 'b'), 5.0, REFERENCE_SIZE, REFERENCE_SIZE)
+    path = registry.plan('a', 'b', size)
+    assert [step.converter for step in path] == [direct]
+
+
+def test_measured_fast_detour_beats_measured_direct_edge():
+    registry, direct, first, second = make_registry()
+    registry.record(ConversionStep(direct, 'a', 'b'), 5.0, REFERENCE_SIZE, REFERENCE_SIZE)
+    registry.record(ConversionStep(first, 'a', 'x'), 1.0, REFERENCE_SIZE, REFERENCE_SIZE)
+    registry.record(ConversionStep(second, 'x', 'b'), 1.0, REFERENCE_SIZE, REFERENCE_SIZE)
+    path = registry.plan('a', 'b', 10 * REFERENCE_SIZE)
+    assert [step.converter for step in path] == [first, second]
@@ -0,0 +1,130 @@
+import os
+import time
+
+import pytest
+
+from app.filedb import FileDB, SQLiteFileDB
+
+
+@pytest.fixture(params=[FileDB, SQLiteFileDB], ids=['files', 'sqlite'])
+def backend(request):
+    return request.param
+
+
+def add(fdb, name, size=10, data=None):
+    source = os.path.join(fdb.path, '.source')
+    with open(source, 'wb') as file:
+        file.write(b'x' * size)
+    return fdb.get_or_create(name, data=data, move_from=source)
+
+
+def test_create_and_remove_are_seen_by_another_instance(tmp_path, backend):
+    first = backend(str(tmp_path))
+    second = backend(str(tmp_path))
+    add(first, 'a', data={'filename': 'a.glb'})
+    second.sync()
+    assert 'a' in second
+    assert second.get('a').get('filename') == 'a.glb'
+
+    first.remove('a')
+    second.sync()
+    assert 'a' not in second
+    assert not os.path.exists(os.path.join(str(tmp_path), 'a'))
+
+
+def test_metadata_changes_of_another_instance_are_kept(tmp_path, backend):
+    first = backend(str(tmp_path))
+    second = backend(str(tmp_path))
+    entry = add(first, 'a')
+    second.sync()
+    second.get('a')['encodings'] = {'gzip': 5}
+    entry['filename'] = 'a.glb'
+    assert second.get('a').get('filename') == 'a.glb'
+    assert first.get('a').get('encodings') == {'gzip': 5}
+
+
+def test_links(tmp_path, backend):
+    fdb = backend(str(tmp_path))
+    add(fdb, 'a')
+    add(fdb, 'b')
+    fdb.set_link('key', 'a')
+    assert fdb.get_link('key').name == 'a'
+    fdb.set_link('key', 'b')
+    assert fdb.get_link('key').name == 'b'
+    assert fdb.get_link('missing') is None
+
+    other = backend(str(tmp_path))
+    assert other.get_link('key').name == 'b'
+    fdb.remove('b')
+    assert fdb.get_link('key') is None
+
+
+def test_remove_deletes_sidecars_variants_and_links(tmp_path, backend):
+    fdb = backend(str(tmp_path))
+    for name in ('h1', 'h2', 'h3', 'h4'):
+        add(fdb, name, data={'filename': name})
+        fdb.set_link('key-' + name, name)
+        with open(fdb.variant_path(name, 'gzip', create=True), 'wb') as file:
+            file.write(b'z')
+    assert fdb.evict(max_entries=2) == ['h1', 'h2']
+
+    files = sorted(name for name in os.listdir(str(tmp_path)) if not name.startswith('.'))
+    if backend is FileDB:
+        assert files == ['h3', 'h3.data', 'h3.lock', 'h4', 'h4.data', 'h4.lock']
+    else:
+        assert files == ['h3', 'h4']
+    assert sorted(os.listdir(fdb.variants_path)) == ['h3', 'h4']
+    assert fdb.get_link('key-h1') is None
+    assert fdb.get_link('key-h3').name == 'h3'
+
+
+def test_usage_counts_variants(tmp_path, backend):
+    fdb = backend(str(tmp_path))
+    add(fdb, 'a', size=100)
+    with open(fdb.variant_path('a', 'gzip', create=True), 'wb') as file:
+        file.write(b'z' * 50)
+    [(name, size, accessed, hits, priority)] = fdb.usage()
+    assert name == 'a'
+    assert size >= 150
+
+
+def make_store(tmp_path, backend):
+    """Returns store with entries old (large, accessed once), hot (accessed
+    often) and new (small, accessed last)"""
+    fdb = backend(str(tmp_path))
+    add(fdb, 'old', size=1000)
+    add(fdb, 'hot', size=100)
+    add(fdb, 'new', size=10)
+    now = time.time()
+    for offset, name in enumerate(('old', 'hot', 'new')):
+        path = os.path.join(str(tmp_path), name)
+        os.utime(path, (now + offset, now + offset))
+        fdb.touch(name)
+    for i in range(5):
+        fdb.touch('hot')
+    fdb.touch('new')
+    return fdb
+
+
+def test_evict_lru(tmp_path, backend):
+    fdb = make_store(tmp_path, backend)
+    assert fdb.evict(max_entries=2, policy='lru') == ['old']
+
+
+def test_evict_lfu(tmp_path, backend):
+    fdb = make_store(tmp_path, backend)
+    assert fdb.evict(max_entries=1, policy='lfu') == ['old', 'new']
+
+
+def test_evict_gdsf(tmp_path, backend):
+    fdb = make_store(tmp_path, backend)
+    assert fdb.evict(max_entries=2, policy='gdsf') == ['old']
+    # Priority of the victim ages the remaining entries, a new large entry is evicted first
+    add(fdb, 'large', size=1000)
+    assert fdb.evict(max_entries=2, policy='gdsf') == ['large']
+
+
+def test_evict_size_budget(tmp_path, backend):
+    fdb = make_store(tmp_path, backend)
+    assert fdb.evict(max_size=1000, policy='lru') == ['old']
+    assert fdb.evict(max_size=1000, policy='lru') == []
@@ -0,0 +1,62 @@
+import struct
+
+import pytest
+
+from app.formats import FormatDetector
+
+
+def check(format_name, data):
+    return FormatDetector.check(format_name, data, len(data))
+
+
+@pytest.mark.parametrize('statement', [b'maplib tex.map', b'usemap tex', b'bevel on', b'lod 2', b'shadow_obj s.obj',
+                                       b'vendor_extension 1'])
+def test_obj_with_uncommon_statements_is_accepted(statement):
+    data = b'mtllib a.mtl\nv 0 0 0\nv 1 0 0\nv 0 1 0\n' + statement + b'\nf 1 2 3\n'
+    assert check('obj', data) is not False
+
+
+def test_obj_with_known_statements_matches():
+    assert check('obj', b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n') is True
+
+
+def test_off_with_leading_comment_is_accepted():
+    data = b'# exported mesh\n\nOFF\n3 1 0\n0 0 0\n1 0 0\n0 1 0\n3 0 1 2\n'
+    assert check('off', data) is True
+
+
+def test_off_without_header_is_accepted():
+    assert check('off', b'3 1 0\n0 0 0\n1 0 0\n0 1 0\n3 0 1 2\n') is not False
+
+
+def binary_stl(count, padding=0):
+    triangle = struct.pack('<12fH', *([0.0] * 12 + [0]))
+    return b'\0' * 80 + struct.pack('<I', count) + triangle * count + b'\0' * padding
+
+
+def test_binary_stl_matches():
+    assert check('stl', binary_stl(2)) is True
+
+
+def test_binary_stl_with_padding_is_accepted():
+    assert check('stl', binary_stl(2, padding=16)) is not False
+
+
+def test_short_binary_stl_is_rejected():
+    assert check('stl', b'\0' * 40) is False
+
+
+def chunk_3ds(length, size):
+    return b'MM' + struct.pack('<I', length) + b'\0' * (size - 6)
+
+
+def test_3ds_matches():
+    assert check('3ds', chunk_3ds(64, 64)) is True
+
+
+def test_3ds_with_wrong_chunk_length_is_accepted():
+    assert check('3ds', chunk_3ds(60, 64)) is not False
+
+
+def test_3ds_with_wrong_magic_is_rejected():
+    assert check('3ds', b'PK' + b'\0' * 62) is False
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+
+from app import ldraw, meshopt
+
+BRICK = '''0 Brick
+0 Name: brick.dat
+0 !LDRAW_ORG Part UPDATE 2024-01
+0 BFC CERTIFY CCW
+4 16 0 0 0 10 0 0 10 0 10 0 0 10
+1 16 0 0 0 1 0 0 0 1 0 0 0 1 s\\brick-s1.dat
+'''
+
+SUBPART = '''0 ~Brick Side
+0 Name: s\\brick-s1.dat
+0 !LDRAW_ORG Subpart UPDATE 2024-01
+0 BFC CERTIFY CCW
+3 16 0 0 0 0 -5 0 10 0 0
+'''
+
+MODEL = '''0 FILE model.ldr
+0 Model
+1 4 0 0 0 1 0 0 0 1 0 0 0 1 sub.ldr
+1 4 50 0 0 1 0 0 0 1 0 0 0 1 sub.ldr
+1 1 0 0 50 1 0 0 0 1 0 0 0 1 brick.dat
+
+0 FILE sub.ldr
+0 Sub-model
+1 16 0 0 0 1 0 0 0 1 0 0 0 1 brick.dat
+'''
+
+
+@pytest.fixture
+def library(tmp_path):
+    ldrawdir = tmp_path / 'ldraw'
+    (ldrawdir / 'parts' / 's').mkdir(parents=True)
+    (ldrawdir / 'parts' / 'brick.dat').write_text(BRICK)
+    (ldrawdir / 'parts' / 's' / 'brick-s1.dat').write_text(SUBPART)
+    return ldraw.LDrawLibrary(str(ldrawdir))
+
+
+def test_part_types():
+    assert ldraw.lines_are_part(BRICK.splitlines())
+    assert not ldraw.lines_are_part(SUBPART.splitlines())
+    assert not ldraw.lines_are_part(['0 !LDRAW_ORG Unofficial_Subpart'])
+    assert ldraw.lines_are_part(['0 !LDRAW_ORG Unofficial_Part'])
+
+
+def test_library_indexes_parts_without_subparts(library):
+    assert library.find('BRICK.DAT') is not None
+    assert library.find('s/brick-s1.dat') is not None
+    assert 'brick.dat' in library.parts
+    assert 's\\brick-s1.dat' not in library.parts and 's/brick-s1.dat' not in library.parts
+
+
+def test_parse_file_splits_quads():
+    file = ldraw.parse_file(BRICK.splitlines(), 'brick.dat')
+    assert file.is_part
+    assert len(file.triangles) == 2
+    assert [ref.name for ref in file.refs] == ['s\\brick-s1.dat']
+
+
+def test_convert_instances_parts(tmp_path, library):
+    input_path = str(tmp_path / 'model.mpd')
+    output_path = str(tmp_path / 'model.glb')
+    with open(input_path, 'w') as file:
+        file.write(MODEL)
+    ldraw.convert(input_path, output_path, library)
+
+    gltf, binary = meshopt.read_glb(output_path)
+    instances = meshopt.mesh_instances(gltf)
+    # One mesh per part and color, the subpart is flattened into the part
+    assert len(gltf['meshes']) == 2
+    assert sorted(len(matrices) for matrices in instances.values()) == [1, 2]
+    for mesh in gltf['meshes']:
+        [primitive] = mesh['primitives']
+        assert gltf['accessors'][primitive['indices']]['count'] == 3 * 3
+
+    # Red instances are placed 50 LDU apart, LDraw -Y up becomes glTF +Y up
+    red = max(instances, key=lambda mesh_index: len(instances[mesh_index]))
+    translations = sorted(matrix[:3, 3].tolist() for matrix in instances[red])
+    assert np.allclose(translations, [[0, 0, 0], [50, 0, 0]])
@@ -0,0 +1,144 @@
+import json
+import struct
+
+import numpy as np
+
+from app import meshopt
+
+
+def grid_mesh(size, count):
+    """Returns tuple (positions, indices) of a square of count x count quads with side size"""
+    steps = np.linspace(0.0, size, count + 1)
+    x, y = np.meshgrid(steps, steps)
+    positions = np.stack([x.reshape(-1), y.reshape(-1), np.zeros(x.size)], axis=1).astype(np.float32)
+    corners = (np.arange(count)[:, np.newaxis] * (count + 1) + np.arange(count)).reshape(-1)
+    indices = np.concatenate([np.stack([corners, corners + 1, corners + count + 2], axis=1),
+                              np.stack([corners, corners + count + 2, corners + count + 1], axis=1)])
+    return positions, indices.astype(np.uint32)
+
+
+def write_glb(path, meshes, nodes):
+    """Writes GLB file path with meshes, a list of tuples (positions, indices),
+    and nodes, all of them roots of the scene"""
+    gltf = {'asset': {'version': '2.0'}, 'scene': 0, 'scenes': [{'nodes': list(range(len(nodes)))}],
+            'nodes': nodes, 'meshes': [], 'accessors': [], 'bufferViews': []}
+    binary = b''
+    for positions, indices in meshes:
+        attributes = {}
+        for array, target, accessor_type in ((positions, meshopt.ARRAY_BUFFER, 'VEC3'),
+                                             (indices.reshape(-1, 1), meshopt.ELEMENT_ARRAY_BUFFER, 'SCALAR')):
+            data = np.ascontiguousarray(array).tobytes()
+            gltf['bufferViews'].append({'buffer': 0, 'byteOffset': len(binary), 'byteLength': len(data),
+                                        'target': target})
+            accessor = {'bufferView': len(gltf['bufferViews']) - 1, 'count': len(array), 'type': accessor_type,
+                        'componentType': meshopt.COMPONENT_TYPE_IDS[array.dtype]}
+            if accessor_type == 'VEC3':
+                accessor.update({'min': array.min(axis=0).tolist(), 'max': array.max(axis=0).tolist()})
+            gltf['accessors'].append(accessor)
+            attributes[accessor_type] = len(gltf['accessors']) - 1
+            binary += data
+        gltf['meshes'].append({'primitives': [{'attributes': {'POSITION': attributes['VEC3']},
+                                               'indices': attributes['SCALAR']}]})
+    gltf['buffers'] = [{'byteLength': len(binary)}]
+    header = json.dumps(gltf).encode()
+    header += b' ' * (-len(header) % 4)
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<4sII', b'glTF', 2, 12 + 8 + len(header) + 8 + len(binary)))
+        file.write(struct.pack('<I4s', len(header), b'JSON') + header)
+        file.write(struct.pack('<I4s', len(binary), b'BIN\0') + binary)
+
+
+def scene_triangles(path):
+    """Returns the number of triangles of all mesh instances of GLB file path"""
+    gltf, binary = meshopt.read_glb(path)
+    instances = meshopt.mesh_instances(gltf)
+    return sum(len(instances[mesh_index]) * gltf['accessors'][primitive['indices']]['count'] // 3
+               for mesh_index, mesh in enumerate(gltf.get('meshes', [])) for primitive in mesh['primitives'])
+
+
+def test_simplify_coarsens_instanced_meshes_relative_to_the_scene(tmp_path):
+    # Small part instanced across a large base plate, like LDraw models
+    meshes = [grid_mesh(100.0, 50), grid_mesh(1.0, 20)]
+    nodes = [{'mesh': 0}] + [{'mesh': 1, 'translation': [10.0 * i, 5.0, 1.0]} for i in range(10)]
+    input_path = str(tmp_path / 'input.glb')
+    write_glb(input_path, meshes, nodes)
+    output_paths = [str(tmp_path / 'lod{}.glb'.format(cells)) for cells in (32, 4)]
+    meshopt.simplify_file(input_path, output_paths, [32, 4])
+
+    full, fine, coarse = [scene_triangles(path) for path in [input_path] + output_paths]
+    assert full == 2 * 50 * 50 + 10 * 2 * 20 * 20
+    assert coarse < fine < full
+
+
+def test_simplify_scales_cells_with_the_instance_transform(tmp_path):
+    # Same mesh scaled up, a world space cell covers fewer local units
+    meshes = [grid_mesh(1.0, 20)]
+    input_path = str(tmp_path / 'input.glb')
+    output_path = str(tmp_path / 'lod.glb')
+    write_glb(input_path, meshes, [{'mesh': 0, 'scale': [100.0, 100.0, 100.0]}])
+    meshopt.simplify_file(input_path, [output_path], [10])
+    assert 0 < scene_triangles(output_path) < scene_triangles(input_path)
+
+
+def triangle_soup(positions, indices):
+    """Returns attributes and faces with three unshared vertices per triangle"""
+    return {'POSITION': positions[indices.reshape(-1)]}, np.arange(indices.size).reshape(-1, 3)
+
+
+def test_weld_merges_equal_vertices():
+    positions, indices = grid_mesh(1.0, 4)
+    attributes, faces = triangle_soup(positions, indices)
+    attributes, faces = meshopt.optimize_primitive(attributes, faces, ('weld',))
+    assert len(attributes['POSITION']) == 5 * 5
+    assert len(faces) == 2 * 4 * 4
+
+
+def test_weld_tolerance_merges_close_vertices():
+    positions = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [1.0001, 0, 0], [1, 1, 0], [0, 1.0001, 0]],
+                         dtype=np.float32)
+    faces = np.array([[0, 1, 2], [3, 4, 5]])
+    welded, welded_faces = meshopt.optimize_primitive({'POSITION': positions}, faces, ('weld',))
+    assert len(welded['POSITION']) == 6
+    welded, welded_faces = meshopt.optimize_primitive({'POSITION': positions}, faces, ('weld',), tolerance=0.01)
+    assert len(welded['POSITION']) == 4
+    assert welded_faces.tolist() == [[0, 1, 2], [1, 3, 2]]
+
+
+def test_degenerate_triangles_are_removed():
+    positions = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [2, 0, 0]], dtype=np.float32)
+    faces = np.array([[0, 1, 2], [0, 0, 2], [0, 1, 3]])
+    attributes, faces = meshopt.optimize_primitive({'POSITION': positions}, faces, ('degenerate',))
+    assert faces.tolist() == [[0, 1, 2]]
+    assert len(attributes['POSITION']) == 3
+
+
+def test_morton_order_sorts_along_the_curve():
+    points = np.array([[3, 3, 3], [0, 0, 0], [2, 2, 2], [1, 1, 1]], dtype=np.float64)
+    assert meshopt.morton_order(points).tolist() == [1, 3, 2, 0]
+    assert meshopt.morton_order(np.zeros((3, 3))).tolist() == [0, 1, 2]
+
+
+def test_quantize_writes_bounded_integer_positions(tmp_path):
+    positions, indices = grid_mesh(10.0, 8)
+    input_path = str(tmp_path / 'input.glb')
+    output_path = str(tmp_path / 'output.glb')
+    write_glb(input_path, [(positions, indices)], [{'mesh': 0, 'translation': [1.0, 2.0, 3.0]}])
+    stats = meshopt.optimize_file(input_path, output_path, stages=meshopt.STAGES, bits=12)
+    assert stats['optimized_vertices'] == 9 * 9
+
+    gltf, binary = meshopt.read_glb(output_path)
+    assert 'KHR_mesh_quantization' in gltf['extensionsRequired']
+    primitive = gltf['meshes'][0]['primitives'][0]
+    accessor = gltf['accessors'][primitive['attributes']['POSITION']]
+    assert accessor['componentType'] == meshopt.COMPONENT_TYPE_IDS[np.dtype(np.uint16)]
+    quantized = meshopt.read_accessor(gltf, binary, primitive['attributes']['POSITION'])
+    assert quantized.min() >= 0 and quantized.max() <= (1 << 12) - 1
+    assert accessor['min'] == quantized.min(axis=0).tolist()
+    assert accessor['max'] == quantized.max(axis=0).tolist()
+
+    # Dequantization node restores the positions up to half a step
+    [matrix] = meshopt.mesh_instances(gltf)[0]
+    restored = np.hstack([quantized, np.ones((len(quantized), 1))]).dot(matrix.T)[:, :3]
+    expected = positions + np.array([1.0, 2.0, 3.0])
+    distances = np.linalg.norm(restored[:, np.newaxis] - expected[np.newaxis], axis=2).min(axis=1)
+    assert distances.max() <= 10.0 / 4095